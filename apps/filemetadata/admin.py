@@ -1,12 +1,50 @@
-from django.contrib import admin
-from apps.filemetadata.models import MetadataSchema, FileMetadata
+from django.contrib import admin, messages
+from django.contrib.admin.views.main import ChangeList
+from apps.filemetadata.models import MetadataSchema, FileMetadata, SchemaRevalidationReport
+from apps.filemetadata.metadata_search import filter_metadata_query
+from apps.filemetadata.metadata_history import save_metadata_version
 from apps.filemetadata.admin_forms import FileMetadataForm
 
-class MetadataSchemaAdmin(admin.ModelAdmin):
+# Large JSON columns of MetadataSchema, never shown on the list pages
+SCHEMA_JSON_COLUMNS = ['schema', 'schema_json', 'schema_json_pretty', 'schema_jsonb',\
+    'schema_json_gzip', 'schema_json_pretty_gzip', 'schema_json_br', 'schema_json_pretty_br',\
+    'schema_precheck']
+
+
+class DeferredColumnsChangeList(ChangeList):
+    """
+    Changelist that doesn't fetch the admin's "changelist_deferred_fields"
+    """
+    def get_queryset(self, request):
+        queryset = super(DeferredColumnsChangeList, self).get_queryset(request)
+        return queryset.defer(*self.model_admin.changelist_deferred_fields)
+
+
+class DeferredColumnsAdmin(admin.ModelAdmin):
+    """
+    ModelAdmin whose list page skips the "changelist_deferred_fields" columns.
+    The change form still loads every column.
+    """
+    changelist_deferred_fields = []
+
+    def get_changelist(self, request, **kwargs):
+        return DeferredColumnsChangeList
+
+
+class SchemaListFilter(admin.RelatedFieldListFilter):
+    """
+    Schema filter choices without loading the schema JSON
+    """
+    def field_choices(self, field, request, model_admin):
+        return [(x.id, str(x)) for x in MetadataSchema.objects.only('id', 'title', 'version')]
+
+
+class MetadataSchemaAdmin(DeferredColumnsAdmin):
     """
     For the JSON schema, only checks if JSON
     can be turned into a valid python dict
     """
+    changelist_deferred_fields = SCHEMA_JSON_COLUMNS
     save_on_top = True
     list_display = ['title', 'slug', 'version', 'published', 'contributor',\
         'description','modified', 'created']
@@ -16,14 +54,66 @@ class MetadataSchemaAdmin(admin.ModelAdmin):
 admin.site.register(MetadataSchema, MetadataSchemaAdmin)
 
 
-class FileMetadataAdmin(admin.ModelAdmin):
+class FileMetadataAdmin(DeferredColumnsAdmin):
     """
-    Includes validation of the metadata against the selected schema
+    Includes validation of the metadata against the selected schema.
+    Edited metadata is saved as a new version, keeping the history
+    (see metadata_history.py).
+
+    The search box also takes metadata content queries:
+        /instrument/name=X
+        {"instrument": {"name": "X"}}
     """
     form = FileMetadataForm
     save_on_top = True
     readonly_fields = ['modified', 'created',  'schema_link', 'view_schema']
     list_display = ['schema', 'datafile_id', 'version', 'published', 'schema_link', 'modified', 'created']
+    list_select_related = ['schema']
+    changelist_deferred_fields = ['metadata', 'metadata_jsonb'] +\
+        ['schema__%s' % x for x in SCHEMA_JSON_COLUMNS]
     search_fields = ['schema__title',]
-    list_filter = ['published', 'schema',]
+    list_filter = ['published', ('schema', SchemaListFilter)]
+
+    def get_search_results(self, request, queryset, search_term):
+        if search_term.strip()[:1] in ('/', '{'):
+            try:
+                return filter_metadata_query(queryset, search_term), False
+            except ValueError as err:
+                self.message_user(request, str(err), level=messages.ERROR)
+                return queryset.none(), False
+
+        return super(FileMetadataAdmin, self).get_search_results(request, queryset, search_term)
+
+    def get_readonly_fields(self, request, obj=None):
+        readonly_fields = super(FileMetadataAdmin, self).get_readonly_fields(request, obj)
+        if obj is None:
+            return readonly_fields
+        # set by save_metadata_version()
+        return list(readonly_fields) + ['version']
+
+    def save_model(self, request, obj, form, change):
+        if change and 'metadata' in form.changed_data:
+            version = obj.version
+            save_metadata_version(obj, obj.metadata)
+            if obj.version != version:
+                return
+        super(FileMetadataAdmin, self).save_model(request, obj, form, change)
 admin.site.register(FileMetadata, FileMetadataAdmin)
+
+
+class SchemaRevalidationReportAdmin(DeferredColumnsAdmin):
+    """
+    Made by the revalidation tasks, read only
+    """
+    list_display = ['schema', 'status', 'num_checked', 'num_invalid', 'num_chunks',\
+        'created', 'finished']
+    list_select_related = ['schema']
+    changelist_deferred_fields = ['invalid_samples'] +\
+        ['schema__%s' % x for x in SCHEMA_JSON_COLUMNS]
+    list_filter = ['status', ('schema', SchemaListFilter)]
+    readonly_fields = ['schema', 'schema_hash', 'status', 'num_chunks', 'num_checked',\
+        'num_invalid', 'invalid_samples', 'finished', 'modified', 'created']
+
+    def has_add_permission(self, request):
+        return False
+admin.site.register(SchemaRevalidationReport, SchemaRevalidationReportAdmin)
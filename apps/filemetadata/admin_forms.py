@@ -1,6 +1,7 @@
 from django import forms
 from apps.filemetadata.models import FileMetadata
 from apps.filemetadata.utils import validate_filemetadata
+from apps.filemetadata.metadata_history import check_next_version_free, VersionTakenError
 
 class FileMetadataForm(forms.ModelForm):
 
@@ -12,7 +13,8 @@ class FileMetadataForm(forms.ModelForm):
         schema = self.cleaned_data.get('schema')
         metadata = self.cleaned_data.get('metadata')
 
-        success, err_msg = validate_filemetadata(schema.get_schema_dict(), metadata)
+        success, err_msg = validate_filemetadata(schema.get_schema_dict(), metadata,\
+                                    cache_key=schema.get_validator_cache_key())
         if not success:
             if err_msg:
                 user_msg = err_msg
@@ -21,6 +23,14 @@ class FileMetadataForm(forms.ModelForm):
             self.add_error('metadata', user_msg)
             #raise forms.ValidationError('The metadata does no comply with the schema.')
 
+        # an edit is saved as the next version (FileMetadataAdmin.save_model)
+        if self.instance.pk and 'metadata' in self.changed_data and schema:
+            try:
+                check_next_version_free(self.instance.pk, schema.id,\
+                                    self.cleaned_data.get('datafile_id'), self.instance.version)
+            except VersionTakenError as err:
+                self.add_error('metadata', str(err))
+
         return self.cleaned_data
 
         #return self.cleaned_data
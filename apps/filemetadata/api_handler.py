@@ -0,0 +1,88 @@
+"""
+WSGI handler for the read-only schema API hot paths
+
+    GET  /api/metadata/schema/<slug>[/<version>], /api/metadata/schema-list
+    POST /api/metadata/schema/<slug>/<version>/validate[-batch]
+
+The views only read published schemas (from the SCHEMA_REGISTRY) and
+validate the posted JSON with apps.filemetadata.utils, so the handler
+skips what the full site (config/wsgi.py) does for every request:
+    - the MIDDLEWARE_CLASSES: sessions, CSRF, auth/allauth and messages.
+      Only settings.SCHEMA_API_MIDDLEWARE_CLASSES are used (by default
+      the SecurityMiddleware, for HTTPS redirects and HSTS).
+    - the transaction around each view from ATOMIC_REQUESTS
+    - every URL other than urls_api.py, e.g. the admin
+
+Same settings, same database connections (closed by the
+request_started/request_finished signals as usual) and the same URLs,
+so reverse() gives the usual paths.
+"""
+from django.conf import settings
+from django.core.exceptions import MiddlewareNotUsed
+from django.core.handlers.wsgi import WSGIHandler
+from django.utils.module_loading import import_string
+
+SCHEMA_API_URLCONF = 'apps.filemetadata.urls_api'
+
+DEFAULT_SCHEMA_API_MIDDLEWARE_CLASSES = (
+    'django.middleware.security.SecurityMiddleware',
+)
+
+
+class SchemaAPIHandler(WSGIHandler):
+    """
+    WSGIHandler with its own short middleware list and URLconf, and no ATOMIC_REQUESTS
+    """
+    urlconf = SCHEMA_API_URLCONF
+
+    def get_middleware_classes(self):
+        return getattr(settings, 'SCHEMA_API_MIDDLEWARE_CLASSES',\
+                    DEFAULT_SCHEMA_API_MIDDLEWARE_CLASSES)
+
+    def load_middleware(self):
+        """
+        As BaseHandler.load_middleware, with get_middleware_classes()
+        instead of settings.MIDDLEWARE_CLASSES
+        """
+        self._view_middleware = []
+        self._template_response_middleware = []
+        self._response_middleware = []
+        self._exception_middleware = []
+
+        request_middleware = []
+        for middleware_path in self.get_middleware_classes():
+            try:
+                mw_instance = import_string(middleware_path)()
+            except MiddlewareNotUsed:
+                continue
+
+            if hasattr(mw_instance, 'process_request'):
+                request_middleware.append(mw_instance.process_request)
+            if hasattr(mw_instance, 'process_view'):
+                self._view_middleware.append(mw_instance.process_view)
+            if hasattr(mw_instance, 'process_template_response'):
+                self._template_response_middleware.insert(0, mw_instance.process_template_response)
+            if hasattr(mw_instance, 'process_response'):
+                self._response_middleware.insert(0, mw_instance.process_response)
+            if hasattr(mw_instance, 'process_exception'):
+                self._exception_middleware.insert(0, mw_instance.process_exception)
+
+        # set last: it marks the middleware as loaded
+        self._request_middleware = request_middleware
+
+    def make_view_atomic(self, view):
+        # read-only views: no transaction per request
+        return view
+
+    def get_response(self, request):
+        request.urlconf = self.urlconf
+        return super(SchemaAPIHandler, self).get_response(request)
+
+
+def get_schema_api_application():
+    """
+    As django.core.wsgi.get_wsgi_application, for the SchemaAPIHandler
+    """
+    import django
+    django.setup()
+    return SchemaAPIHandler()
@@ -2,4 +2,10 @@ from django.apps import AppConfig
 
 
 class FilemetadataConfig(AppConfig):
-    name = 'filemetadata'
+    name = 'apps.filemetadata'
+    label = 'filemetadata'
+
+    def ready(self):
+        # connects the post_save/post_delete receivers
+        import apps.filemetadata.schema_registry
+        import apps.filemetadata.response_cache
@@ -0,0 +1,194 @@
+"""
+Streaming export of FileMetadata as NDJSON or CSV, used by the
+export API and "manage.py export_filemetadata"
+
+Each record has the fields read by bulk_import, so an export can be
+imported again:
+    id, schema, schema_version, datafile_id, version, published, modified, metadata
+
+Rows are read in primary key order, one chunk at a time (keyset
+pagination on id), and written as they are read.  Memory use stays the
+same however many rows are exported.
+"""
+import csv
+import io
+import json
+import zlib
+from collections import OrderedDict
+from decimal import Decimal, InvalidOperation
+from django.conf import settings
+from django.utils import timezone
+from django.utils.dateparse import parse_datetime, parse_date
+from apps.filemetadata.models import FileMetadata
+
+EXPORT_FORMAT_NDJSON = 'ndjson'
+EXPORT_FORMAT_CSV = 'csv'
+EXPORT_FORMATS = [EXPORT_FORMAT_NDJSON, EXPORT_FORMAT_CSV]
+
+EXPORT_CONTENT_TYPES = {EXPORT_FORMAT_NDJSON: 'application/x-ndjson',\
+                        EXPORT_FORMAT_CSV: 'text/csv'}
+
+# rows read per query
+EXPORT_CHUNK_SIZE = 2000
+
+# bytes collected before they're (compressed and) written
+EXPORT_BLOCK_SIZE = 64 * 1024
+
+EXPORT_COLUMNS = ['id', 'schema', 'schema_version', 'datafile_id', 'version',\
+    'published', 'modified', 'metadata']
+EXPORT_DB_COLUMNS = ['id', 'schema__slug', 'schema__version', 'datafile_id', 'version',\
+    'published', 'modified', 'metadata']
+
+ERR_MSG_BAD_MODIFIED_SINCE = 'The "modified_since" must be a date or datetime, e.g. "2016-07-18" or "2016-07-18T17:00:00Z"'
+ERR_MSG_BAD_SCHEMA_VERSION = 'The "schema_version" must be a number'
+ERR_MSG_BAD_EXPORT_FORMAT = 'The "format" must be one of: %s' % ', '.join(EXPORT_FORMATS)
+
+
+def parse_modified_since(modified_since):
+    """
+    datetime for a date or datetime string, raise ValueError if it's invalid
+    """
+    if modified_since is None:
+        return None
+    try:
+        parsed = parse_datetime(modified_since)
+        if parsed is None:
+            parsed_date = parse_date(modified_since)
+            if parsed_date is None:
+                raise ValueError(ERR_MSG_BAD_MODIFIED_SINCE)
+            parsed = parse_datetime(parsed_date.isoformat() + 'T00:00:00')
+    except ValueError:
+        raise ValueError(ERR_MSG_BAD_MODIFIED_SINCE)
+
+    if settings.USE_TZ and timezone.is_naive(parsed):
+        parsed = timezone.make_aware(parsed, timezone.get_default_timezone())
+    return parsed
+
+
+def get_export_queryset(schema=None, schema_version=None, installation=None, modified_since=None,\
+    include_unpublished=False):
+    """
+    FileMetadata to export (published ones unless "include_unpublished"),
+    optionally limited to:
+        - a schema slug (and version)
+        - a Dataverse installation (only scans its partition, see partitioning.py)
+        - rows modified at or after "modified_since" (a datetime)
+    """
+    fm_qs = FileMetadata.objects.all()
+    if not include_unpublished:
+        fm_qs = fm_qs.filter(published=True)
+    if schema:
+        fm_qs = fm_qs.filter(schema__slug=schema)
+    if schema_version:
+        try:
+            fm_qs = fm_qs.filter(schema__version=Decimal(str(schema_version)))
+        except InvalidOperation:
+            raise ValueError(ERR_MSG_BAD_SCHEMA_VERSION)
+    if installation:
+        fm_qs = fm_qs.filter(dataverse_installation_id=installation)
+    if modified_since:
+        fm_qs = fm_qs.filter(modified__gte=modified_since)
+    return fm_qs
+
+
+def iter_export_rows(fm_qs, chunk_size=EXPORT_CHUNK_SIZE):
+    """
+    Yield value tuples (EXPORT_DB_COLUMNS) in id order, one query per chunk
+    """
+    last_id = 0
+    while True:
+        rows = list(fm_qs.filter(id__gt=last_id)\
+                        .order_by('id')\
+                        .values_list(*EXPORT_DB_COLUMNS)[:chunk_size])
+        for row in rows:
+            yield row
+        if len(rows) < chunk_size:
+            return
+        last_id = rows[-1][0]
+
+
+def get_metadata_json(metadata):
+    """
+    JSON text of the metadata on one line.
+    values_list() returns the stored text, which is used as is.
+    """
+    if isinstance(metadata, str) and '\n' not in metadata:
+        return metadata
+    if isinstance(metadata, str):
+        metadata = json.loads(metadata, object_pairs_hook=OrderedDict)
+    return json.dumps(metadata)
+
+
+def iter_ndjson_lines(rows):
+    for row in rows:
+        record = OrderedDict(zip(EXPORT_COLUMNS[:-1], row[:-1]))
+        record['schema_version'] = float(record['schema_version'])
+        record['modified'] = record['modified'].isoformat()
+        # splice in the stored metadata text instead of decoding it
+        yield '%s,"metadata":%s}\n' % (json.dumps(record)[:-1], get_metadata_json(row[-1]))
+
+
+def iter_csv_lines(rows):
+    line_buffer = io.StringIO()
+    writer = csv.writer(line_buffer)
+
+    def pop_line(values):
+        writer.writerow(values)
+        line = line_buffer.getvalue()
+        line_buffer.seek(0)
+        line_buffer.truncate()
+        return line
+
+    yield pop_line(EXPORT_COLUMNS)
+    for row in rows:
+        fm_id, slug, schema_version, datafile_id, version, published, modified, metadata = row
+        yield pop_line([fm_id, slug, schema_version, datafile_id, version,\
+                        'true' if published else 'false', modified.isoformat(),\
+                        get_metadata_json(metadata)])
+
+
+def iter_export_blocks(lines, use_gzip=False, block_size=EXPORT_BLOCK_SIZE):
+    """
+    Join text lines into UTF-8 blocks of about "block_size" bytes,
+    gzip compressed if "use_gzip" is True
+    """
+    compressor = zlib.compressobj(6, zlib.DEFLATED, 16 + zlib.MAX_WBITS) if use_gzip else None
+
+    def encode(block):
+        if compressor is None:
+            return block
+        return compressor.compress(block)
+
+    pending = []
+    pending_size = 0
+    for line in lines:
+        encoded_line = line.encode('utf-8')
+        pending.append(encoded_line)
+        pending_size += len(encoded_line)
+        if pending_size >= block_size:
+            block = encode(b''.join(pending))
+            pending = []
+            pending_size = 0
+            if block:
+                yield block
+
+    block = encode(b''.join(pending))
+    if compressor is not None:
+        block += compressor.flush()
+    if block:
+        yield block
+
+
+def iter_export(fm_qs, export_format=EXPORT_FORMAT_NDJSON, use_gzip=False):
+    """
+    Bytes of the export, produced as the rows are read
+    """
+    if export_format not in EXPORT_FORMATS:
+        raise ValueError(ERR_MSG_BAD_EXPORT_FORMAT)
+
+    rows = iter_export_rows(fm_qs)
+    if export_format == EXPORT_FORMAT_CSV:
+        lines = iter_csv_lines(rows)
+    else:
+        lines = iter_ndjson_lines(rows)
+    return iter_export_blocks(lines, use_gzip)
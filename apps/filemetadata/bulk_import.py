@@ -0,0 +1,292 @@
+"""
+Bulk import of FileMetadata from NDJSON or CSV, used by
+"manage.py import_filemetadata"
+
+Each record has:
+    - schema: MetadataSchema slug
+    - schema_version: optional, the latest version is used if it's missing
+    - datafile_id
+    - version: optional, default 1
+    - published: optional, default true
+    - metadata: JSON object (JSON text in a CSV column)
+
+Records are read as a stream, one batch at a time.  Each batch is
+validated in a process pool and its valid records are written with
+bulk_create() in a single transaction.  Rejected records are written,
+with their error messages, to an NDJSON error file.
+"""
+import csv
+import json
+from collections import OrderedDict
+from decimal import Decimal, InvalidOperation
+from multiprocessing import Pool
+from django.db import transaction
+from apps.filemetadata.models import MetadataSchema, FileMetadata
+from apps.filemetadata.utils import validate_filemetadata
+
+IMPORT_FORMAT_NDJSON = 'ndjson'
+IMPORT_FORMAT_CSV = 'csv'
+IMPORT_FORMATS = [IMPORT_FORMAT_NDJSON, IMPORT_FORMAT_CSV]
+
+DEFAULT_BATCH_SIZE = 1000
+
+# records sent to a worker at a time
+VALIDATION_CHUNK_SIZE = 100
+
+ERR_MSG_RECORD_INVALID_JSON = 'The record is not valid JSON'
+ERR_MSG_RECORD_NOT_OBJECT = 'The record is not a JSON object'
+ERR_MSG_NO_SCHEMA = 'The record has no "schema"'
+ERR_MSG_SCHEMA_NOT_FOUND = 'Schema not found: %s (version: %s)'
+ERR_MSG_BAD_SCHEMA_VERSION = 'The "schema_version" must be a number'
+ERR_MSG_BAD_DATAFILE_ID = 'The "datafile_id" must be an integer'
+ERR_MSG_BAD_VERSION = 'The "version" must be an integer'
+ERR_MSG_BAD_PUBLISHED = 'The "published" must be true or false'
+ERR_MSG_METADATA_INVALID_JSON = 'The "metadata" is not valid JSON'
+ERR_MSG_METADATA_NOT_OBJECT = 'The "metadata" must be a JSON object'
+ERR_MSG_DUPLICATE = 'File metadata for this schema, datafile_id and version already exists'
+
+
+def read_ndjson_records(stream):
+    """
+    Yield (line number, record, error message or None) for each non-blank line.
+    Lines that can't be read are returned as text with an error message.
+    """
+    for line_num, line in enumerate(stream, 1):
+        if not line.strip():
+            continue
+        try:
+            record = json.loads(line, object_pairs_hook=OrderedDict)
+        except ValueError:
+            yield line_num, line.rstrip('\r\n'), ERR_MSG_RECORD_INVALID_JSON
+            continue
+        if not isinstance(record, dict):
+            yield line_num, record, ERR_MSG_RECORD_NOT_OBJECT
+            continue
+        yield line_num, record, None
+
+
+def read_csv_records(stream):
+    """
+    Yield (line number, record, error message or None) for each CSV row.
+    The "metadata" column holds JSON text.
+    """
+    reader = csv.DictReader(stream)
+    for record in reader:
+        line_num = reader.line_num
+        metadata = record.get('metadata')
+        if metadata:
+            try:
+                record['metadata'] = json.loads(metadata, object_pairs_hook=OrderedDict)
+            except ValueError:
+                yield line_num, record, ERR_MSG_METADATA_INVALID_JSON
+                continue
+        yield line_num, record, None
+
+
+def read_records(stream, import_format):
+    if import_format == IMPORT_FORMAT_CSV:
+        return read_csv_records(stream)
+    return read_ndjson_records(stream)
+
+
+def parse_bool(value):
+    if isinstance(value, bool):
+        return value
+    if isinstance(value, str) and value.strip().lower() in ('true', '1', 'yes'):
+        return True
+    if isinstance(value, str) and value.strip().lower() in ('false', '0', 'no'):
+        return False
+    raise ValueError(ERR_MSG_BAD_PUBLISHED)
+
+
+def parse_int(value, err_msg):
+    if isinstance(value, bool):
+        raise ValueError(err_msg)
+    try:
+        if isinstance(value, float) and not value.is_integer():
+            raise ValueError(err_msg)
+        return int(value)
+    except (TypeError, ValueError):
+        raise ValueError(err_msg)
+
+
+def validate_chunk(chunk):
+    """
+    Validate a chunk of metadata against one schema, run in the worker processes.
+    "chunk" is (cache key, schema dict, [(line number, metadata), ...]).
+
+    Returns [(line number, error messages or None), ...]
+    """
+    cache_key, schema_dict, items = chunk
+    results = []
+    for line_num, metadata in items:
+        success, err_msgs = validate_filemetadata(schema_dict, metadata, cache_key=cache_key)
+        results.append((line_num, None if success else err_msgs))
+    return results
+
+
+class FileMetadataImporter(object):
+    """
+    Import FileMetadata records, see the module docstring
+    """
+    def __init__(self, error_stream, batch_size=DEFAULT_BATCH_SIZE, workers=None,\
+                default_schema=None, default_schema_version=None):
+        """
+        "workers": number of validation processes.  1 validates in this process,
+            None uses one per CPU.
+        "default_schema", "default_schema_version": used by records without a "schema"
+        """
+        self.error_stream = error_stream
+        self.batch_size = batch_size
+        self.workers = workers
+        self.default_schema = default_schema
+        self.default_schema_version = default_schema_version
+
+        # (slug, version) -> MetadataSchema or None
+        self.schemas = {}
+
+        self.num_imported = 0
+        self.num_rejected = 0
+
+    def reject(self, line_num, record, err_msgs):
+        self.num_rejected += 1
+        self.error_stream.write(json.dumps(OrderedDict([('line', line_num),\
+                                                    ('errors', err_msgs),\
+                                                    ('record', record)])) + '\n')
+
+    def get_schema(self, slug, version):
+        """
+        MetadataSchema for a slug and version (the latest if version is None), looked up once
+        """
+        schema_key = (slug, version)
+        if schema_key not in self.schemas:
+            schema_qs = MetadataSchema.objects.filter(slug=slug)
+            if version is not None:
+                schema_qs = schema_qs.filter(version=version)
+            self.schemas[schema_key] = schema_qs.order_by('-version').first()
+        return self.schemas[schema_key]
+
+    def build_filemetadata(self, record):
+        """
+        Unsaved FileMetadata for a record, raise ValueError if the record is incomplete
+        """
+        slug = record.get('schema') or self.default_schema
+        if not slug:
+            raise ValueError(ERR_MSG_NO_SCHEMA)
+
+        version = record.get('schema_version') or self.default_schema_version
+        if version is not None:
+            try:
+                version = Decimal(str(version))
+            except InvalidOperation:
+                raise ValueError(ERR_MSG_BAD_SCHEMA_VERSION)
+
+        mschema = self.get_schema(slug, version)
+        if mschema is None:
+            raise ValueError(ERR_MSG_SCHEMA_NOT_FOUND % (slug, version or 'latest'))
+
+        metadata = record.get('metadata')
+        if not isinstance(metadata, dict):
+            raise ValueError(ERR_MSG_METADATA_NOT_OBJECT)
+
+        published = record.get('published')
+        return FileMetadata(schema=mschema,\
+                        datafile_id=parse_int(record.get('datafile_id'), ERR_MSG_BAD_DATAFILE_ID),\
+                        version=parse_int(record.get('version') or 1, ERR_MSG_BAD_VERSION),\
+                        published=True if published in (None, '') else parse_bool(published),\
+                        metadata=metadata)
+
+    def get_existing_keys(self, fm_objects):
+        """
+        (schema_id, datafile_id, version) of the batch already in the database
+        """
+        existing_keys = set()
+        chunk_size = FileMetadata.BULK_ID_LOOKUP_SIZE
+        for start in range(0, len(fm_objects), chunk_size):
+            fm_chunk = fm_objects[start:start + chunk_size]
+            existing_keys.update(FileMetadata.objects\
+                .filter(schema_id__in=set(x.schema_id for x in fm_chunk),\
+                        datafile_id__in=set(x.datafile_id for x in fm_chunk),\
+                        version__in=set(x.version for x in fm_chunk))\
+                .values_list('schema_id', 'datafile_id', 'version'))
+        return existing_keys
+
+    def validate_batch(self, pool, batch):
+        """
+        Return {line number: error messages} for the batch's invalid metadata.
+        "batch" is [(line number, record, FileMetadata), ...]
+        """
+        # schema id -> (MetadataSchema, [(line number, metadata), ...])
+        by_schema = OrderedDict()
+        for line_num, _record, fm in batch:
+            by_schema.setdefault(fm.schema.id, (fm.schema, []))[1].append((line_num, fm.metadata))
+
+        chunks = []
+        for mschema, items in by_schema.values():
+            for start in range(0, len(items), VALIDATION_CHUNK_SIZE):
+                chunks.append((mschema.get_validator_cache_key(), mschema.get_schema_dict(),\
+                            items[start:start + VALIDATION_CHUNK_SIZE]))
+
+        if pool is None:
+            chunk_results = map(validate_chunk, chunks)
+        else:
+            chunk_results = pool.map(validate_chunk, chunks)
+
+        return dict((line_num, err_msgs)\
+                    for results in chunk_results\
+                    for line_num, err_msgs in results if err_msgs)
+
+    def import_batch(self, pool, batch):
+        """
+        Validate a batch and write its valid records in one transaction
+        """
+        invalid = self.validate_batch(pool, batch)
+        existing_keys = self.get_existing_keys([fm for _l, _r, fm in batch])
+
+        fm_objects = []
+        for line_num, record, fm in batch:
+            fm_key = (fm.schema.id, fm.datafile_id, fm.version)
+            if line_num in invalid:
+                self.reject(line_num, record, invalid[line_num])
+            elif fm_key in existing_keys:
+                self.reject(line_num, record, [ERR_MSG_DUPLICATE])
+            else:
+                # also catches duplicates within the input
+                existing_keys.add(fm_key)
+                fm_objects.append(fm)
+
+        with transaction.atomic():
+            FileMetadata.bulk_create_indexed(fm_objects)
+        self.num_imported += len(fm_objects)
+
+    def run(self, records):
+        """
+        Import (line number, record, error message) tuples from read_records()
+        """
+        pool = None
+        if self.workers != 1:
+            pool = Pool(self.workers)
+
+        try:
+            batch = []
+            for line_num, record, err_msg in records:
+                if err_msg is None:
+                    try:
+                        batch.append((line_num, record, self.build_filemetadata(record)))
+                    except ValueError as err:
+                        err_msg = str(err)
+                if err_msg is not None:
+                    self.reject(line_num, record, [err_msg])
+
+                if len(batch) >= self.batch_size:
+                    self.import_batch(pool, batch)
+                    batch = []
+
+            if batch:
+                self.import_batch(pool, batch)
+        finally:
+            if pool is not None:
+                pool.close()
+                pool.join()
+
+        return self.num_imported, self.num_rejected
@@ -0,0 +1,83 @@
+"""
+Precompressed variants of the stored schema JSON
+
+MetadataSchema.save() compresses the compact and indented JSON once,
+with gzip and, if the optional "brotli" package is installed, brotli.
+The schema views then pick a variant from the request's Accept-Encoding
+instead of compressing on each request.
+"""
+import zlib
+
+try:
+    import brotli
+except ImportError:     # optional: pip install brotli
+    brotli = None
+
+ENCODING_GZIP = 'gzip'
+ENCODING_BROTLI = 'br'
+
+# tried in this order when the client accepts several equally
+PREFERRED_ENCODINGS = (ENCODING_BROTLI, ENCODING_GZIP)
+
+GZIP_LEVEL = 9
+BROTLI_QUALITY = 11
+
+
+def gzip_compress(data):
+    """
+    gzip data without a timestamp, so the same JSON gives the same bytes
+    """
+    compressor = zlib.compressobj(GZIP_LEVEL, zlib.DEFLATED, 16 + zlib.MAX_WBITS)
+    return compressor.compress(data) + compressor.flush()
+
+
+def compress_variants(text):
+    """
+    {encoding: compressed bytes} of a text, for every available encoding
+    """
+    data = text.encode('utf-8')
+    variants = {ENCODING_GZIP: gzip_compress(data)}
+    if brotli is not None:
+        variants[ENCODING_BROTLI] = brotli.compress(data, quality=BROTLI_QUALITY)
+    return variants
+
+
+def parse_accept_encoding(accept_encoding):
+    """
+    {coding: q-value} of an Accept-Encoding header, e.g.
+    "gzip, br;q=0.5" -> {'gzip': 1.0, 'br': 0.5}
+    """
+    qvalues = {}
+    for part in accept_encoding.split(','):
+        params = [x.strip() for x in part.split(';')]
+        coding = params[0].lower()
+        if not coding:
+            continue
+        qvalue = 1.0
+        for param in params[1:]:
+            if param.lower().startswith('q='):
+                try:
+                    qvalue = float(param[2:])
+                except ValueError:
+                    qvalue = 0.0
+        qvalues[coding] = qvalue
+    return qvalues
+
+
+def choose_encoding(accept_encoding, available_encodings):
+    """
+    The best of the available encodings for an Accept-Encoding
+    header, or None to send the uncompressed bytes
+    """
+    if not accept_encoding or not available_encodings:
+        return None
+    qvalues = parse_accept_encoding(accept_encoding)
+
+    best_encoding, best_qvalue = None, 0.0
+    for encoding in PREFERRED_ENCODINGS:
+        if encoding not in available_encodings:
+            continue
+        qvalue = qvalues.get(encoding, qvalues.get('*', 0.0))
+        if qvalue > best_qvalue:
+            best_encoding, best_qvalue = encoding, qvalue
+    return best_encoding
@@ -0,0 +1,192 @@
+"""
+Model fields for JSON stored natively by PostgreSQL
+
+The jsonfield.JSONField columns stay the ordered copy of each document
+(jsonb doesn't keep key order).  JSONBField columns hold the same document
+as native jsonb so PostgreSQL can filter, index and project into it.
+
+LazyJSONField is a jsonfield.JSONField that keeps the text loaded from the
+database and only decodes it when the attribute is first read.
+
+Lookups (PostgreSQL only):
+    - metadata_jsonb__jsonb_contains={"instrument": "X"}
+        containment (@>), uses the GIN index
+    - metadata_jsonb__jsonb_path_equals=(['instrument', 'name'], "X")
+        value at a path (#>) equals a JSON value
+"""
+import json
+from django.conf import settings
+from django.db import models
+from django.db.models import Lookup
+from django.forms.utils import ValidationError
+from jsonfield import JSONField
+from jsonfield.encoder import JSONEncoder
+
+ERR_MSG_JSONB_POSTGRESQL_ONLY = 'jsonb lookups are only available on PostgreSQL'
+
+
+class JSONBField(models.Field):
+    """
+    JSON stored as "jsonb" on PostgreSQL and as text on other databases
+    (e.g. sqlite for local development)
+    """
+    description = 'JSON (jsonb on PostgreSQL)'
+
+    def db_type(self, connection):
+        if connection.vendor == 'postgresql':
+            return 'jsonb'
+        return 'text'
+
+    def from_db_value(self, value, expression, connection, context):
+        # psycopg2 already decodes jsonb columns
+        if value is None or not isinstance(value, str):
+            return value
+        return json.loads(value)
+
+    def to_python(self, value):
+        if isinstance(value, str):
+            return json.loads(value)
+        return value
+
+    def get_prep_value(self, value):
+        if value is None:
+            return None
+        return json.dumps(value, cls=JSONEncoder, separators=(',', ':'))
+
+    def value_to_string(self, obj):
+        # used by the serializers (dumpdata, fixtures)
+        return self.get_prep_value(self.value_from_object(obj))
+
+
+class RawJSON(object):
+    """
+    JSON text loaded from the database that hasn't been decoded yet
+    """
+    __slots__ = ('text',)
+
+    def __init__(self, text):
+        self.text = text
+
+    def __getstate__(self):
+        return self.text
+
+    def __setstate__(self, state):
+        self.text = state
+
+
+class LazyJSONDescriptor(object):
+    """
+    Model attribute of a LazyJSONField.
+    Text from the database is stored as RawJSON and decoded on first read.
+    """
+    def __init__(self, field):
+        self.field = field
+
+    def __get__(self, obj, type=None):
+        if obj is None:
+            raise AttributeError('Can only be accessed via an instance.')
+        value = obj.__dict__[self.field.name]
+        if isinstance(value, RawJSON):
+            value = self.field.decode(value.text)
+            obj.__dict__[self.field.name] = value
+        return value
+
+    def __set__(self, obj, value):
+        if isinstance(value, str) and obj._state.adding\
+            and getattr(obj, 'pk', None) is not None:
+            # being loaded from the database, the same
+            # test as jsonfield's JSONFieldBase.pre_init
+            value = RawJSON(value)
+        obj.__dict__[self.field.name] = value
+
+
+class LazyJSONField(JSONField):
+    """
+    JSONField decoded on first access instead of when the row is loaded.
+
+    With settings.JSON_FIELD_PLAIN_DICTS = True, objects are decoded
+    as dicts instead of the field's "object_pairs_hook" (e.g. OrderedDict).
+    dicts keep key order on Python 3.7+ only.
+    """
+    def contribute_lazy_descriptor(self, cls, name, **kwargs):
+        super(LazyJSONField, self).contribute_to_class(cls, name, **kwargs)
+        setattr(cls, self.name, LazyJSONDescriptor(self))
+
+    def get_load_kwargs(self):
+        if getattr(settings, 'JSON_FIELD_PLAIN_DICTS', False):
+            return dict((k, v) for k, v in self.load_kwargs.items()\
+                        if k != 'object_pairs_hook')
+        return self.load_kwargs
+
+    def decode(self, text):
+        try:
+            return json.loads(text, **self.get_load_kwargs())
+        except ValueError:
+            raise ValidationError('Enter valid JSON')
+
+    def pre_save(self, model_instance, add):
+        # save JSON that was never read without decoding it
+        value = model_instance.__dict__.get(self.attname)
+        if isinstance(value, RawJSON):
+            return value
+        return super(LazyJSONField, self).pre_save(model_instance, add)
+
+    def get_db_prep_value(self, value, connection, prepared=False):
+        if isinstance(value, RawJSON):
+            return value.text
+        return super(LazyJSONField, self).get_db_prep_value(value, connection, prepared)
+
+    @staticmethod
+    def get_raw_json(model_instance, field_name):
+        """
+        The JSON text loaded from the database if it hasn't been decoded, else None
+        """
+        value = model_instance.__dict__.get(field_name)
+        if isinstance(value, RawJSON):
+            return value.text
+        return None
+
+# jsonfield's SubfieldBase metaclass wraps a contribute_to_class defined in
+# the class body so that it installs its own (decoding) descriptor last
+LazyJSONField.contribute_to_class = LazyJSONField.contribute_lazy_descriptor
+
+
+class JSONBContains(Lookup):
+    """
+    The column contains the given JSON (PostgreSQL's @> operator)
+    """
+    lookup_name = 'jsonb_contains'
+
+    def get_prep_lookup(self):
+        return self.lhs.output_field.get_prep_value(self.rhs)
+
+    def as_sql(self, compiler, connection):
+        if connection.vendor != 'postgresql':
+            raise NotImplementedError(ERR_MSG_JSONB_POSTGRESQL_ONLY)
+
+        lhs, lhs_params = self.process_lhs(compiler, connection)
+        return '%s @> %%s::jsonb' % lhs, lhs_params + [self.rhs]
+JSONBField.register_lookup(JSONBContains)
+
+
+class JSONBPathEquals(Lookup):
+    """
+    The value at a path equals the given JSON (PostgreSQL's #> operator).
+    The right hand side is (list of path parts, value)
+    """
+    lookup_name = 'jsonb_path_equals'
+
+    def get_prep_lookup(self):
+        path, value = self.rhs
+        return [str(x) for x in path], self.lhs.output_field.get_prep_value(value)
+
+    def as_sql(self, compiler, connection):
+        if connection.vendor != 'postgresql':
+            raise NotImplementedError(ERR_MSG_JSONB_POSTGRESQL_ONLY)
+
+        lhs, lhs_params = self.process_lhs(compiler, connection)
+        path, value = self.rhs
+        if not path:
+            return '%s = %%s::jsonb' % lhs, lhs_params + [value]
+        return '%s #> %%s = %%s::jsonb' % lhs, lhs_params + [path, value]
+JSONBField.register_lookup(JSONBPathEquals)
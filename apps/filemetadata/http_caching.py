@@ -0,0 +1,53 @@
+"""
+Cache-Control lifetimes of the schema API responses
+
+    - a published schema version, /api/metadata/schema/<slug>/<version>,
+      never changes: "public, immutable" for SCHEMA_VERSION_MAX_AGE
+    - the latest version, /api/metadata/schema/<slug>, and the schema
+      list change when a schema is published: kept for a short
+      SCHEMA_LATEST_MAX_AGE / SCHEMA_LIST_MAX_AGE, then revalidated
+      with the ETag
+    - unpublished versions may still be edited: always revalidated
+
+The nginx proxy cache (compose/nginx/nginx.conf) follows these
+headers, so repeat requests are answered without reaching Django.
+"""
+from django.conf import settings
+from django.utils.cache import patch_cache_control
+
+DEFAULT_SCHEMA_VERSION_MAX_AGE = 365 * 24 * 60 * 60     # seconds
+DEFAULT_SCHEMA_LATEST_MAX_AGE = 60
+DEFAULT_SCHEMA_LIST_MAX_AGE = 60
+
+# only successful responses (and their 304s) are cacheable
+CACHEABLE_STATUS_CODES = (200, 304)
+
+
+def patch_cache_lifetime(response, max_age, immutable=False):
+    """
+    Let clients and shared caches keep a response for max_age seconds
+    """
+    if response.status_code not in CACHEABLE_STATUS_CODES:
+        return response
+    if immutable:
+        patch_cache_control(response, public=True, max_age=max_age, immutable=True)
+    else:
+        patch_cache_control(response, public=True, must_revalidate=True, max_age=max_age)
+    return response
+
+
+def patch_schema_version_lifetime(response, published):
+    if published:
+        return patch_cache_lifetime(response, getattr(settings, 'SCHEMA_VERSION_MAX_AGE',\
+                                                DEFAULT_SCHEMA_VERSION_MAX_AGE), immutable=True)
+    return patch_cache_lifetime(response, 0)
+
+
+def patch_latest_schema_lifetime(response):
+    return patch_cache_lifetime(response, getattr(settings, 'SCHEMA_LATEST_MAX_AGE',\
+                                                DEFAULT_SCHEMA_LATEST_MAX_AGE))
+
+
+def patch_schema_list_lifetime(response):
+    return patch_cache_lifetime(response, getattr(settings, 'SCHEMA_LIST_MAX_AGE',\
+                                                DEFAULT_SCHEMA_LIST_MAX_AGE))
@@ -0,0 +1,266 @@
+"""
+JSON Patch (RFC 6902) diff and apply, and JSON Merge Patch (RFC 7396)
+
+    patch = make_json_patch(old_metadata, new_metadata)
+    apply_json_patch(old_metadata, patch) == new_metadata
+
+    apply_merge_patch({'a': 1, 'b': 2}, {'a': None, 'c': 3}) == {'b': 2, 'c': 3}
+
+make_json_patch() only writes "add", "remove" and "replace" operations;
+apply_json_patch() also accepts "move", "copy" and "test".
+Documents are never changed in place.
+"""
+import copy
+from apps.filemetadata.json_pointer import parse_json_pointer, format_json_pointer,\
+    ERR_MSG_BAD_POINTER
+
+ERR_MSG_NOT_A_PATCH = 'A JSON Patch must be an array of operation objects'
+ERR_MSG_BAD_OP = 'Unknown JSON Patch operation: %s'
+ERR_MSG_MISSING_MEMBER = 'The "%s" operation needs a "%s" member'
+ERR_MSG_BAD_POINTER_MEMBER = 'The "%s" member is not a valid JSON pointer. ' + ERR_MSG_BAD_POINTER
+ERR_MSG_BAD_PATH = 'The path "%s" does not exist in the document'
+ERR_MSG_BAD_INDEX = 'The array index in "%s" is not valid'
+ERR_MSG_TEST_FAILED = 'The value at "%s" is not the one tested'
+ERR_MSG_MOVE_INTO_ITSELF = 'Can\'t move "%s" into its own child "%s"'
+
+PATCH_OPS = ['add', 'remove', 'replace', 'move', 'copy', 'test']
+
+
+class JsonPatchError(ValueError):
+    pass
+
+
+class JsonPatchFormatError(JsonPatchError):
+    """
+    The patch itself is malformed, whatever document it's applied to
+    """
+    pass
+
+
+def is_same_json(value1, value2):
+    """
+    JSON equality: unlike ==, True is not 1 (but 1 is 1.0)
+    """
+    if isinstance(value1, bool) or isinstance(value2, bool):
+        return type(value1) == type(value2) and value1 == value2
+    if isinstance(value1, dict) and isinstance(value2, dict):
+        return value1.keys() == value2.keys() and\
+            all(is_same_json(value1[k], value2[k]) for k in value1)
+    if isinstance(value1, list) and isinstance(value2, list):
+        return len(value1) == len(value2) and\
+            all(is_same_json(x, y) for x, y in zip(value1, value2))
+    if isinstance(value1, (dict, list)) or isinstance(value2, (dict, list)):
+        return False
+    return value1 == value2
+
+
+def make_json_patch(source, target, parts=None):
+    """
+    Operations that turn the source document into the target
+    """
+    if parts is None:
+        parts = []
+    path = format_json_pointer(parts)
+
+    if isinstance(source, dict) and isinstance(target, dict):
+        ops = []
+        for key in source:
+            if key not in target:
+                ops.append(dict(op='remove', path=format_json_pointer(parts + [key])))
+        for key, value in target.items():
+            if key in source:
+                ops.extend(make_json_patch(source[key], value, parts + [key]))
+            else:
+                ops.append(dict(op='add', path=format_json_pointer(parts + [key]),\
+                                value=value))
+        return ops
+
+    if isinstance(source, list) and isinstance(target, list):
+        ops = []
+        common_length = min(len(source), len(target))
+        for idx in range(common_length):
+            ops.extend(make_json_patch(source[idx], target[idx], parts + [idx]))
+        # remove from the end so the earlier indexes don't shift
+        for idx in range(len(source) - 1, common_length - 1, -1):
+            ops.append(dict(op='remove', path=format_json_pointer(parts + [idx])))
+        for idx in range(common_length, len(target)):
+            ops.append(dict(op='add', path=format_json_pointer(parts + [idx]),\
+                            value=target[idx]))
+        return ops
+
+    if is_same_json(source, target):
+        return []
+    return [dict(op='replace', path=path, value=target)]
+
+
+def get_array_index(container, part, path, for_add=False):
+    """
+    Index of an array member in a path, "-" is the end of the array when adding
+    """
+    if for_add and part == '-':
+        return len(container)
+    if not part.isdigit() or (len(part) > 1 and part.startswith('0')):
+        raise JsonPatchError(ERR_MSG_BAD_INDEX % path)
+    idx = int(part)
+    if idx > len(container) or (idx == len(container) and not for_add):
+        raise JsonPatchError(ERR_MSG_BAD_INDEX % path)
+    return idx
+
+
+def resolve_parent(document, path):
+    """
+    (parent container, last path part) of a non-empty path
+    """
+    parts = parse_json_pointer(path)
+    parent = document
+    for part in parts[:-1]:
+        if isinstance(parent, dict) and part in parent:
+            parent = parent[part]
+        elif isinstance(parent, list):
+            parent = parent[get_array_index(parent, part, path)]
+        else:
+            raise JsonPatchError(ERR_MSG_BAD_PATH % path)
+    if not isinstance(parent, (dict, list)):
+        raise JsonPatchError(ERR_MSG_BAD_PATH % path)
+    return parent, parts[-1]
+
+
+def get_value(document, path):
+    if path == '':
+        return document
+    parent, part = resolve_parent(document, path)
+    if isinstance(parent, dict):
+        if part not in parent:
+            raise JsonPatchError(ERR_MSG_BAD_PATH % path)
+        return parent[part]
+    return parent[get_array_index(parent, part, path)]
+
+
+def add_value(document, path, value):
+    if path == '':
+        return value
+    parent, part = resolve_parent(document, path)
+    if isinstance(parent, dict):
+        parent[part] = value
+    else:
+        parent.insert(get_array_index(parent, part, path, for_add=True), value)
+    return document
+
+
+def remove_value(document, path):
+    if path == '':
+        raise JsonPatchError(ERR_MSG_BAD_PATH % path)
+    parent, part = resolve_parent(document, path)
+    if isinstance(parent, dict):
+        if part not in parent:
+            raise JsonPatchError(ERR_MSG_BAD_PATH % path)
+        del parent[part]
+    else:
+        del parent[get_array_index(parent, part, path)]
+    return document
+
+
+def replace_value(document, path, value):
+    """
+    Replace an existing value, keeping its place in its object or array
+    """
+    get_value(document, path)
+    if path == '':
+        return value
+    parent, part = resolve_parent(document, path)
+    if isinstance(parent, dict):
+        parent[part] = value
+    else:
+        parent[get_array_index(parent, part, path)] = value
+    return document
+
+
+def get_member(operation, name):
+    if name not in operation:
+        raise JsonPatchFormatError(ERR_MSG_MISSING_MEMBER % (operation.get('op'), name))
+    return operation[name]
+
+
+def get_pointer_member(operation, name):
+    """
+    (pointer, pointer parts) of an operation's "path" or "from" member
+    """
+    pointer = get_member(operation, name)
+    if not isinstance(pointer, str):
+        raise JsonPatchFormatError(ERR_MSG_BAD_POINTER_MEMBER % name)
+    try:
+        return pointer, parse_json_pointer(pointer)
+    except ValueError:
+        raise JsonPatchFormatError(ERR_MSG_BAD_POINTER_MEMBER % name)
+
+
+def check_json_patch(patch):
+    """
+    Raise JsonPatchFormatError unless every operation has a known "op"
+    and valid JSON pointers
+    """
+    if not isinstance(patch, list) or [x for x in patch if not isinstance(x, dict)]:
+        raise JsonPatchFormatError(ERR_MSG_NOT_A_PATCH)
+
+    for operation in patch:
+        op = operation.get('op')
+        if op not in PATCH_OPS:
+            raise JsonPatchFormatError(ERR_MSG_BAD_OP % op)
+        get_pointer_member(operation, 'path')
+        if op in ('move', 'copy'):
+            get_pointer_member(operation, 'from')
+
+
+def apply_json_patch(document, patch):
+    """
+    Return a patched copy of the document.
+    Raise JsonPatchFormatError if the patch is malformed, and
+    JsonPatchError if an operation can't be applied.
+    """
+    check_json_patch(patch)
+
+    document = copy.deepcopy(document)
+    for operation in patch:
+        op = operation['op']
+        path = operation['path']
+
+        if op == 'add':
+            document = add_value(document, path, copy.deepcopy(get_member(operation, 'value')))
+        elif op == 'remove':
+            document = remove_value(document, path)
+        elif op == 'replace':
+            document = replace_value(document, path,\
+                                    copy.deepcopy(get_member(operation, 'value')))
+        elif op == 'test':
+            if not is_same_json(get_value(document, path), get_member(operation, 'value')):
+                raise JsonPatchError(ERR_MSG_TEST_FAILED % path)
+        else:
+            from_path = operation['from']
+            value = copy.deepcopy(get_value(document, from_path))
+            if op == 'move':
+                if path.startswith(from_path + '/'):
+                    raise JsonPatchError(ERR_MSG_MOVE_INTO_ITSELF % (from_path, path))
+                document = remove_value(document, from_path)
+            document = add_value(document, path, value)
+
+    return document
+
+
+def apply_merge_patch(document, patch):
+    """
+    Return a copy of the document with a JSON Merge Patch applied:
+    null members are removed, objects are merged, anything else replaces
+    """
+    if not isinstance(patch, dict):
+        return copy.deepcopy(patch)
+
+    if isinstance(document, dict):
+        document = copy.copy(document)
+    else:
+        document = {}
+    for key, value in patch.items():
+        if value is None:
+            document.pop(key, None)
+        else:
+            document[key] = apply_merge_patch(document.get(key), value)
+    return document
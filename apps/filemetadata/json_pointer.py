@@ -0,0 +1,65 @@
+"""
+JSON pointer (RFC 6901) helpers
+
+Used to index and search the scalar values of FileMetadata.metadata,
+e.g. the pointer "/instrument/name" for {"instrument": {"name": "X"}}
+"""
+import json
+from numbers import Number
+
+ERR_MSG_BAD_POINTER = 'A JSON pointer must be empty or start with "/", e.g. "/instrument/name"'
+
+
+def parse_json_pointer(pointer):
+    """
+    "/a/b~1c" -> ['a', 'b/c']
+    """
+    if pointer == '':
+        return []
+    if not pointer.startswith('/'):
+        raise ValueError(ERR_MSG_BAD_POINTER)
+
+    return [part.replace('~1', '/').replace('~0', '~')\
+            for part in pointer[1:].split('/')]
+
+
+def format_json_pointer(parts):
+    """
+    ['a', 'b/c'] -> "/a/b~1c"
+    """
+    return ''.join('/' + str(part).replace('~', '~0').replace('/', '~1')\
+                for part in parts)
+
+
+def is_json_scalar(value):
+    return value is None or isinstance(value, (str, bool, Number))
+
+
+def encode_index_value(value):
+    """
+    JSON text of a scalar used for equality matching.
+    Integral floats are written as ints so 1 and 1.0 match (as in jsonb).
+    """
+    if isinstance(value, float) and value.is_integer():
+        value = int(value)
+    return json.dumps(value)
+
+
+def flatten_metadata(document, parts=None):
+    """
+    Yield (JSON pointer, encoded value) for every scalar in the document
+    """
+    if parts is None:
+        parts = []
+
+    if isinstance(document, dict):
+        children = document.items()
+    elif isinstance(document, list):
+        children = enumerate(document)
+    else:
+        yield format_json_pointer(parts), encode_index_value(document)
+        return
+
+    for key, child in children:
+        for item in flatten_metadata(child, parts + [key]):
+            yield item
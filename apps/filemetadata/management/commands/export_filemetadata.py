@@ -0,0 +1,53 @@
+"""
+Export FileMetadata as NDJSON or CSV to a file (or stdout)
+
+    python manage.py export_filemetadata filemetadata.ndjson.gz --gzip
+    python manage.py export_filemetadata - --schema example --modified-since 2016-07-18
+
+See apps.filemetadata.bulk_export for the record format
+"""
+import sys
+from django.core.management.base import BaseCommand, CommandError
+from apps.filemetadata.bulk_export import get_export_queryset, parse_modified_since,\
+    iter_export, EXPORT_FORMATS, EXPORT_FORMAT_NDJSON
+
+
+class Command(BaseCommand):
+    help = 'Stream FileMetadata records to NDJSON or CSV'
+
+    def add_arguments(self, parser):
+        parser.add_argument('output',\
+            help='Output file, "-" for stdout')
+        parser.add_argument('--format', choices=EXPORT_FORMATS, default=EXPORT_FORMAT_NDJSON)
+        parser.add_argument('--gzip', action='store_true', default=False,\
+            help='gzip compress the output')
+        parser.add_argument('--schema',\
+            help='Only export metadata for this schema slug')
+        parser.add_argument('--schema-version',\
+            help='Only export metadata for this schema version (used with --schema)')
+        parser.add_argument('--installation',\
+            help='Only export metadata for schemas of this Dataverse installation')
+        parser.add_argument('--modified-since',\
+            help='Only export metadata modified at or after this date or datetime')
+
+    def handle(self, *args, **options):
+        try:
+            fm_qs = get_export_queryset(schema=options['schema'],\
+                            schema_version=options['schema_version'],\
+                            installation=options['installation'],\
+                            modified_since=parse_modified_since(options['modified_since']),\
+                            include_unpublished=True)
+        except ValueError as err:
+            raise CommandError(str(err))
+
+        blocks = iter_export(fm_qs, options['format'], options['gzip'])
+
+        if options['output'] == '-':
+            for block in blocks:
+                sys.stdout.buffer.write(block)
+            sys.stdout.buffer.flush()
+            return
+
+        with open(options['output'], 'wb') as output_file:
+            for block in blocks:
+                output_file.write(block)
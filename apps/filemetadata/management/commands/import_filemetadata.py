@@ -0,0 +1,66 @@
+"""
+Import FileMetadata from an NDJSON or CSV file (or stdin)
+
+    python manage.py import_filemetadata metadata.ndjson --errors rejected.ndjson
+    zcat metadata.csv.gz | python manage.py import_filemetadata - --format csv
+
+See apps.filemetadata.bulk_import for the record format
+"""
+import io
+import sys
+from django.core.management.base import BaseCommand, CommandError
+from apps.filemetadata.bulk_import import FileMetadataImporter, read_records,\
+    IMPORT_FORMATS, IMPORT_FORMAT_CSV, IMPORT_FORMAT_NDJSON, DEFAULT_BATCH_SIZE
+
+
+class Command(BaseCommand):
+    help = 'Validate and import FileMetadata records from NDJSON or CSV'
+
+    def add_arguments(self, parser):
+        parser.add_argument('input',\
+            help='NDJSON or CSV file, "-" for stdin')
+        parser.add_argument('--format', choices=IMPORT_FORMATS,\
+            help='Input format.  Default: "csv" for .csv files, otherwise "ndjson"')
+        parser.add_argument('--errors', default='import_filemetadata_errors.ndjson',\
+            help='NDJSON file for the rejected records and their errors')
+        parser.add_argument('--batch-size', type=int, default=DEFAULT_BATCH_SIZE,\
+            help='Records validated and written per transaction')
+        parser.add_argument('--workers', type=int, default=None,\
+            help='Validation processes.  Default: one per CPU.  1: no pool')
+        parser.add_argument('--schema',\
+            help='Schema slug for records without a "schema"')
+        parser.add_argument('--schema-version',\
+            help='Schema version for records without a "schema_version"')
+
+    def handle(self, *args, **options):
+        if options['batch_size'] < 1:
+            raise CommandError('--batch-size must be at least 1')
+        if options['workers'] is not None and options['workers'] < 1:
+            raise CommandError('--workers must be at least 1')
+
+        import_format = options['format']
+        if import_format is None:
+            if options['input'].lower().endswith('.csv'):
+                import_format = IMPORT_FORMAT_CSV
+            else:
+                import_format = IMPORT_FORMAT_NDJSON
+
+        if options['input'] == '-':
+            input_stream = io.TextIOWrapper(sys.stdin.buffer, encoding='utf-8', newline='')
+        else:
+            try:
+                input_stream = open(options['input'], 'r', encoding='utf-8', newline='')
+            except IOError as err:
+                raise CommandError(str(err))
+
+        with input_stream, open(options['errors'], 'w', encoding='utf-8') as error_stream:
+            importer = FileMetadataImporter(error_stream,\
+                                        batch_size=options['batch_size'],\
+                                        workers=options['workers'],\
+                                        default_schema=options['schema'],\
+                                        default_schema_version=options['schema_version'])
+            num_imported, num_rejected = importer.run(read_records(input_stream, import_format))
+
+        self.stdout.write('Imported: %s, rejected: %s' % (num_imported, num_rejected))
+        if num_rejected:
+            self.stdout.write('Rejected records: %s' % options['errors'])
@@ -0,0 +1,37 @@
+"""
+Partition the FileMetadata table (PostgreSQL 11+), or undo it
+
+    python manage.py partition_filemetadata
+    python manage.py partition_filemetadata --by datafile_hash --partitions 32
+    python manage.py partition_filemetadata --undo
+
+See apps.filemetadata.partitioning
+"""
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection
+from apps.filemetadata.partitioning import partition_filemetadata, unpartition_filemetadata,\
+    get_partition_strategy, PARTITION_STRATEGIES
+
+
+class Command(BaseCommand):
+    help = 'Rebuild the FileMetadata table as a partitioned (or plain) table'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--by', choices=PARTITION_STRATEGIES,\
+            help='Partition key (default: settings.FILEMETADATA_PARTITION_BY)')
+        parser.add_argument('--partitions', type=int,\
+            help='Number of hash partitions (default: settings.FILEMETADATA_PARTITION_COUNT)')
+        parser.add_argument('--undo', action='store_true', default=False,\
+            help='Rebuild FileMetadata as a plain table')
+
+    def handle(self, *args, **options):
+        try:
+            if options['undo']:
+                unpartition_filemetadata(connection)
+            else:
+                partition_filemetadata(connection, options['by'], options['partitions'])
+        except ValueError as err:
+            raise CommandError(str(err))
+
+        self.stdout.write('FileMetadata partitioning: %s' %\
+                        (get_partition_strategy(connection) or 'none'))
@@ -0,0 +1,130 @@
+"""
+Version history of FileMetadata
+
+    save_metadata_version(fm, new_metadata)     # fm.version + 1
+    get_metadata_version(fm, 3)
+    diff_metadata_versions(fm, 3, 5)            # JSON Patch from version 3 to 5
+
+The FileMetadata row keeps the latest version in full.  Each earlier
+version is a FileMetadataRevision holding a JSON Patch (RFC 6902) that
+turns the next version back into it, so an edit only stores what
+changed.  Every FILEMETADATA_SNAPSHOT_INTERVAL-th version is stored in
+full instead, so rebuilding any version applies fewer patches than that.
+"""
+from django.conf import settings
+from django.db import transaction
+from apps.filemetadata.json_patch import make_json_patch, apply_json_patch
+from apps.filemetadata.models import FileMetadata, FileMetadataRevision
+
+DEFAULT_SNAPSHOT_INTERVAL = 10
+
+ERR_MSG_NO_VERSION = 'There is no version %s of this file metadata'
+ERR_MSG_MISSING_REVISIONS = 'Versions %s to %s of this file metadata are missing'
+ERR_MSG_VERSION_TAKEN = 'Version %s of this file metadata is already saved as a separate row'\
+    ' (id %s), so the change can\'t be saved as a new version'
+
+
+class VersionTakenError(ValueError):
+    """
+    The next version is already a FileMetadata row of its own
+    """
+    pass
+
+
+def check_next_version_free(file_metadata_id, schema_id, datafile_id, version):
+    """
+    Raise VersionTakenError if another FileMetadata row holds
+    (schema, datafile_id, version + 1), the key the next version needs
+    """
+    taken_id = FileMetadata.objects.filter(schema_id=schema_id, datafile_id=datafile_id,\
+                                        version=version + 1)\
+                .exclude(pk=file_metadata_id).values_list('id', flat=True).first()
+    if taken_id is not None:
+        raise VersionTakenError(ERR_MSG_VERSION_TAKEN % (version + 1, taken_id))
+
+
+def get_snapshot_interval():
+    return max(1, getattr(settings, 'FILEMETADATA_SNAPSHOT_INTERVAL', DEFAULT_SNAPSHOT_INTERVAL))
+
+
+def save_metadata_version(fm, metadata):
+    """
+    Save "metadata" as the next version of a FileMetadata and keep the
+    current version as a revision.  Nothing is saved if it's unchanged.
+
+    The next (schema, datafile_id, version) must be free: FileMetadata
+    saved as one row per version can't also have a history.  Raise
+    VersionTakenError, saving nothing, if it isn't.
+    """
+    with transaction.atomic():
+        current = FileMetadata.objects.select_for_update()\
+                    .only('id', 'version', 'metadata', 'modified').get(pk=fm.pk)
+        patch = make_json_patch(metadata, current.metadata)
+        if not patch:
+            return fm
+        check_next_version_free(fm.pk, fm.schema_id, fm.datafile_id, current.version)
+
+        revision = FileMetadataRevision(file_metadata_id=fm.pk,\
+                                    version=current.version,\
+                                    version_modified=current.modified)
+        if current.version % get_snapshot_interval() == 0:
+            revision.is_snapshot = True
+            revision.snapshot = current.metadata
+        else:
+            revision.patch = patch
+        revision.save()
+
+        fm.metadata = metadata
+        fm.version = current.version + 1
+        fm.save()
+    return fm
+
+
+def get_metadata_version(fm, version):
+    """
+    The metadata of one version, raise ValueError if there's no such version
+    """
+    if version == fm.version:
+        return fm.metadata
+    if version < 1 or version > fm.version:
+        raise ValueError(ERR_MSG_NO_VERSION % version)
+
+    # start from the closest later snapshot, or the latest version
+    snapshot = fm.revisions.filter(version__gte=version, is_snapshot=True)\
+                    .order_by('version').only('version', 'snapshot').first()
+    if snapshot is None:
+        start_version, metadata = fm.version, fm.metadata
+    else:
+        start_version, metadata = snapshot.version, snapshot.snapshot
+
+    revisions = fm.revisions.filter(version__gte=version, version__lt=start_version)\
+                    .order_by('-version').only('version', 'patch')
+    expected_version = start_version - 1
+    for revision in revisions:
+        if revision.version != expected_version:
+            break
+        metadata = apply_json_patch(metadata, revision.patch)
+        expected_version -= 1
+
+    if expected_version != version - 1:
+        raise ValueError(ERR_MSG_MISSING_REVISIONS % (version, expected_version))
+    return metadata
+
+
+def diff_metadata_versions(fm, from_version, to_version):
+    """
+    JSON Patch that turns one version's metadata into the other's
+    """
+    return make_json_patch(get_metadata_version(fm, from_version),\
+                        get_metadata_version(fm, to_version))
+
+
+def get_version_list(fm):
+    """
+    [(version, modified, is_snapshot)] of every version, oldest first.
+    The latest version is the FileMetadata itself.
+    """
+    versions = list(fm.revisions.order_by('version')\
+                    .values_list('version', 'version_modified', 'is_snapshot'))
+    versions.append((fm.version, fm.modified, True))
+    return versions
@@ -0,0 +1,223 @@
+"""
+Patch a FileMetadata document and revalidate only what the patch touched
+
+    patched, changes = apply_metadata_patch(metadata, patch, PATCH_TYPE_JSON_PATCH)
+    is_valid, errors, validated = validate_patched_metadata(schema_dict, patched,
+                                                            changes, cache_key)
+
+Patches are JSON Patch (RFC 6902) or JSON Merge Patch (RFC 7396).
+Each change is (JSON pointer parts, whether the member was added or
+removed).  For each change the schema is followed down the document
+through "properties" (or "additionalProperties"/"items" schemas), and
+only the changed member is validated against its subschema.
+
+Keywords that look across a node's members are handled on the way:
+    - "required", "additionalProperties", "minProperties",
+      "maxProperties", "minItems" and "maxItems" only depend on which
+      members exist, so when a member is added or removed they are
+      checked on their own, without validating the members' values
+    - combinators and "$ref" ("allOf", "anyOf", "oneOf", "not", "$ref"),
+      "dependencies", "patternProperties", "enum", "uniqueItems" and
+      tuple "items" depend on the whole node: that node is validated
+A change to the document root validates the whole document.
+"""
+import jsonschema
+from jsonschema import RefResolver
+from apps.filemetadata.json_patch import apply_json_patch, apply_merge_patch, check_json_patch,\
+    get_pointer_member, JsonPatchError
+from apps.filemetadata.json_pointer import format_json_pointer
+from apps.filemetadata.utils import CHOSEN_VALIDATOR_CLASS, format_error_message,\
+    validate_filemetadata
+from apps.filemetadata.validator_cache import VALIDATOR_CACHE
+
+PATCH_TYPE_JSON_PATCH = 'application/json-patch+json'
+PATCH_TYPE_MERGE_PATCH = 'application/merge-patch+json'
+PATCH_TYPES = [PATCH_TYPE_JSON_PATCH, PATCH_TYPE_MERGE_PATCH]
+
+# keywords that constrain a node as a whole
+WHOLE_NODE_KEYWORDS = ['allOf', 'anyOf', 'oneOf', 'not', '$ref', 'dependencies',\
+    'patternProperties', 'enum', 'uniqueItems', 'additionalItems']
+
+# keywords that only depend on which members a node has
+MEMBER_SET_KEYWORDS = ['required', 'additionalProperties', 'minProperties', 'maxProperties',\
+    'minItems', 'maxItems']
+
+ERR_MSG_BAD_PATCH_TYPE = 'The patch Content-Type must be one of: %s' % ', '.join(PATCH_TYPES)
+
+
+def get_json_patch_changes(patch):
+    """
+    [(pointer parts, member added or removed)] of a JSON Patch.
+    Raise JsonPatchFormatError if the patch is malformed.
+    """
+    check_json_patch(patch)
+
+    changes = []
+    for operation in patch:
+        op = operation['op']
+        if op == 'test':
+            continue
+        if op == 'move':
+            changes.append((get_pointer_member(operation, 'from')[1], True))
+        changes.append((get_pointer_member(operation, 'path')[1], op != 'replace'))
+    return changes
+
+
+def get_merge_patch_changes(document, patch, parts=None):
+    """
+    [(pointer parts, member added or removed)] of a JSON Merge Patch
+    """
+    if parts is None:
+        parts = []
+    if not isinstance(patch, dict) or not isinstance(document, dict):
+        return [(parts, False)]
+
+    changes = []
+    for key, value in patch.items():
+        if value is None:
+            if key in document:
+                changes.append((parts + [key], True))
+        elif key not in document:
+            changes.append((parts + [key], True))
+        elif isinstance(value, dict):
+            changes.extend(get_merge_patch_changes(document[key], value, parts + [key]))
+        else:
+            changes.append((parts + [key], False))
+    return changes
+
+
+def apply_metadata_patch(document, patch, patch_type):
+    """
+    (patched copy of the document, changes).
+    Raise JsonPatchError if the patch can't be applied.
+    """
+    if patch_type == PATCH_TYPE_JSON_PATCH:
+        patched = apply_json_patch(document, patch)
+        return patched, get_json_patch_changes(patch)
+    if patch_type == PATCH_TYPE_MERGE_PATCH:
+        return apply_merge_patch(document, patch), get_merge_patch_changes(document, patch)
+    raise JsonPatchError(ERR_MSG_BAD_PATCH_TYPE)
+
+
+def get_member_set_schema(schema):
+    """
+    The member-set keywords of a schema, with any member value allowed
+    """
+    member_schema = dict((k, v) for k, v in schema.items() if k in MEMBER_SET_KEYWORDS)
+    if 'properties' in schema:
+        member_schema['properties'] = dict((k, {}) for k in schema['properties'])
+    if 'type' in schema:
+        member_schema['type'] = schema['type']
+    return member_schema
+
+
+def get_child_schema(schema, part, node):
+    """
+    (schema keyword path, subschema) for a member of a document node,
+    None if it's unconstrained.  As in jsonschema, objects only use
+    "properties"/"additionalProperties" and arrays only "items".
+    """
+    if isinstance(node, dict):
+        properties = schema.get('properties', {})
+        if part in properties:
+            return ['properties', part], properties[part]
+        if isinstance(schema.get('additionalProperties'), dict):
+            return ['additionalProperties'], schema['additionalProperties']
+    elif isinstance(node, list):
+        if isinstance(schema.get('items'), dict):
+            return ['items'], schema['items']
+    return None
+
+
+def get_validation_targets(schema_dict, document, changes):
+    """
+    [(document pointer parts, schema pointer parts, subschema)] to validate
+    in the patched document.  An empty document pointer means the whole document.
+    """
+    targets = []
+    for parts, is_member_change in changes:
+        doc_parts, schema_parts, schema = [], [], schema_dict
+        for depth, part in enumerate(parts):
+            if [x for x in WHOLE_NODE_KEYWORDS if x in schema] or isinstance(schema.get('items'), list):
+                break
+            if depth == len(parts) - 1 and is_member_change and\
+                [x for x in MEMBER_SET_KEYWORDS if x in schema]:
+                targets.append((list(doc_parts), schema_parts + ['(members)'],\
+                                get_member_set_schema(schema)))
+
+            child = get_child_schema(schema, part, get_document_node(document, doc_parts)[1])
+            if child is None:
+                schema = None
+                break
+            schema_parts = schema_parts + child[0]
+            schema = child[1]
+            doc_parts.append(part)
+
+        if schema is not None:
+            targets.append((doc_parts, schema_parts, schema))
+
+    # drop the targets inside a subtree that's validated as a whole
+    whole_targets = [x[0] for x in targets if x[1][-1:] != ['(members)']]
+    unique_targets = []
+    for target in targets:
+        doc_parts = target[0]
+        if [x for x in whole_targets if len(x) < len(doc_parts) and doc_parts[:len(x)] == x]:
+            continue
+        if target not in unique_targets:
+            unique_targets.append(target)
+    return unique_targets
+
+
+def get_document_node(document, parts):
+    """
+    The node at the pointer parts, (False, None) if it doesn't exist
+    """
+    node = document
+    for part in parts:
+        if isinstance(node, dict) and part in node:
+            node = node[part]
+        elif isinstance(node, list) and part == '-' and node:
+            node = node[-1]     # just appended
+        elif isinstance(node, list) and str(part).isdigit() and int(part) < len(node):
+            node = node[int(part)]
+        else:
+            return False, None
+    return True, node
+
+
+def get_subschema_validator(schema_dict, schema_parts, subschema, cache_key=None):
+    """
+    Validator for a subschema, resolving "$ref"s against the whole schema
+    """
+    def build():
+        return CHOSEN_VALIDATOR_CLASS(subschema, resolver=RefResolver.from_schema(schema_dict))
+
+    if cache_key is None:
+        return build()
+    return VALIDATOR_CACHE.get_or_build(tuple(cache_key) + ('subschema',\
+                                        format_json_pointer(schema_parts)), build)
+
+
+def validate_patched_metadata(schema_dict, document, changes, cache_key=None):
+    """
+    (is valid, error messages, [validated JSON pointers]) of a patched document
+    """
+    targets = get_validation_targets(schema_dict, document, changes)
+    if [x for x in targets if not x[0] and not x[1]]:
+        is_valid, errors = validate_filemetadata(schema_dict, document, cache_key)
+        return is_valid, errors, ['']
+
+    validated = []
+    for doc_parts, schema_parts, subschema in targets:
+        exists, node = get_document_node(document, doc_parts)
+        if not exists:
+            continue    # removed: checked with its parent's members
+        validated.append(format_json_pointer(doc_parts))
+        try:
+            get_subschema_validator(schema_dict, schema_parts, subschema, cache_key)\
+                .validate(node)
+        except jsonschema.exceptions.ValidationError as validation_err:
+            validation_err.path.extendleft(reversed(doc_parts))
+            return False, format_error_message(validation_err), validated
+
+    return True, None, validated
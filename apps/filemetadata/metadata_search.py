@@ -0,0 +1,135 @@
+"""
+Search FileMetadata by the content of its metadata
+
+    - containment: rows whose metadata contains a JSON document, e.g.
+        {"instrument": {"name": "X"}, "tags": ["raw"]}
+    - pointer equality: rows whose value at a JSON pointer equals a JSON value, e.g.
+        "/instrument/name" = "X"
+
+On PostgreSQL these run against metadata_jsonb and its GIN index.
+Elsewhere they use the FileMetadataValue side table, which indexes
+every scalar by (pointer, value).
+"""
+import json
+import re
+from django.db import connections
+from apps.filemetadata.models import FileMetadataValue
+from apps.filemetadata.json_pointer import parse_json_pointer, format_json_pointer,\
+    is_json_scalar, encode_index_value
+
+ERR_MSG_NESTED_ARRAY_VALUE = 'Searching for objects or arrays inside an array is only available on PostgreSQL'
+ERR_MSG_POINTER_VALUE_NOT_SCALAR = 'Searching for an object or array at a JSON pointer is only available on PostgreSQL'
+ERR_MSG_BAD_METADATA_QUERY = 'Use "/json/pointer=value" or a JSON object, e.g. {"instrument": "X"}'
+
+
+def uses_jsonb(queryset):
+    return connections[queryset.db].vendor == 'postgresql'
+
+
+def get_indexed_ids(pointer, value):
+    """
+    Subquery of the FileMetadata ids with this (pointer, encoded value)
+    """
+    return FileMetadataValue.objects.filter(pointer=pointer, value=value)\
+                        .values('file_metadata_id')
+
+
+def get_containment_conditions(document, parts=None):
+    """
+    Split a containment document into side table subqueries,
+    one per scalar it holds
+    """
+    if parts is None:
+        parts = []
+
+    if isinstance(document, dict):
+        conditions = []
+        for key, child in document.items():
+            conditions.extend(get_containment_conditions(child, parts + [key]))
+        return conditions
+
+    if isinstance(document, list):
+        # like jsonb, each element may be anywhere in the array
+        item_pointer = re.escape(format_json_pointer(parts)) + r'/\d+$'
+        conditions = []
+        for item in document:
+            if not is_json_scalar(item):
+                raise ValueError(ERR_MSG_NESTED_ARRAY_VALUE)
+            conditions.append(FileMetadataValue.objects\
+                            .filter(pointer__regex='^' + item_pointer,\
+                                    value=encode_index_value(item))\
+                            .values('file_metadata_id'))
+        return conditions
+
+    return [get_indexed_ids(format_json_pointer(parts), encode_index_value(document))]
+
+
+def filter_metadata_contains(queryset, document):
+    """
+    FileMetadata whose metadata contains the document (jsonb's @>)
+    """
+    if uses_jsonb(queryset):
+        return queryset.filter(metadata_jsonb__jsonb_contains=document)
+
+    for id_subquery in get_containment_conditions(document):
+        queryset = queryset.filter(id__in=id_subquery)
+    return queryset
+
+
+def filter_metadata_pointer(queryset, pointer, value):
+    """
+    FileMetadata whose metadata has the value at the JSON pointer
+    """
+    parts = parse_json_pointer(pointer)
+
+    if uses_jsonb(queryset):
+        if not [x for x in parts if x.isdigit()]:
+            # containment lets PostgreSQL use the GIN index,
+            # the path comparison then checks for an exact match
+            document = value
+            for part in reversed(parts):
+                document = {part: document}
+            queryset = queryset.filter(metadata_jsonb__jsonb_contains=document)
+        return queryset.filter(metadata_jsonb__jsonb_path_equals=(parts, value))
+
+    if not is_json_scalar(value):
+        raise ValueError(ERR_MSG_POINTER_VALUE_NOT_SCALAR)
+    return queryset.filter(id__in=get_indexed_ids(format_json_pointer(parts),\
+                                                encode_index_value(value)))
+
+
+def parse_metadata_query(query):
+    """
+    Parse a search box query:
+        '/instrument/name="X"' or '/instrument/name=X' -> ('/instrument/name', 'X')
+        '{"instrument": "X"}' -> (None, {'instrument': 'X'})
+
+    Values that aren't JSON are used as strings
+    """
+    query = query.strip()
+    if query.startswith('{'):
+        try:
+            document = json.loads(query)
+        except ValueError:
+            raise ValueError(ERR_MSG_BAD_METADATA_QUERY)
+        return None, document
+
+    if not query.startswith('/') or '=' not in query:
+        raise ValueError(ERR_MSG_BAD_METADATA_QUERY)
+
+    pointer, value = query.split('=', 1)
+    try:
+        value = json.loads(value)
+    except ValueError:
+        pass
+    return pointer, value
+
+
+def filter_metadata_query(queryset, query):
+    """
+    Apply a query in the parse_metadata_query format
+    """
+    pointer, value = parse_metadata_query(query)
+    if pointer is None:
+        return filter_metadata_contains(queryset, value)
+    return filter_metadata_pointer(queryset, pointer, value)
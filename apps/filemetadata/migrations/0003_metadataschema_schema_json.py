@@ -0,0 +1,49 @@
+# -*- coding: utf-8 -*-
+# Generated by Django 1.9.7 on 2026-10-17 02:02
+from __future__ import unicode_literals
+
+from django.db import migrations, models
+from collections import OrderedDict
+import json
+
+
+def set_schema_json(apps, schema_editor):
+    """
+    Fill in the stored JSON for existing schemas (same output as
+    MetadataSchema.as_json).  The raw column is read so the
+    schema's key order is kept.
+    """
+    MetadataSchema = apps.get_model('filemetadata', 'MetadataSchema')
+    with schema_editor.connection.cursor() as cursor:
+        cursor.execute('SELECT id, schema FROM %s' % MetadataSchema._meta.db_table)
+        rows = cursor.fetchall()
+
+    for schema_id, schema_text in rows:
+        schema_dict = json.loads(schema_text, object_pairs_hook=OrderedDict)
+        if 'self' in schema_dict:
+            schema_dict['self']['version'] = float(schema_dict['self']['version'])
+
+        MetadataSchema.objects.filter(pk=schema_id).update(\
+            schema_json=json.dumps(schema_dict),\
+            schema_json_pretty=json.dumps(schema_dict, indent=4))
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('filemetadata', '0002_auto_20160718_1203'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='metadataschema',
+            name='schema_json',
+            field=models.TextField(blank=True, editable=False, help_text='Compact JSON of the schema. (auto-filled on save)'),
+        ),
+        migrations.AddField(
+            model_name='metadataschema',
+            name='schema_json_pretty',
+            field=models.TextField(blank=True, editable=False, help_text='Indented JSON of the schema. (auto-filled on save)'),
+        ),
+        migrations.RunPython(set_schema_json, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,34 @@
+# -*- coding: utf-8 -*-
+# Generated by Django 1.9.7 on 2026-10-17 02:02
+from __future__ import unicode_literals
+
+from django.db import migrations, models
+import hashlib
+
+
+def set_schema_hash(apps, schema_editor):
+    """
+    Hash the stored JSON of existing schemas
+    """
+    MetadataSchema = apps.get_model('filemetadata', 'MetadataSchema')
+    for schema_id, schema_json in MetadataSchema.objects.values_list('id', 'schema_json'):
+        if not schema_json:
+            continue
+        MetadataSchema.objects.filter(pk=schema_id).update(\
+            schema_hash=hashlib.sha1(schema_json.encode('utf-8')).hexdigest())
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('filemetadata', '0003_metadataschema_schema_json'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='metadataschema',
+            name='schema_hash',
+            field=models.CharField(blank=True, editable=False, help_text='SHA-1 of the compact JSON, used for ETags. (auto-filled on save)', max_length=40),
+        ),
+        migrations.RunPython(set_schema_hash, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,31 @@
+# -*- coding: utf-8 -*-
+# Generated by Django 1.9.7 on 2026-10-17 02:05
+from __future__ import unicode_literals
+
+import apps.filemetadata.fields
+from django.db import migrations
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('filemetadata', '0004_metadataschema_schema_hash'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='filemetadata',
+            name='metadata_jsonb',
+            field=apps.filemetadata.fields.JSONBField(blank=True, editable=False, null=True),
+        ),
+        migrations.AddField(
+            model_name='metadataschema',
+            name='schema_jsonb',
+            field=apps.filemetadata.fields.JSONBField(blank=True, editable=False, null=True),
+        ),
+        migrations.AddField(
+            model_name='metadataschemasubmission',
+            name='schema_jsonb',
+            field=apps.filemetadata.fields.JSONBField(blank=True, editable=False, null=True),
+        ),
+    ]
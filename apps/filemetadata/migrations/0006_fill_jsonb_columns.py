@@ -0,0 +1,64 @@
+# -*- coding: utf-8 -*-
+from __future__ import unicode_literals
+
+from django.db import migrations, transaction
+
+# rows updated per transaction
+BATCH_SIZE = 5000
+
+# (model name, text column, jsonb column)
+JSONB_COLUMNS = [
+    ('MetadataSchemaSubmission', 'schema', 'schema_jsonb'),
+    ('MetadataSchema', 'schema', 'schema_jsonb'),
+    ('FileMetadata', 'metadata', 'metadata_jsonb'),
+]
+
+
+def fill_jsonb_columns(apps, schema_editor):
+    """
+    Copy the existing JSON text into the new jsonb columns.
+
+    Each primary key range is updated in its own short transaction so
+    the table is never locked for the whole copy.  Rows that are
+    already filled are skipped, so this may be rerun.
+    """
+    connection = schema_editor.connection
+    quote_name = connection.ops.quote_name
+    if connection.vendor == 'postgresql':
+        source_format = '%s::jsonb'
+    else:
+        source_format = '%s'
+
+    for model_name, text_column, jsonb_column in JSONB_COLUMNS:
+        model = apps.get_model('filemetadata', model_name)
+        table = quote_name(model._meta.db_table)
+
+        with connection.cursor() as cursor:
+            cursor.execute('SELECT MIN(id), MAX(id) FROM %s' % table)
+            min_id, max_id = cursor.fetchone()
+        if min_id is None:
+            continue
+
+        update_sql = 'UPDATE {table} SET {jsonb} = {source} WHERE id >= %s AND id < %s AND {jsonb} IS NULL'\
+                        .format(table=table,\
+                            jsonb=quote_name(jsonb_column),\
+                            source=source_format % quote_name(text_column))
+
+        for start_id in range(min_id, max_id + 1, BATCH_SIZE):
+            with transaction.atomic(using=connection.alias):
+                with connection.cursor() as cursor:
+                    cursor.execute(update_sql, [start_id, start_id + BATCH_SIZE])
+
+
+class Migration(migrations.Migration):
+
+    # batches commit separately
+    atomic = False
+
+    dependencies = [
+        ('filemetadata', '0005_jsonb_columns'),
+    ]
+
+    operations = [
+        migrations.RunPython(fill_jsonb_columns, migrations.RunPython.noop),
+    ]
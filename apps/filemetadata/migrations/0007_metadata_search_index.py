@@ -0,0 +1,102 @@
+# -*- coding: utf-8 -*-
+# Generated by Django 1.9.7 on 2026-10-17 02:08
+from __future__ import unicode_literals
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+from apps.filemetadata.json_pointer import flatten_metadata
+
+GIN_INDEX_NAME = 'filemetadata_metadata_jsonb_gin'
+
+# FileMetadata rows indexed per bulk insert
+BATCH_SIZE = 1000
+
+
+class NotOnPostgreSQL(object):
+    """
+    Operation mixin: the model state changes everywhere, but PostgreSQL
+    searches metadata_jsonb and gets no FileMetadataValue table
+    """
+    def database_forwards(self, app_label, schema_editor, from_state, to_state):
+        if schema_editor.connection.vendor != 'postgresql':
+            super(NotOnPostgreSQL, self).database_forwards(app_label, schema_editor,\
+                                                        from_state, to_state)
+
+    def database_backwards(self, app_label, schema_editor, from_state, to_state):
+        if schema_editor.connection.vendor != 'postgresql':
+            super(NotOnPostgreSQL, self).database_backwards(app_label, schema_editor,\
+                                                        from_state, to_state)
+
+
+class CreateModelNotOnPostgreSQL(NotOnPostgreSQL, migrations.CreateModel):
+    pass
+
+
+class AlterIndexTogetherNotOnPostgreSQL(NotOnPostgreSQL, migrations.AlterIndexTogether):
+    pass
+
+
+def create_metadata_index(apps, schema_editor):
+    """
+    PostgreSQL: GIN index on metadata_jsonb for containment (@>) queries,
+    built CONCURRENTLY so FileMetadata stays writable meanwhile.
+    Other databases: fill the FileMetadataValue side table.
+    """
+    connection = schema_editor.connection
+    FileMetadata = apps.get_model('filemetadata', 'FileMetadata')
+
+    if connection.vendor == 'postgresql':
+        schema_editor.execute('CREATE INDEX CONCURRENTLY %s'\
+                        ' ON %s USING GIN (%s jsonb_path_ops)' %\
+                        (GIN_INDEX_NAME,\
+                        schema_editor.quote_name(FileMetadata._meta.db_table),\
+                        schema_editor.quote_name('metadata_jsonb')))
+        return
+
+    FileMetadataValue = apps.get_model('filemetadata', 'FileMetadataValue')
+    max_length = FileMetadataValue._meta.get_field('pointer').max_length
+
+    value_rows = []
+    for fm_id, metadata in FileMetadata.objects.values_list('id', 'metadata_jsonb').iterator():
+        if metadata is None:
+            continue
+        value_rows.extend(FileMetadataValue(file_metadata_id=fm_id, pointer=pointer, value=value)\
+                        for pointer, value in flatten_metadata(metadata)\
+                        if len(pointer) <= max_length)
+        if len(value_rows) >= BATCH_SIZE:
+            FileMetadataValue.objects.bulk_create(value_rows)
+            value_rows = []
+    FileMetadataValue.objects.bulk_create(value_rows)
+
+
+def drop_metadata_index(apps, schema_editor):
+    if schema_editor.connection.vendor == 'postgresql':
+        schema_editor.execute('DROP INDEX CONCURRENTLY IF EXISTS %s' % GIN_INDEX_NAME)
+
+
+class Migration(migrations.Migration):
+
+    # CREATE INDEX CONCURRENTLY can't run in a transaction
+    atomic = False
+
+    dependencies = [
+        ('filemetadata', '0006_fill_jsonb_columns'),
+    ]
+
+    operations = [
+        CreateModelNotOnPostgreSQL(
+            name='FileMetadataValue',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('pointer', models.CharField(max_length=255)),
+                ('value', models.TextField()),
+                ('file_metadata', models.ForeignKey(on_delete=django.db.models.deletion.DO_NOTHING, related_name='indexed_values', to='filemetadata.FileMetadata')),
+            ],
+        ),
+        AlterIndexTogetherNotOnPostgreSQL(
+            name='filemetadatavalue',
+            index_together=set([('pointer', 'value')]),
+        ),
+        migrations.RunPython(create_metadata_index, drop_metadata_index, atomic=False),
+    ]
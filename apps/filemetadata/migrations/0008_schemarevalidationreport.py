@@ -0,0 +1,38 @@
+# -*- coding: utf-8 -*-
+# Generated by Django 1.9.7 on 2026-10-17 02:12
+from __future__ import unicode_literals
+
+from django.db import migrations, models
+import django.db.models.deletion
+import django.utils.timezone
+import jsonfield.fields
+import model_utils.fields
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('filemetadata', '0007_metadata_search_index'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='SchemaRevalidationReport',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('created', model_utils.fields.AutoCreatedField(default=django.utils.timezone.now, editable=False, verbose_name='created')),
+                ('modified', model_utils.fields.AutoLastModifiedField(default=django.utils.timezone.now, editable=False, verbose_name='modified')),
+                ('schema_hash', models.CharField(blank=True, help_text='MetadataSchema.schema_hash that was validated against', max_length=40)),
+                ('status', models.CharField(choices=[('RUNNING', 'RUNNING'), ('COMPLETE', 'COMPLETE'), ('FAILED', 'FAILED')], default='RUNNING', max_length=20)),
+                ('num_chunks', models.IntegerField(default=0)),
+                ('num_checked', models.IntegerField(default=0)),
+                ('num_invalid', models.IntegerField(default=0)),
+                ('invalid_samples', jsonfield.fields.JSONField(blank=True, default=list, help_text='Some of the invalid FileMetadata: id, datafile_id, version and errors')),
+                ('finished', models.DateTimeField(blank=True, null=True)),
+                ('schema', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='revalidation_reports', to='filemetadata.MetadataSchema')),
+            ],
+            options={
+                'ordering': ('-created',),
+            },
+        ),
+    ]
@@ -0,0 +1,31 @@
+# -*- coding: utf-8 -*-
+# Generated by Django 1.9.7 on 2026-10-17 02:14
+from __future__ import unicode_literals
+
+import apps.filemetadata.fields
+from django.db import migrations
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('filemetadata', '0008_schemarevalidationreport'),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name='filemetadata',
+            name='metadata',
+            field=apps.filemetadata.fields.LazyJSONField(),
+        ),
+        migrations.AlterField(
+            model_name='metadataschema',
+            name='schema',
+            field=apps.filemetadata.fields.LazyJSONField(),
+        ),
+        migrations.AlterField(
+            model_name='metadataschemasubmission',
+            name='schema',
+            field=apps.filemetadata.fields.LazyJSONField(),
+        ),
+    ]
@@ -0,0 +1,19 @@
+# -*- coding: utf-8 -*-
+# Generated by Django 1.9.7 on 2026-10-17 02:17
+from __future__ import unicode_literals
+
+from django.db import migrations
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('filemetadata', '0009_lazy_json_fields'),
+    ]
+
+    operations = [
+        migrations.AlterIndexTogether(
+            name='metadataschema',
+            index_together=set([('slug', 'published', 'version')]),
+        ),
+    ]
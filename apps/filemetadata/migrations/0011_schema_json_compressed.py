@@ -0,0 +1,55 @@
+# -*- coding: utf-8 -*-
+# Generated by Django 1.9.7 on 2026-10-17 02:22
+from __future__ import unicode_literals
+
+from django.db import migrations, models
+
+from apps.filemetadata.compression import compress_variants, ENCODING_GZIP, ENCODING_BROTLI
+
+
+def compress_schema_json(apps, schema_editor):
+    """
+    Compress the JSON already stored for each schema.
+    Rows saved before their JSON was stored are compressed on their next save.
+    """
+    MetadataSchema = apps.get_model('filemetadata', 'MetadataSchema')
+    schema_qs = MetadataSchema.objects.exclude(schema_json='')\
+                    .values_list('id', 'schema_json', 'schema_json_pretty')
+    for schema_id, schema_json, schema_json_pretty in schema_qs.iterator():
+        columns = {}
+        for suffix, text in (('', schema_json), ('_pretty', schema_json_pretty)):
+            variants = compress_variants(text)
+            for encoding in (ENCODING_GZIP, ENCODING_BROTLI):
+                columns['schema_json%s_%s' % (suffix, encoding)] = variants.get(encoding)
+        MetadataSchema.objects.filter(id=schema_id).update(**columns)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('filemetadata', '0010_latest_schema_index'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='metadataschema',
+            name='schema_json_br',
+            field=models.BinaryField(null=True),
+        ),
+        migrations.AddField(
+            model_name='metadataschema',
+            name='schema_json_gzip',
+            field=models.BinaryField(null=True),
+        ),
+        migrations.AddField(
+            model_name='metadataschema',
+            name='schema_json_pretty_br',
+            field=models.BinaryField(null=True),
+        ),
+        migrations.AddField(
+            model_name='metadataschema',
+            name='schema_json_pretty_gzip',
+            field=models.BinaryField(null=True),
+        ),
+        migrations.RunPython(compress_schema_json, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,33 @@
+# -*- coding: utf-8 -*-
+# Generated by Django 1.9.7 on 2026-10-17 02:25
+from __future__ import unicode_literals
+
+from django.db import migrations, models
+
+
+def fill_installation_ids(apps, schema_editor):
+    """
+    Copy each schema's installation to its FileMetadata
+    """
+    MetadataSchema = apps.get_model('filemetadata', 'MetadataSchema')
+    FileMetadata = apps.get_model('filemetadata', 'FileMetadata')
+    for schema_id, installation_id in MetadataSchema.objects\
+                                    .values_list('id', 'dataverse_installation_id'):
+        FileMetadata.objects.filter(schema_id=schema_id)\
+            .update(dataverse_installation_id=installation_id)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('filemetadata', '0011_schema_json_compressed'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='filemetadata',
+            name='dataverse_installation_id',
+            field=models.CharField(blank=True, editable=False, help_text="The schema's Dataverse installation. (auto-filled on save)", max_length=255),
+        ),
+        migrations.RunPython(fill_installation_ids, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,20 @@
+# -*- coding: utf-8 -*-
+from __future__ import unicode_literals
+
+from django.db import migrations
+
+
+class Migration(migrations.Migration):
+    """
+    FileMetadata partitioning is opt-in: "manage.py partition_filemetadata"
+    rebuilds the table (see apps/filemetadata/partitioning.py).  It isn't
+    done here, so a deploy never copies the table under an exclusive lock
+    and every database migrated to this state has the same schema.
+    """
+    dependencies = [
+        ('filemetadata', '0012_filemetadata_installation'),
+    ]
+
+    operations = [
+        migrations.RunPython(migrations.RunPython.noop, migrations.RunPython.noop),
+    ]
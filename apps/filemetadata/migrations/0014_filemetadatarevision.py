@@ -0,0 +1,41 @@
+# -*- coding: utf-8 -*-
+# Generated by Django 1.9.7 on 2026-10-17 02:27
+from __future__ import unicode_literals
+
+import apps.filemetadata.fields
+from django.db import migrations, models
+import django.db.models.deletion
+import django.utils.timezone
+import jsonfield.fields
+import model_utils.fields
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('filemetadata', '0013_partition_filemetadata'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='FileMetadataRevision',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('created', model_utils.fields.AutoCreatedField(default=django.utils.timezone.now, editable=False, verbose_name='created')),
+                ('modified', model_utils.fields.AutoLastModifiedField(default=django.utils.timezone.now, editable=False, verbose_name='modified')),
+                ('version', models.IntegerField()),
+                ('version_modified', models.DateTimeField(blank=True, help_text='When this version was saved', null=True)),
+                ('is_snapshot', models.BooleanField(default=False)),
+                ('snapshot', apps.filemetadata.fields.LazyJSONField(blank=True, help_text='The full metadata, for snapshots', null=True)),
+                ('patch', jsonfield.fields.JSONField(blank=True, help_text='JSON Patch from the next version to this one, for the others', null=True)),
+                ('file_metadata', models.ForeignKey(db_constraint=False, on_delete=django.db.models.deletion.CASCADE, related_name='revisions', to='filemetadata.FileMetadata')),
+            ],
+            options={
+                'ordering': ('file_metadata', '-version'),
+            },
+        ),
+        migrations.AlterUniqueTogether(
+            name='filemetadatarevision',
+            unique_together=set([('file_metadata', 'version')]),
+        ),
+    ]
@@ -0,0 +1,40 @@
+# -*- coding: utf-8 -*-
+# Generated by Django 1.9.7 on 2026-10-17 02:32
+from __future__ import unicode_literals
+
+import json
+from collections import OrderedDict
+
+from django.db import migrations
+import jsonfield.fields
+
+from apps.filemetadata.schema_precheck import build_schema_precheck
+
+
+def fill_schema_precheck(apps, schema_editor):
+    """
+    Summarize each existing schema for the validation pre-check
+    """
+    MetadataSchema = apps.get_model('filemetadata', 'MetadataSchema')
+    for schema_id, schema in MetadataSchema.objects.values_list('id', 'schema').iterator():
+        if isinstance(schema, str):
+            # values_list() skips the JSONField's decoding
+            schema = json.loads(schema, object_pairs_hook=OrderedDict)
+        MetadataSchema.objects.filter(id=schema_id)\
+            .update(schema_precheck=build_schema_precheck(schema))
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('filemetadata', '0014_filemetadatarevision'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='metadataschema',
+            name='schema_precheck',
+            field=jsonfield.fields.JSONField(blank=True, editable=False, help_text='Summary for the validation pre-check. (auto-filled on save)', null=True),
+        ),
+        migrations.RunPython(fill_schema_precheck, migrations.RunPython.noop),
+    ]
@@ -1,17 +1,30 @@
 """
 Basic models for File Metadata schemas and the data itself:
-    MetadataSchemaSubmission, MetadataSchema, FileMetadata
+    MetadataSchemaSubmission, MetadataSchema, FileMetadata, FileMetadataValue,
+    SchemaRevalidationReport
 """
 from collections import OrderedDict
+from decimal import Decimal
+import hashlib
 import json
 # django
-from django.db import models
+from django.conf import settings
+from django.db import models, connection, connections, transaction
+from django.db.models.signals import post_delete
+from django.dispatch import receiver
 from django.core.urlresolvers import reverse
 from django.utils.text import slugify
 from django.utils.html import escape
 # other
 from model_utils.models import TimeStampedModel
 from jsonfield import JSONField
+from apps.filemetadata.compression import compress_variants, ENCODING_GZIP, ENCODING_BROTLI
+from apps.filemetadata.fields import JSONBField, LazyJSONField
+from apps.filemetadata.json_pointer import flatten_metadata
+from apps.filemetadata.partitioning import ensure_installation_partition
+from apps.filemetadata.schema_precheck import build_schema_precheck, get_schema_precheck,\
+    PRECHECK_CACHE
+from apps.filemetadata.validator_cache import VALIDATOR_CACHE
 
 SCHEMA_STATUS_SUBMITTED = '1 - SUBMITTED'
 SUBMISSION_STATUS_UNDER_REVIEW = '2 - UNDER_REVIEW'
@@ -21,6 +34,13 @@ SCHEMA_STATUSES = [SCHEMA_STATUS_SUBMITTED, SUBMISSION_STATUS_UNDER_REVIEW,\
     SUBMISSION_STATUS_ACCEPTED, SUBMISSION_STATUS_REJECTED]
 SCHEMA_STATUS_CHOICES = [(x, x) for x in SCHEMA_STATUSES]
 
+REVALIDATION_STATUS_RUNNING = 'RUNNING'
+REVALIDATION_STATUS_COMPLETE = 'COMPLETE'
+REVALIDATION_STATUS_FAILED = 'FAILED'
+REVALIDATION_STATUSES = [REVALIDATION_STATUS_RUNNING, REVALIDATION_STATUS_COMPLETE,\
+    REVALIDATION_STATUS_FAILED]
+REVALIDATION_STATUS_CHOICES = [(x, x) for x in REVALIDATION_STATUSES]
+
 class MetadataSchemaSubmission(TimeStampedModel):
     """
     Metadata schemas submitted via API.
@@ -36,13 +56,22 @@ class MetadataSchemaSubmission(TimeStampedModel):
     contributor = models.CharField(max_length=255, default='Dataverse core')
     review_complete = models.BooleanField(default=False)
     version = models.DecimalField(default=1.0, decimal_places=2, max_digits=5)
-    schema = JSONField(load_kwargs={'object_pairs_hook': OrderedDict})
+    schema = LazyJSONField(load_kwargs={'object_pairs_hook': OrderedDict})
     description = models.TextField(blank=True)
     rejection_reason = models.TextField(blank=True)
 
+    # Copy of "schema" for database queries (jsonb on PostgreSQL).  "schema"
+    # stays the copy that is read: jsonb doesn't keep the key order the
+    # schema is served in (see FileMetadata.metadata_jsonb)
+    schema_jsonb = JSONBField(null=True, blank=True, editable=False)
+
     def __str__(self):
         return self.title
 
+    def save(self, *args, **kwargs):
+        self.schema_jsonb = self.schema
+        super(MetadataSchemaSubmission, self).save(*args, **kwargs)
+
 
 class MetadataSchema(TimeStampedModel):
     dataverse_installation_id = models.CharField(max_length=255,\
@@ -52,16 +81,44 @@ class MetadataSchema(TimeStampedModel):
     published = models.BooleanField(default=True)
     slug = models.SlugField(max_length=120, blank=True)
     version = models.DecimalField(default=1.0, decimal_places=2, max_digits=5)
-    schema = JSONField(load_kwargs={'object_pairs_hook': OrderedDict})
+    schema = LazyJSONField(load_kwargs={'object_pairs_hook': OrderedDict})
     description = models.TextField(blank=True)
     contributor = models.CharField(max_length=255, default='Dataverse core')
 
+    # The schema's JSON, as served by the API, made once on save
+    schema_json = models.TextField(blank=True, editable=False,\
+        help_text='Compact JSON of the schema. (auto-filled on save)')
+    schema_json_pretty = models.TextField(blank=True, editable=False,\
+        help_text='Indented JSON of the schema. (auto-filled on save)')
+    schema_hash = models.CharField(max_length=40, blank=True, editable=False,\
+        help_text='SHA-1 of the compact JSON, used for ETags. (auto-filled on save)')
+
+    # Compressed copies of schema_json/schema_json_pretty, sent to clients
+    # that accept them (see compression.py).  Brotli is optional.
+    schema_json_gzip = models.BinaryField(null=True, editable=False)
+    schema_json_pretty_gzip = models.BinaryField(null=True, editable=False)
+    schema_json_br = models.BinaryField(null=True, editable=False)
+    schema_json_pretty_br = models.BinaryField(null=True, editable=False)
+
+    # Copy of "schema" for database queries (jsonb on PostgreSQL).  "schema"
+    # stays the copy that is read: jsonb doesn't keep the key order the
+    # schema is served in (see FileMetadata.metadata_jsonb)
+    schema_jsonb = JSONBField(null=True, blank=True, editable=False)
+
+    # Required keys and property types/enums, checked before
+    # the full validation (see schema_precheck.py)
+    schema_precheck = JSONField(null=True, blank=True, editable=False,\
+        load_kwargs={'object_pairs_hook': OrderedDict},\
+        help_text='Summary for the validation pre-check. (auto-filled on save)')
+
     def __str__(self):
         return '%s (%s)' % (self.title, self.version)
 
     class Meta:
         unique_together = ('title', 'version')
         ordering = ('title', '-version',)
+        # latest published version of a slug (read backwards for version DESC)
+        index_together = [('slug', 'published', 'version')]
 
     @staticmethod
     def get_next_version(title, minor_version=False):
@@ -80,6 +137,24 @@ class MetadataSchema(TimeStampedModel):
     def get_schema_dict(self):
         return self.schema
 
+    def get_validator_cache_key(self):
+        """
+        Identify this schema version for the validator cache.
+        The modified timestamp changes on every save.
+        """
+        if not self.id:
+            return None
+        return (self.id, str(self.version), str(self.modified))
+
+    def get_schema_precheck(self):
+        """
+        SchemaPrecheck made from the summary stored on save
+        (or from the schema, for rows saved before it was stored)
+        """
+        return get_schema_precheck(self.get_schema_dict(),\
+                                cache_key=self.get_validator_cache_key(),\
+                                summary=self.schema_precheck)
+
     def as_json(self, indent=None):
         """
         Dump the schema as JSON
@@ -97,10 +172,51 @@ class MetadataSchema(TimeStampedModel):
         - Change the version from a Decimal to a float
         """
         schema_copy = self.schema.copy()
+        schema_copy['self'] = schema_copy['self'].copy()
         schema_copy['self']['version'] = float(schema_copy['self']['version'])
 
         return schema_copy
 
+    def get_schema_json(self, pretty=False):
+        """
+        Return the schema's JSON made on save, falling back to
+        as_json() for rows saved before it was stored
+        """
+        if pretty:
+            if self.schema_json_pretty:
+                return self.schema_json_pretty
+            return self.as_json(indent=4)
+
+        if self.schema_json:
+            return self.schema_json
+        return self.as_json()
+
+    def get_schema_json_variants(self, pretty=False):
+        """
+        {encoding: compressed bytes} of the JSON made on save
+        """
+        suffix = '_pretty' if pretty else ''
+        variants = {}
+        for encoding in (ENCODING_GZIP, ENCODING_BROTLI):
+            data = getattr(self, 'schema_json%s_%s' % (suffix, encoding))
+            if data:
+                variants[encoding] = bytes(data)    # memoryview on PostgreSQL
+        return variants
+
+    def set_schema_json(self):
+        """
+        Store the schema's compact and indented JSON, their
+        compressed variants and the hash
+        """
+        self.schema_json = self.as_json()
+        self.schema_json_pretty = self.as_json(indent=4)
+        self.schema_hash = hashlib.sha1(self.schema_json.encode('utf-8')).hexdigest()
+
+        for suffix, text in (('', self.schema_json), ('_pretty', self.schema_json_pretty)):
+            variants = compress_variants(text)
+            for encoding in (ENCODING_GZIP, ENCODING_BROTLI):
+                setattr(self, 'schema_json%s_%s' % (suffix, encoding), variants.get(encoding))
+
     def as_dict(self):
         return self.schema
 
@@ -111,8 +227,15 @@ class MetadataSchema(TimeStampedModel):
         """
         if not self.id:
             return 'n/a'
-        api_dict = dict(schema_name_slug=self.slug,\
-                    version=self.version)
+        return MetadataSchema.format_api_url(self.slug, self.version)
+
+    @staticmethod
+    def format_api_url(slug, version):
+        """
+        API url for a schema slug and version
+        """
+        api_dict = dict(schema_name_slug=slug,\
+                    version=version)
         url = reverse('view_schema_with_identifier', kwargs=api_dict)
 
         return url
@@ -145,18 +268,61 @@ class MetadataSchema(TimeStampedModel):
     def save(self, *args, **kwargs):
         self.slug = slugify(self.title)
         self.add_version_to_schema()
+        self.set_schema_json()
+        self.schema_jsonb = self.schema
+        self.schema_precheck = build_schema_precheck(self.schema)
+
+        previous_installation_id = None
+        if self.pk is not None:
+            previous_installation_id = MetadataSchema.objects.filter(pk=self.pk)\
+                            .values_list('dataverse_installation_id', flat=True).first()
+
         super(MetadataSchema, self).save(*args, **kwargs)
+        VALIDATOR_CACHE.invalidate_schema(self.id)
+        PRECHECK_CACHE.invalidate_schema(self.id)
+
+        if connection.vendor == 'postgresql':
+            ensure_installation_partition(connection, self.dataverse_installation_id)
+        if previous_installation_id is not None and\
+            previous_installation_id != self.dataverse_installation_id:
+            # moves the rows to the new installation's partition
+            FileMetadata.objects.filter(schema_id=self.id)\
+                .update(dataverse_installation_id=self.dataverse_installation_id)
+        if self.published and getattr(settings, 'REVALIDATE_ON_SCHEMA_SAVE', True):
+            self.schedule_revalidation()
+
+    def schedule_revalidation(self):
+        """
+        Revalidate this schema's FileMetadata in Celery once the save is committed
+        """
+        from apps.filemetadata.tasks import revalidate_schema_filemetadata
+
+        schema_id = self.id
+        transaction.on_commit(lambda: revalidate_schema_filemetadata.delay(schema_id))
 
 
 class FileMetadata(TimeStampedModel):
 
     schema = models.ForeignKey(MetadataSchema)
     datafile_id = models.IntegerField(default=1)
-    metadata = JSONField(load_kwargs={'object_pairs_hook': OrderedDict})
+    metadata = LazyJSONField(load_kwargs={'object_pairs_hook': OrderedDict})
     published = models.BooleanField(default=True)
     # How does this version relate to DatasetVersion?
     version = models.IntegerField(default=1, help_text='Placeholder')
 
+    # Copy of "metadata" for database queries (jsonb on PostgreSQL).
+    # Both are written on purpose: jsonb doesn't keep the key order that
+    # "metadata" is served, exported and diffed (metadata_history.py) in,
+    # so "metadata" stays the copy read for output.  Reads where the order
+    # doesn't matter use metadata_jsonb instead, e.g. the search and the
+    # revalidation (tasks.py).
+    metadata_jsonb = JSONBField(null=True, blank=True, editable=False)
+
+    # Copy of the schema's installation, the partition key (see partitioning.py).
+    # Filtering on it only scans that installation's partition.
+    dataverse_installation_id = models.CharField(max_length=255, blank=True, editable=False,\
+        help_text="The schema's Dataverse installation. (auto-filled on save)")
+
     class Meta:
         unique_together = ('schema', 'datafile_id', 'version')
         ordering = ('schema', '-version',)
@@ -187,5 +353,161 @@ class FileMetadata(TimeStampedModel):
 %s</pre>""" % self.schema.as_json(indent=4)
     view_schema.allow_tags = True
 
+    def update_indexed_values(self):
+        """
+        Refresh the FileMetadataValue rows used to search the metadata.
+        Only needed without jsonb: on PostgreSQL metadata_jsonb is searched
+        directly through its GIN index.
+        """
+        if connection.vendor == 'postgresql':
+            return
+
+        self.indexed_values.all().delete()
+        FileMetadataValue.objects.bulk_create(\
+            FileMetadataValue.build_for_metadata(self.id, self.metadata))
+
     def save(self, *args, **kwargs):
+        self.metadata_jsonb = self.metadata
+        self.dataverse_installation_id = self.schema.dataverse_installation_id
         super(FileMetadata, self).save(*args, **kwargs)
+        self.update_indexed_values()
+
+    # ids looked up per query when indexing a bulk insert
+    # (sqlite allows 999 query parameters)
+    BULK_ID_LOOKUP_SIZE = 400
+
+    @staticmethod
+    def bulk_create_indexed(fm_objects, batch_size=None):
+        """
+        bulk_create() that also fills what save() does:
+        metadata_jsonb, dataverse_installation_id and, without jsonb,
+        the FileMetadataValue rows
+        """
+        installation_ids = dict(MetadataSchema.objects\
+                                .filter(id__in=set(x.schema_id for x in fm_objects))\
+                                .values_list('id', 'dataverse_installation_id'))
+        for fm in fm_objects:
+            fm.metadata_jsonb = fm.metadata
+            fm.dataverse_installation_id = installation_ids[fm.schema_id]
+        FileMetadata.objects.bulk_create(fm_objects, batch_size)
+
+        if connection.vendor == 'postgresql':
+            return
+
+        # bulk_create() only sets the ids on PostgreSQL,
+        # look them up by the unique (schema, datafile_id, version)
+        fm_ids = {}
+        for start in range(0, len(fm_objects), FileMetadata.BULK_ID_LOOKUP_SIZE):
+            fm_chunk = fm_objects[start:start + FileMetadata.BULK_ID_LOOKUP_SIZE]
+            id_qs = FileMetadata.objects\
+                        .filter(schema_id__in=set(x.schema_id for x in fm_chunk),\
+                                datafile_id__in=set(x.datafile_id for x in fm_chunk),\
+                                version__in=set(x.version for x in fm_chunk))\
+                        .values_list('id', 'schema_id', 'datafile_id', 'version')
+            for fm_id, schema_id, datafile_id, version in id_qs:
+                fm_ids[(schema_id, datafile_id, version)] = fm_id
+
+        value_objects = []
+        for fm in fm_objects:
+            fm.id = fm_ids[(fm.schema_id, fm.datafile_id, fm.version)]
+            value_objects.extend(FileMetadataValue.build_for_metadata(fm.id, fm.metadata))
+        FileMetadataValue.objects.bulk_create(value_objects, batch_size)
+
+
+class FileMetadataValue(models.Model):
+    """
+    One scalar of FileMetadata.metadata, e.g.
+        pointer: "/instrument/name", value: '"X"' (JSON text)
+
+    Index for searching the metadata on databases without jsonb
+    (e.g. sqlite for local development).  Not used on PostgreSQL, where
+    migration 0007 doesn't create the table.
+    """
+    POINTER_MAX_LENGTH = 255
+
+    # DO_NOTHING: a cascade would query the missing table on PostgreSQL,
+    # the rows are deleted by delete_indexed_values() instead
+    file_metadata = models.ForeignKey(FileMetadata, related_name='indexed_values',\
+        on_delete=models.DO_NOTHING)
+    pointer = models.CharField(max_length=POINTER_MAX_LENGTH)
+    value = models.TextField()
+
+    class Meta:
+        index_together = [('pointer', 'value')]
+
+    def __str__(self):
+        return '%s=%s' % (self.pointer, self.value)
+
+    @staticmethod
+    def build_for_metadata(file_metadata_id, metadata):
+        """
+        Unsaved FileMetadataValue objects for each scalar in the metadata.
+        Pointers too long for the column aren't indexed.
+        """
+        return [FileMetadataValue(file_metadata_id=file_metadata_id, pointer=pointer, value=value)\
+                for pointer, value in flatten_metadata(metadata)\
+                if len(pointer) <= FileMetadataValue.POINTER_MAX_LENGTH]
+
+
+@receiver(post_delete, sender=FileMetadata)
+def delete_indexed_values(sender, instance, using, **kwargs):
+    if connections[using].vendor != 'postgresql':
+        FileMetadataValue.objects.using(using).filter(file_metadata_id=instance.pk).delete()
+
+
+class SchemaRevalidationReport(TimeStampedModel):
+    """
+    Result of revalidating a schema's FileMetadata after the schema was saved.
+    See apps/filemetadata/tasks.py
+    """
+    schema = models.ForeignKey(MetadataSchema, related_name='revalidation_reports',\
+        on_delete=models.CASCADE)
+    schema_hash = models.CharField(max_length=40, blank=True,\
+        help_text='MetadataSchema.schema_hash that was validated against')
+    status = models.CharField(max_length=20, choices=REVALIDATION_STATUS_CHOICES,\
+        default=REVALIDATION_STATUS_RUNNING)
+    num_chunks = models.IntegerField(default=0)
+    num_checked = models.IntegerField(default=0)
+    num_invalid = models.IntegerField(default=0)
+    invalid_samples = JSONField(default=list, blank=True,\
+        help_text='Some of the invalid FileMetadata: id, datafile_id, version and errors')
+    finished = models.DateTimeField(null=True, blank=True)
+
+    class Meta:
+        ordering = ('-created',)
+
+    def __str__(self):
+        return '%s: %s (%s of %s invalid)' % (self.schema, self.status,\
+                                            self.num_invalid, self.num_checked)
+
+
+class FileMetadataRevision(TimeStampedModel):
+    """
+    An earlier version of a FileMetadata's metadata.
+
+    The FileMetadata row holds the latest version in full.  Earlier
+    versions are JSON Patches (RFC 6902) from the next version, with a
+    full snapshot every FILEMETADATA_SNAPSHOT_INTERVAL versions so
+    rebuilding an old version applies a bounded number of patches.
+    See apps/filemetadata/metadata_history.py
+    """
+    # no database constraint: FileMetadata may be partitioned (see partitioning.py)
+    file_metadata = models.ForeignKey(FileMetadata, related_name='revisions',\
+        on_delete=models.CASCADE, db_constraint=False)
+    version = models.IntegerField()
+    version_modified = models.DateTimeField(null=True, blank=True,\
+        help_text='When this version was saved')
+    is_snapshot = models.BooleanField(default=False)
+    snapshot = LazyJSONField(null=True, blank=True,\
+        load_kwargs={'object_pairs_hook': OrderedDict},\
+        help_text='The full metadata, for snapshots')
+    patch = JSONField(null=True, blank=True,\
+        load_kwargs={'object_pairs_hook': OrderedDict},\
+        help_text='JSON Patch from the next version to this one, for the others')
+
+    class Meta:
+        unique_together = ('file_metadata', 'version')
+        ordering = ('file_metadata', '-version')
+
+    def __str__(self):
+        return '%s, version %s' % (self.file_metadata_id, self.version)
@@ -0,0 +1,259 @@
+"""
+PostgreSQL declarative partitioning of the FileMetadata table
+
+FileMetadata rows are split into partitions, each with its own smaller
+indexes that are vacuumed separately:
+    - "installation" (the command's default): LIST partitions on the
+      dataverse_installation_id copied from the schema.  There is one
+      partition per Dataverse installation plus a default partition.
+      Queries filtering on dataverse_installation_id only scan that
+      installation's partition.
+    - "datafile_hash": HASH partitions on datafile_id, spreading the
+      rows evenly over FILEMETADATA_PARTITION_COUNT partitions
+
+The ORM keeps working: the table keeps its name and columns and "id"
+stays unique through its sequence.  PostgreSQL requires the partition
+key in the primary key and unique constraints, so they become
+    PRIMARY KEY (id, <key>), UNIQUE (schema_id, datafile_id, version, <key>)
+
+Partitioning needs PostgreSQL 11+ and is opt-in, never done by a
+migration.  Run, during a maintenance window:
+
+    python manage.py partition_filemetadata
+    python manage.py partition_filemetadata --undo
+
+The table is rebuilt in one transaction holding an ACCESS EXCLUSIVE
+lock, so reads and writes wait until it's done.
+
+FileMetadataValue is only used without jsonb, so PostgreSQL databases
+migrated before it was left out there may still have its table.  Its
+foreign key to FileMetadata is dropped: before PostgreSQL 12 a foreign
+key can't reference a partitioned table.
+"""
+import hashlib
+import logging
+import re
+from django.conf import settings
+from django.db import transaction, DatabaseError
+
+LOGGER = logging.getLogger(__name__)
+
+FILEMETADATA_TABLE = 'filemetadata_filemetadata'
+SCHEMA_TABLE = 'filemetadata_metadataschema'
+
+# (table, column) of the foreign keys to FileMetadata.id
+REFERENCING_COLUMNS = [('filemetadata_filemetadatavalue', 'file_metadata_id')]
+
+PARTITION_BY_INSTALLATION = 'installation'
+PARTITION_BY_DATAFILE_HASH = 'datafile_hash'
+PARTITION_STRATEGIES = [PARTITION_BY_INSTALLATION, PARTITION_BY_DATAFILE_HASH]
+
+# partition key column of each strategy
+PARTITION_KEYS = {PARTITION_BY_INSTALLATION: 'dataverse_installation_id',\
+                PARTITION_BY_DATAFILE_HASH: 'datafile_id'}
+
+# pg_partitioned_table.partstrat of each strategy
+PG_PARTITION_STRATEGIES = {'l': PARTITION_BY_INSTALLATION, 'h': PARTITION_BY_DATAFILE_HASH}
+
+DEFAULT_PARTITION_COUNT = 16
+
+# declarative partitioning with default partitions,
+# hash partitions and primary keys
+MIN_PG_VERSION = 110000
+
+ERR_MSG_UNSUPPORTED = 'Partitioning FileMetadata needs PostgreSQL 11 or later'
+ERR_MSG_BAD_STRATEGY = 'The partitioning must be one of: %s' % ', '.join(PARTITION_STRATEGIES)
+ERR_MSG_ALREADY_PARTITIONED = 'FileMetadata is already partitioned'
+ERR_MSG_NOT_PARTITIONED = 'FileMetadata is not partitioned'
+
+
+def get_partition_settings():
+    """
+    (default strategy, number of hash partitions) of partition_filemetadata()
+    from the settings.  The strategy is None if none is set.
+    """
+    return (getattr(settings, 'FILEMETADATA_PARTITION_BY', PARTITION_BY_INSTALLATION) or None,\
+            getattr(settings, 'FILEMETADATA_PARTITION_COUNT', DEFAULT_PARTITION_COUNT))
+
+
+def supports_partitioning(connection):
+    return connection.vendor == 'postgresql' and connection.pg_version >= MIN_PG_VERSION
+
+
+def get_partition_strategy(connection, table=FILEMETADATA_TABLE):
+    """
+    PARTITION_BY_INSTALLATION or PARTITION_BY_DATAFILE_HASH,
+    None if the table isn't partitioned
+    """
+    if not supports_partitioning(connection):
+        return None
+    with connection.cursor() as cursor:
+        cursor.execute('SELECT partstrat FROM pg_partitioned_table'\
+                        ' WHERE partrelid = %s::regclass', [table])
+        row = cursor.fetchone()
+    if row is None:
+        return None
+    return PG_PARTITION_STRATEGIES.get(row[0])
+
+
+def get_installation_partition_name(installation_id, table=FILEMETADATA_TABLE):
+    """
+    Partition table of an installation, e.g. "filemetadata_filemetadata_i_harvard_dataverse_3f2a9c1b".
+    The hash keeps names unique and under PostgreSQL's 63 characters.
+    """
+    name_part = re.sub(r'[^a-z0-9]+', '_', installation_id.lower()).strip('_')[:20]
+    digest = hashlib.sha1(installation_id.encode('utf-8')).hexdigest()[:8]
+    return '%s_i_%s_%s' % (table, name_part, digest)
+
+
+def get_table_definitions(cursor, table):
+    """
+    (index definitions, [(foreign key name, definition)]) of a table,
+    other than its primary key and unique constraints
+    """
+    cursor.execute('SELECT pg_get_indexdef(indexrelid) FROM pg_index'\
+                    ' WHERE indrelid = %s::regclass AND NOT indisprimary AND NOT indisunique',\
+                    [table])
+    # partitioned tables' indexes are defined "ON ONLY" the parent
+    index_defs = [x[0].replace(' ON ONLY ', ' ON ') for x in cursor.fetchall()]
+
+    cursor.execute("SELECT conname, pg_get_constraintdef(oid) FROM pg_constraint"\
+                    " WHERE conrelid = %s::regclass AND contype = 'f'", [table])
+    return index_defs, cursor.fetchall()
+
+
+def drop_referencing_foreign_keys(cursor, table):
+    quote_name = cursor.db.ops.quote_name
+    cursor.execute("SELECT conrelid::regclass::text, conname FROM pg_constraint"\
+                    " WHERE confrelid = %s::regclass AND contype = 'f'", [table])
+    for referencing_table, constraint_name in cursor.fetchall():
+        cursor.execute('ALTER TABLE %s DROP CONSTRAINT %s' %\
+                        (referencing_table, quote_name(constraint_name)))
+
+
+def rebuild_table(connection, table, partition_clause, create_partitions, key_columns):
+    """
+    Copy a table into a new one, partitioned by "partition_clause" or
+    not partitioned if it's empty, keeping its name, sequence, indexes
+    and foreign keys.  "key_columns" are added to the primary key and
+    the (schema_id, datafile_id, version) unique constraint.
+    """
+    quote_name = connection.ops.quote_name
+    new_table = table + '_rebuilt'
+
+    with transaction.atomic(using=connection.alias), connection.cursor() as cursor:
+        index_defs, foreign_keys = get_table_definitions(cursor, table)
+        cursor.execute("SELECT pg_get_serial_sequence(%s, 'id')", [table])
+        sequence_name = cursor.fetchone()[0]
+        drop_referencing_foreign_keys(cursor, table)
+
+        cursor.execute('CREATE TABLE %s (LIKE %s INCLUDING DEFAULTS) %s' %\
+                        (quote_name(new_table), quote_name(table), partition_clause))
+        create_partitions(cursor, new_table)
+        cursor.execute('INSERT INTO %s SELECT * FROM %s' % (quote_name(new_table), quote_name(table)))
+        if sequence_name:
+            cursor.execute('ALTER SEQUENCE %s OWNED BY %s.%s' %\
+                            (sequence_name, quote_name(new_table), quote_name('id')))
+
+        cursor.execute('DROP TABLE %s' % quote_name(table))
+        cursor.execute('ALTER TABLE %s RENAME TO %s' % (quote_name(new_table), quote_name(table)))
+
+        cursor.execute('ALTER TABLE %s ADD CONSTRAINT %s PRIMARY KEY (%s)' %\
+                        (quote_name(table), quote_name(table + '_pkey'),\
+                        ', '.join(quote_name(x) for x in ['id'] + key_columns)))
+        unique_columns = ['schema_id', 'datafile_id', 'version']
+        unique_columns += [x for x in key_columns if x not in unique_columns]
+        cursor.execute('ALTER TABLE %s ADD CONSTRAINT %s UNIQUE (%s)' %\
+                        (quote_name(table), quote_name(table + '_schema_datafile_version_uniq'),\
+                        ', '.join(quote_name(x) for x in unique_columns)))
+        for index_def in index_defs:
+            cursor.execute(index_def)
+        for constraint_name, constraint_def in foreign_keys:
+            cursor.execute('ALTER TABLE %s ADD CONSTRAINT %s %s' %\
+                            (quote_name(table), quote_name(constraint_name), constraint_def))
+
+        cursor.execute('ANALYZE %s' % quote_name(table))
+
+
+def partition_filemetadata(connection, strategy=None, num_partitions=None):
+    """
+    Rebuild the FileMetadata table as a partitioned table
+    """
+    if not supports_partitioning(connection):
+        raise ValueError(ERR_MSG_UNSUPPORTED)
+    default_strategy, default_num_partitions = get_partition_settings()
+    strategy = strategy or default_strategy
+    num_partitions = num_partitions or default_num_partitions
+    if strategy not in PARTITION_STRATEGIES:
+        raise ValueError(ERR_MSG_BAD_STRATEGY)
+    if get_partition_strategy(connection) is not None:
+        raise ValueError(ERR_MSG_ALREADY_PARTITIONED)
+
+    quote_name = connection.ops.quote_name
+    key_column = PARTITION_KEYS[strategy]
+
+    def create_partitions(cursor, parent_table):
+        if strategy == PARTITION_BY_DATAFILE_HASH:
+            for remainder in range(num_partitions):
+                cursor.execute('CREATE TABLE %s PARTITION OF %s'\
+                                ' FOR VALUES WITH (MODULUS %d, REMAINDER %d)' %\
+                                (quote_name('%s_h%d' % (FILEMETADATA_TABLE, remainder)),\
+                                quote_name(parent_table), num_partitions, remainder))
+            return
+
+        cursor.execute('SELECT DISTINCT dataverse_installation_id FROM %s'\
+                        ' UNION SELECT DISTINCT dataverse_installation_id FROM %s' %\
+                        (quote_name(SCHEMA_TABLE), quote_name(FILEMETADATA_TABLE)))
+        for (installation_id,) in cursor.fetchall():
+            cursor.execute('CREATE TABLE %s PARTITION OF %s FOR VALUES IN (%%s)' %\
+                            (quote_name(get_installation_partition_name(installation_id)),\
+                            quote_name(parent_table)), [installation_id])
+        cursor.execute('CREATE TABLE %s PARTITION OF %s DEFAULT' %\
+                        (quote_name(FILEMETADATA_TABLE + '_default'), quote_name(parent_table)))
+
+    rebuild_table(connection, FILEMETADATA_TABLE,\
+                'PARTITION BY %s (%s)' % ('HASH' if strategy == PARTITION_BY_DATAFILE_HASH\
+                                        else 'LIST', quote_name(key_column)),\
+                create_partitions, [key_column])
+
+
+def unpartition_filemetadata(connection):
+    """
+    Rebuild the FileMetadata table as a plain table
+    """
+    if get_partition_strategy(connection) is None:
+        raise ValueError(ERR_MSG_NOT_PARTITIONED)
+
+    quote_name = connection.ops.quote_name
+    rebuild_table(connection, FILEMETADATA_TABLE, '', lambda cursor, parent_table: None, [])
+
+    table_names = connection.introspection.table_names()
+    with connection.cursor() as cursor:
+        for table, column in REFERENCING_COLUMNS:
+            if table not in table_names:
+                continue
+            cursor.execute('ALTER TABLE %s ADD CONSTRAINT %s FOREIGN KEY (%s)'\
+                            ' REFERENCES %s (%s) DEFERRABLE INITIALLY DEFERRED' %\
+                            (quote_name(table), quote_name('%s_%s_fk' % (table, column)),\
+                            quote_name(column), quote_name(FILEMETADATA_TABLE), quote_name('id')))
+
+
+def ensure_installation_partition(connection, installation_id):
+    """
+    Give a new installation its own partition, if FileMetadata is
+    partitioned by installation.  Until then (or if this fails) its
+    rows go to the default partition.
+    """
+    if get_partition_strategy(connection) != PARTITION_BY_INSTALLATION:
+        return
+
+    quote_name = connection.ops.quote_name
+    try:
+        with transaction.atomic(using=connection.alias), connection.cursor() as cursor:
+            cursor.execute('CREATE TABLE IF NOT EXISTS %s PARTITION OF %s FOR VALUES IN (%%s)' %\
+                            (quote_name(get_installation_partition_name(installation_id)),\
+                            quote_name(FILEMETADATA_TABLE)), [installation_id])
+    except DatabaseError:
+        # e.g. the default partition already has rows for this installation
+        LOGGER.warning('No FileMetadata partition made for installation %r',\
+                        installation_id, exc_info=True)
@@ -0,0 +1,152 @@
+"""
+Cache-aside for rendered schema responses, shared by all workers
+through the Django cache (django_redis in production)
+
+    entry = RESPONSE_CACHE.get_or_build(('schema-list', query), build_entry)
+
+The published schemas loaded by the SCHEMA_REGISTRY go through it too,
+so workers starting together after a deploy share one database read.
+
+Keys are versioned: every key includes a generation number that is
+replaced whenever a MetadataSchema is saved or deleted, so one write
+retires every cached response at once.
+
+Rebuilds are spread out so an expiring popular key, or a deploy with
+cold workers, doesn't send every worker to the database at once:
+    - probabilistic early refresh ("XFetch"): before an entry expires,
+      each read has a small, growing chance of rebuilding it, weighted
+      by how long the entry took to build
+    - single-flight: a rebuild first takes a short lock with cache.add().
+      Other workers keep serving the stale entry, or, if there's none,
+      wait briefly for the lock holder's result.
+
+If the cache is down (django_redis with IGNORE_EXCEPTIONS returns None
+for everything), entries are built on each request as before.
+"""
+import math
+import random
+import time
+import uuid
+from django.conf import settings
+from django.core.cache import caches
+from django.db import transaction
+from django.db.models.signals import post_save, post_delete
+from django.dispatch import receiver
+from apps.filemetadata.models import MetadataSchema
+
+KEY_PREFIX = 'filemetadata:response'
+GENERATION_KEY = 'filemetadata:response-generation'
+
+DEFAULT_RESPONSE_CACHE_TTL = 5 * 60     # seconds
+
+# stale entries are kept this much longer than their TTL
+# so they can be served while one worker rebuilds them
+STALE_GRACE_FACTOR = 2
+
+# XFetch "beta": > 1 refreshes earlier, < 1 later
+EARLY_REFRESH_BETA = 1.0
+
+# seconds a rebuild lock is held at most
+LOCK_TIMEOUT = 10
+
+# seconds to wait for another worker's rebuild of a missing entry
+LOCK_WAIT = 2
+LOCK_POLL_INTERVAL = 0.05
+
+
+class ResponseCache(object):
+    """
+    Versioned cache-aside with single-flight rebuilds and early refresh
+    """
+    def __init__(self, cache_alias='default', ttl=DEFAULT_RESPONSE_CACHE_TTL):
+        self.cache_alias = cache_alias
+        self.ttl = ttl
+
+    @property
+    def cache(self):
+        return caches[self.cache_alias]
+
+    def get_generation(self):
+        generation = self.cache.get(GENERATION_KEY)
+        if generation is None:
+            self.cache.add(GENERATION_KEY, uuid.uuid4().hex, None)
+            generation = self.cache.get(GENERATION_KEY)
+        return generation
+
+    def invalidate(self):
+        """
+        Retire every cached response
+        """
+        self.cache.set(GENERATION_KEY, uuid.uuid4().hex, None)
+
+    def make_key(self, generation, key_parts):
+        return ':'.join([KEY_PREFIX, generation] + [str(x) for x in key_parts])
+
+    def should_refresh_early(self, expires_at, build_time):
+        """
+        XFetch: True with a probability that grows as expiry nears
+        """
+        return time.time() - build_time * EARLY_REFRESH_BETA * math.log(random.random() or 1e-12)\
+                >= expires_at
+
+    def build_and_set(self, key, build):
+        started = time.time()
+        value = build()
+        build_time = time.time() - started
+        self.cache.set(key, (value, time.time() + self.ttl, build_time),\
+                    self.ttl * STALE_GRACE_FACTOR)
+        return value
+
+    def get_or_build(self, key_parts, build):
+        """
+        Cached value for the key parts, calling build() to make it if needed
+        """
+        generation = self.get_generation()
+        if generation is None:
+            return build()      # the cache is unavailable
+
+        key = self.make_key(generation, key_parts)
+        lock_key = key + ':lock'
+
+        entry = self.cache.get(key)
+        if entry is not None:
+            value, expires_at, build_time = entry
+            if not self.should_refresh_early(expires_at, build_time):
+                return value
+            if self.cache.add(lock_key, 1, LOCK_TIMEOUT):
+                try:
+                    return self.build_and_set(key, build)
+                finally:
+                    self.cache.delete(lock_key)
+            return value    # someone else is refreshing it
+
+        got_lock = self.cache.add(lock_key, 1, LOCK_TIMEOUT)
+        if got_lock is None:
+            return build()      # the cache is unavailable
+        if got_lock:
+            try:
+                return self.build_and_set(key, build)
+            finally:
+                self.cache.delete(lock_key)
+
+        # wait for the worker holding the lock
+        wait_until = time.time() + LOCK_WAIT
+        while time.time() < wait_until:
+            time.sleep(LOCK_POLL_INTERVAL)
+            entry = self.cache.get(key)
+            if entry is not None:
+                return entry[0]
+        return build()
+
+
+RESPONSE_CACHE = ResponseCache(\
+            cache_alias=getattr(settings, 'SCHEMA_RESPONSE_CACHE_ALIAS', 'default'),\
+            ttl=getattr(settings, 'SCHEMA_RESPONSE_CACHE_TTL', DEFAULT_RESPONSE_CACHE_TTL))
+
+
+@receiver(post_save, sender=MetadataSchema)
+@receiver(post_delete, sender=MetadataSchema)
+def invalidate_schema_responses(sender, instance, **kwargs):
+    RESPONSE_CACHE.invalidate()
+    # again once committed, in case a worker cached the old rows meanwhile
+    transaction.on_commit(RESPONSE_CACHE.invalidate)
@@ -0,0 +1,469 @@
+"""
+Compile a JSON schema (Draft 4) into Python validation code
+
+Instead of walking the schema dictionary for every document (as the
+jsonschema validators do), each (sub)schema is turned into a small
+Python function with the schema's constants written directly into it.
+Similar to the approach of the fastjsonschema library.
+
+The compiled validator:
+    - accepts and rejects the same documents as jsonschema's Draft4Validator
+    - raises jsonschema.exceptions.ValidationError for the first error
+      found--with the same message and path--so utils.format_error_message
+      works unchanged
+
+Schemas using anything the compiler doesn't handle (remote "$ref"s,
+nested "id" scopes, unknown types, malformed keyword values) raise
+UnsupportedSchemaError; callers should fall back to jsonschema.
+
+See jsonschema/_validators.py for the behavior mirrored here.
+"""
+import re
+from numbers import Number
+from jsonschema import _utils, Draft4Validator
+from jsonschema.compat import unquote
+from jsonschema.exceptions import ValidationError
+
+# Python expression checking each JSON type, "{0}" is the variable name
+TYPE_CHECKS = {
+    'array': 'isinstance({0}, list)',
+    'boolean': 'isinstance({0}, bool)',
+    'integer': '(isinstance({0}, int) and not isinstance({0}, bool))',
+    'null': '{0} is None',
+    'number': '(isinstance({0}, _Number) and not isinstance({0}, bool))',
+    'object': 'isinstance({0}, dict)',
+    'string': 'isinstance({0}, str)',
+}
+
+# Draft 4 keywords that are intentionally not compiled:
+#   - "format" is only checked when a format checker is given,
+#     and CHOSEN_VALIDATOR_CLASS is used without one
+#   - "$ref" is handled before any other keyword
+SKIPPED_KEYWORDS = ('format', '$ref')
+
+
+class UnsupportedSchemaError(Exception):
+    """
+    The schema uses a feature the compiler doesn't handle
+    """
+    pass
+
+
+def _error(message, keyword, schema, instance):
+    """
+    Build a ValidationError the way jsonschema's iter_errors does
+    """
+    return ValidationError(message,\
+                validator=keyword,\
+                validator_value=schema[keyword],\
+                instance=instance,\
+                schema=schema)
+
+
+def _ok(validate_func, instance):
+    """
+    Does the instance validate? (used for anyOf, oneOf, not)
+    """
+    try:
+        validate_func(instance)
+    except ValidationError:
+        return False
+    return True
+
+
+def _is_number(value):
+    return isinstance(value, Number) and not isinstance(value, bool)
+
+
+class CompiledValidator(object):
+    """
+    Validator built by compile_schema.  Mimics the part of
+    the jsonschema validator interface used in utils.py
+    """
+    def __init__(self, schema, validate_func, source):
+        self.schema = schema
+        self.source = source
+        self._validate_func = validate_func
+
+    def validate(self, instance):
+        """
+        Raise a jsonschema ValidationError for the first error found
+        """
+        self._validate_func(instance)
+
+    def is_valid(self, instance):
+        return _ok(self._validate_func, instance)
+
+
+class SchemaCompiler(object):
+    """
+    Generate the source of one function per (sub)schema.
+    Usage: SchemaCompiler(schema_dict).compile()
+    """
+    def __init__(self, schema):
+        self.root_schema = schema
+        self.lines = []
+        self.func_names = {}    # id(subschema) -> function name
+        self.pending = []       # (function name, subschema) still to write
+        self.namespace = dict(_ValidationError=ValidationError,\
+                            _Number=Number,\
+                            _error=_error,\
+                            _ok=_ok,\
+                            _types_msg=_utils.types_msg,\
+                            _extras_msg=_utils.extras_msg,\
+                            _uniq=_utils.uniq)
+
+    def compile(self):
+        """
+        Return a CompiledValidator for the schema
+        """
+        root_func_name = self.get_func_name(self.root_schema, is_root=True)
+        while self.pending:
+            func_name, subschema = self.pending.pop(0)
+            self.write_function(func_name, subschema)
+
+        source = '\n'.join(self.lines)
+        exec(compile(source, '<compiled schema>', 'exec'), self.namespace)
+
+        return CompiledValidator(self.root_schema,\
+                            self.namespace[root_func_name],\
+                            source)
+
+    def add_const(self, value):
+        """
+        Make a value available to the generated code, return its name
+        """
+        const_name = '_c%d' % len(self.namespace)
+        self.namespace[const_name] = value
+        return const_name
+
+    def get_func_name(self, subschema, is_root=False):
+        """
+        Name of the function validating "subschema", queued
+        for writing the first time the subschema is seen
+        """
+        if not isinstance(subschema, dict):
+            raise UnsupportedSchemaError('Subschema is not an object: %r' % (subschema,))
+        if 'id' in subschema and not is_root:
+            raise UnsupportedSchemaError('"id" is only supported at the top level')
+
+        key = id(subschema)
+        if key not in self.func_names:
+            self.func_names[key] = '_validate_%d' % len(self.func_names)
+            self.pending.append((self.func_names[key], subschema))
+
+        return self.func_names[key]
+
+    def resolve_ref(self, ref):
+        """
+        Resolve a local JSON reference such as "#/definitions/address"
+        """
+        if not isinstance(ref, str) or not ref.startswith('#'):
+            raise UnsupportedSchemaError('Only local "$ref"s are supported: %s' % ref)
+
+        fragment = ref[1:].lstrip('/')
+        parts = unquote(fragment).split('/') if fragment else []
+
+        document = self.root_schema
+        for part in parts:
+            part = part.replace('~1', '/').replace('~0', '~')
+            if isinstance(document, list):
+                try:
+                    part = int(part)
+                except ValueError:
+                    pass
+            try:
+                document = document[part]
+            except (TypeError, LookupError):
+                raise UnsupportedSchemaError('Unresolvable "$ref": %s' % ref)
+
+        return document
+
+    def write_function(self, func_name, schema):
+        self.schema_name = self.add_const(schema)
+        self.lines.append('def %s(data):' % func_name)
+        body_start = len(self.lines)
+
+        ref = schema.get('$ref')
+        if ref is not None:
+            # jsonschema ignores the other keywords next to "$ref"
+            self.emit(1, '%s(data)' % self.get_func_name(self.resolve_ref(ref)))
+        else:
+            for keyword, value in schema.items():
+                if keyword in SKIPPED_KEYWORDS or keyword not in Draft4Validator.VALIDATORS:
+                    continue
+                getattr(self, 'emit_%s' % keyword)(schema, value)
+
+        if len(self.lines) == body_start:
+            self.emit(1, 'pass')
+        self.lines.append('')
+
+    # ------------------------------------------
+    # code generation helpers
+    # ------------------------------------------
+    def emit(self, depth, line):
+        self.lines.append('    ' * depth + line)
+
+    def emit_raise(self, depth, keyword, message_expr):
+        self.emit(depth, 'raise _error(%s, %r, %s, data)' % (message_expr, keyword, self.schema_name))
+
+    def emit_descend(self, depth, subschema, instance_expr, path_expr=None):
+        """
+        Validate "instance_expr" against a subschema, adding
+        "path_expr" to the error path
+        """
+        func_name = self.get_func_name(subschema)
+        if path_expr is None:
+            self.emit(depth, '%s(%s)' % (func_name, instance_expr))
+            return
+        self.emit(depth, 'try:')
+        self.emit(depth + 1, '%s(%s)' % (func_name, instance_expr))
+        self.emit(depth, 'except _ValidationError as err:')
+        self.emit(depth + 1, 'err.path.appendleft(%s)' % path_expr)
+        self.emit(depth + 1, 'raise')
+
+    def check_number(self, keyword, value):
+        if not _is_number(value):
+            raise UnsupportedSchemaError('"%s" must be a number' % keyword)
+
+    def check_count(self, keyword, value):
+        if not isinstance(value, int) or isinstance(value, bool):
+            raise UnsupportedSchemaError('"%s" must be an integer' % keyword)
+
+    def check_schema_list(self, keyword, value):
+        if not isinstance(value, list) or not value:
+            raise UnsupportedSchemaError('"%s" must be a list of schemas' % keyword)
+
+    # ------------------------------------------
+    # one emit_ method per Draft 4 keyword
+    # ------------------------------------------
+    def emit_type(self, schema, value):
+        types = _utils.ensure_list(value)
+        for type_name in types:
+            if type_name not in TYPE_CHECKS:
+                raise UnsupportedSchemaError('Unknown type: %r' % (type_name,))
+
+        type_check = ' or '.join(TYPE_CHECKS[x].format('data') for x in types)
+        self.emit(1, 'if not (%s):' % type_check)
+        self.emit_raise(2, 'type', '_types_msg(data, %s)' % self.add_const(types))
+
+    def emit_enum(self, schema, value):
+        if not isinstance(value, list):
+            raise UnsupportedSchemaError('"enum" must be a list')
+
+        enum_name = self.add_const(value)
+        self.emit(1, 'if data not in %s:' % enum_name)
+        self.emit_raise(2, 'enum', "'%%r is not one of %%r' %% (data, %s)" % enum_name)
+
+    def emit_properties(self, schema, value):
+        if not isinstance(value, dict):
+            raise UnsupportedSchemaError('"properties" must be an object')
+
+        self.emit(1, 'if isinstance(data, dict):')
+        self.emit(2, 'pass')
+        for prop_name, subschema in value.items():
+            self.emit(2, 'if %r in data:' % prop_name)
+            self.emit_descend(3, subschema, 'data[%r]' % prop_name, repr(prop_name))
+
+    def emit_patternProperties(self, schema, value):
+        if not isinstance(value, dict):
+            raise UnsupportedSchemaError('"patternProperties" must be an object')
+
+        self.emit(1, 'if isinstance(data, dict):')
+        self.emit(2, 'pass')
+        for pattern, subschema in value.items():
+            pattern_name = self.add_const(re.compile(pattern))
+            self.emit(2, 'for key in data:')
+            self.emit(3, 'if %s.search(key):' % pattern_name)
+            self.emit_descend(4, subschema, 'data[key]', 'key')
+
+    def emit_additionalProperties(self, schema, value):
+        properties = schema.get('properties', {})
+        patterns = '|'.join(schema.get('patternProperties', {}))
+
+        extras_expr = 'set(key for key in data if key not in %s' % self.add_const(properties)
+        if patterns:
+            extras_expr += ' and not %s.search(key)' % self.add_const(re.compile(patterns))
+        extras_expr += ')'
+
+        if isinstance(value, dict):
+            self.emit(1, 'if isinstance(data, dict):')
+            self.emit(2, 'for key in %s:' % extras_expr)
+            self.emit_descend(3, value, 'data[key]', 'key')
+        elif not value:
+            self.emit(1, 'if isinstance(data, dict):')
+            self.emit(2, 'extras = %s' % extras_expr)
+            self.emit(2, 'if extras:')
+            self.emit_raise(3, 'additionalProperties',\
+                "'Additional properties are not allowed (%s %s unexpected)' % _extras_msg(extras)")
+
+    def emit_items(self, schema, value):
+        if isinstance(value, dict):
+            self.emit(1, 'if isinstance(data, list):')
+            self.emit(2, 'for index, item in enumerate(data):')
+            self.emit_descend(3, value, 'item', 'index')
+        elif isinstance(value, list):
+            self.emit(1, 'if isinstance(data, list):')
+            self.emit(2, 'pass')
+            for index, subschema in enumerate(value):
+                self.emit(2, 'if len(data) > %d:' % index)
+                self.emit_descend(3, subschema, 'data[%d]' % index, str(index))
+        else:
+            raise UnsupportedSchemaError('"items" must be a schema or a list of schemas')
+
+    def emit_additionalItems(self, schema, value):
+        items = schema.get('items', {})
+        if isinstance(items, dict):
+            # only applies when "items" is a list
+            return
+        if not isinstance(items, list):
+            raise UnsupportedSchemaError('"items" must be a schema or a list of schemas')
+
+        len_items = len(items)
+        if isinstance(value, dict):
+            self.emit(1, 'if isinstance(data, list):')
+            self.emit(2, 'for index, item in enumerate(data[%d:], start=%d):' % (len_items, len_items))
+            self.emit_descend(3, value, 'item', 'index')
+        elif not value:
+            self.emit(1, 'if isinstance(data, list) and len(data) > %d:' % len_items)
+            self.emit_raise(2, 'additionalItems',\
+                "'Additional items are not allowed (%%s %%s unexpected)' %% _extras_msg(data[%d:])" % len_items)
+
+    def emit_minimum(self, schema, value):
+        self.check_number('minimum', value)
+        if schema.get('exclusiveMinimum', False):
+            operator, cmp = '<=', 'less than or equal to'
+        else:
+            operator, cmp = '<', 'less than'
+
+        value_name = self.add_const(value)
+        self.emit(1, 'if %s and data %s %s:' % (TYPE_CHECKS['number'].format('data'), operator, value_name))
+        self.emit_raise(2, 'minimum', "'%%r is %s the minimum of %%r' %% (data, %s)" % (cmp, value_name))
+
+    def emit_maximum(self, schema, value):
+        self.check_number('maximum', value)
+        if schema.get('exclusiveMaximum', False):
+            operator, cmp = '>=', 'greater than or equal to'
+        else:
+            operator, cmp = '>', 'greater than'
+
+        value_name = self.add_const(value)
+        self.emit(1, 'if %s and data %s %s:' % (TYPE_CHECKS['number'].format('data'), operator, value_name))
+        self.emit_raise(2, 'maximum', "'%%r is %s the maximum of %%r' %% (data, %s)" % (cmp, value_name))
+
+    def emit_multipleOf(self, schema, value):
+        self.check_number('multipleOf', value)
+        value_name = self.add_const(value)
+        if isinstance(value, float):
+            failed_expr = 'int(data / {0}) != data / {0}'.format(value_name)
+        else:
+            failed_expr = 'data % {0}'.format(value_name)
+
+        self.emit(1, 'if %s and %s:' % (TYPE_CHECKS['number'].format('data'), failed_expr))
+        self.emit_raise(2, 'multipleOf', "'%%r is not a multiple of %%r' %% (data, %s)" % value_name)
+
+    def emit_length_check(self, keyword, value, type_name, operator, message):
+        self.check_count(keyword, value)
+        self.emit(1, 'if %s and len(data) %s %d:' % (TYPE_CHECKS[type_name].format('data'), operator, value))
+        self.emit_raise(2, keyword, "'%%r %s' %% (data,)" % message)
+
+    def emit_minItems(self, schema, value):
+        self.emit_length_check('minItems', value, 'array', '<', 'is too short')
+
+    def emit_maxItems(self, schema, value):
+        self.emit_length_check('maxItems', value, 'array', '>', 'is too long')
+
+    def emit_minLength(self, schema, value):
+        self.emit_length_check('minLength', value, 'string', '<', 'is too short')
+
+    def emit_maxLength(self, schema, value):
+        self.emit_length_check('maxLength', value, 'string', '>', 'is too long')
+
+    def emit_minProperties(self, schema, value):
+        self.emit_length_check('minProperties', value, 'object', '<', 'does not have enough properties')
+
+    def emit_maxProperties(self, schema, value):
+        self.emit_length_check('maxProperties', value, 'object', '>', 'has too many properties')
+
+    def emit_uniqueItems(self, schema, value):
+        if not value:
+            return
+        self.emit(1, 'if isinstance(data, list) and not _uniq(data):')
+        self.emit_raise(2, 'uniqueItems', "'%r has non-unique elements' % (data,)")
+
+    def emit_pattern(self, schema, value):
+        if not isinstance(value, str):
+            raise UnsupportedSchemaError('"pattern" must be a string')
+
+        pattern_name = self.add_const(re.compile(value))
+        self.emit(1, 'if isinstance(data, str) and not %s.search(data):' % pattern_name)
+        self.emit_raise(2, 'pattern', "'%%r does not match %%r' %% (data, %r)" % value)
+
+    def emit_required(self, schema, value):
+        if not isinstance(value, list):
+            raise UnsupportedSchemaError('"required" must be a list')
+
+        self.emit(1, 'if isinstance(data, dict):')
+        self.emit(2, 'pass')
+        for prop_name in value:
+            self.emit(2, 'if %r not in data:' % prop_name)
+            self.emit_raise(3, 'required', "'%%r is a required property' %% %r" % (prop_name,))
+
+    def emit_dependencies(self, schema, value):
+        if not isinstance(value, dict):
+            raise UnsupportedSchemaError('"dependencies" must be an object')
+
+        self.emit(1, 'if isinstance(data, dict):')
+        self.emit(2, 'pass')
+        for prop_name, dependency in value.items():
+            self.emit(2, 'if %r in data:' % prop_name)
+            if isinstance(dependency, dict):
+                self.emit_descend(3, dependency, 'data')
+                continue
+            self.emit(3, 'pass')
+            for required_name in _utils.ensure_list(dependency):
+                self.emit(3, 'if %r not in data:' % required_name)
+                self.emit_raise(4, 'dependencies',\
+                    "'%%r is a dependency of %%r' %% (%r, %r)" % (required_name, prop_name))
+
+    def emit_allOf(self, schema, value):
+        self.check_schema_list('allOf', value)
+        for subschema in value:
+            self.emit_descend(1, subschema, 'data')
+
+    def emit_anyOf(self, schema, value):
+        self.check_schema_list('anyOf', value)
+        func_names = [self.get_func_name(x) for x in value]
+        self.emit(1, 'if not (%s):' % ' or '.join('_ok(%s, data)' % x for x in func_names))
+        self.emit_raise(2, 'anyOf', "'%r is not valid under any of the given schemas' % (data,)")
+
+    def emit_oneOf(self, schema, value):
+        self.check_schema_list('oneOf', value)
+        func_names = [self.get_func_name(x) for x in value]
+        self.emit(1, 'valid_indexes = [index for index, func in enumerate((%s,)) if _ok(func, data)]'\
+                    % ', '.join(func_names))
+        self.emit(1, 'if not valid_indexes:')
+        self.emit_raise(2, 'oneOf', "'%r is not valid under any of the given schemas' % (data,)")
+        self.emit(1, 'if len(valid_indexes) > 1:')
+        self.emit(2, 'valid_indexes = valid_indexes[1:] + valid_indexes[:1]')
+        self.emit_raise(2, 'oneOf', "'%%r is valid under each of %%s' %% (data, ', '.join(repr(%s[x]) for x in valid_indexes))"\
+                    % self.add_const(value))
+
+    def emit_not(self, schema, value):
+        func_name = self.get_func_name(value)
+        self.emit(1, 'if _ok(%s, data):' % func_name)
+        self.emit_raise(2, 'not', "'%%r is not allowed for %%r' %% (%s, data)" % self.add_const(value))
+
+
+def compile_schema(schema_dict):
+    """
+    Compile "schema_dict" into a CompiledValidator.
+    Raises UnsupportedSchemaError if it can't be compiled.
+    """
+    if not isinstance(schema_dict, dict):
+        raise UnsupportedSchemaError('The schema must be an object')
+
+    try:
+        return SchemaCompiler(schema_dict).compile()
+    except re.error as err:
+        raise UnsupportedSchemaError('Invalid regular expression: %s' % err)
@@ -0,0 +1,190 @@
+"""
+Cheap pre-check run before the full Draft 4 validation
+
+Most invalid documents are missing a required key or have a value of
+the wrong type.  A summary of the schema's top level is made when a
+MetadataSchema is saved (MetadataSchema.schema_precheck):
+
+    {"type": ["object"],
+     "required": ["id", "name"],
+     "properties": {"id": {"type": ["integer"]},
+                    "license": {"enum": ["CC0", "CC-BY"]}}}
+
+SchemaPrecheck turns it into tuples and frozensets and checks a
+document with a few dict lookups and isinstance() calls:
+
+    precheck = get_schema_precheck(schema_dict, cache_key)
+    validation_err = precheck.check(data_dict)     # None if it passed
+
+The summary only holds constraints every valid document meets, so a
+document the pre-check rejects would also fail the full validation.
+Passing it proves nothing: the full validator still runs.
+Subschemas using "$ref" are left out, since Draft 4 ignores the
+keywords next to a "$ref".
+
+The error is a jsonschema ValidationError with jsonschema's message,
+so utils.format_error_message works unchanged.  When a document has
+several errors, it may not be the one the full validator reports first.
+"""
+from collections import OrderedDict, deque
+from numbers import Number
+from jsonschema import _utils
+from jsonschema.exceptions import ValidationError
+from django.conf import settings
+from apps.filemetadata.validator_cache import ValidatorCache, get_schema_content_key,\
+    DEFAULT_CACHE_MAX_SIZE, DEFAULT_CACHE_TTL
+
+# Draft 4 types, as jsonschema's Draft4Validator checks them
+TYPE_CHECKS = {
+    'array': lambda x: isinstance(x, list),
+    'boolean': lambda x: isinstance(x, bool),
+    'integer': lambda x: isinstance(x, int) and not isinstance(x, bool),
+    'null': lambda x: x is None,
+    'number': lambda x: isinstance(x, Number) and not isinstance(x, bool),
+    'object': lambda x: isinstance(x, dict),
+    'string': lambda x: isinstance(x, str),
+}
+
+
+def get_summary_types(schema):
+    """
+    The schema's "type" as a list, None if it can't be summarized
+    """
+    types = _utils.ensure_list(schema.get('type'))
+    if not types or [x for x in types if x not in TYPE_CHECKS]:
+        return None
+    return list(types)
+
+
+def get_summary_enum(schema):
+    """
+    The schema's "enum" if every value is hashable, else None
+    """
+    enum = schema.get('enum')
+    if not isinstance(enum, list) or [x for x in enum if isinstance(x, (dict, list))]:
+        return None
+    return enum
+
+
+def build_schema_precheck(schema_dict):
+    """
+    JSON ready summary of a schema's required keys, and its
+    properties' types and enums
+    """
+    summary = OrderedDict()
+    if not isinstance(schema_dict, dict) or '$ref' in schema_dict:
+        return summary
+
+    types = get_summary_types(schema_dict)
+    if types:
+        summary['type'] = types
+
+    required = schema_dict.get('required')
+    if isinstance(required, list) and [x for x in required if isinstance(x, str)] == required:
+        summary['required'] = required
+
+    properties = OrderedDict()
+    schema_properties = schema_dict.get('properties')
+    if isinstance(schema_properties, dict):
+        for name, subschema in schema_properties.items():
+            if not isinstance(subschema, dict) or '$ref' in subschema:
+                continue
+            prop_summary = OrderedDict()
+            types = get_summary_types(subschema)
+            if types:
+                prop_summary['type'] = types
+            enum = get_summary_enum(subschema)
+            if enum is not None:
+                prop_summary['enum'] = enum
+            if prop_summary:
+                properties[name] = prop_summary
+    if properties:
+        summary['properties'] = properties
+
+    return summary
+
+
+class SchemaPrecheck(object):
+    """
+    A schema summary, ready to check documents
+    """
+    def __init__(self, summary):
+        self.types = self.get_type_checks(summary.get('type'))
+        self.required = tuple(summary.get('required', ()))
+        # (name, type names, type checks, enum list, enum frozenset)
+        self.properties = tuple((name,\
+                                prop.get('type'),\
+                                self.get_type_checks(prop.get('type')),\
+                                prop.get('enum'),\
+                                frozenset(prop['enum']) if 'enum' in prop else None)\
+                                for name, prop in summary.get('properties', {}).items())
+
+    @staticmethod
+    def get_type_checks(types):
+        if not types:
+            return None
+        return (types, tuple(TYPE_CHECKS[x] for x in types))
+
+    @staticmethod
+    def is_type(value, type_checks):
+        for check in type_checks[1]:
+            if check(value):
+                return True
+        return False
+
+    def check(self, data):
+        """
+        ValidationError for an obviously invalid document, None if it passed
+        """
+        if self.types is not None and not self.is_type(data, self.types):
+            return ValidationError(_utils.types_msg(data, self.types[0]), validator='type',\
+                                validator_value=self.types[0], instance=data,\
+                                schema_path=deque(['type']))
+        if not isinstance(data, dict):
+            return None
+
+        for name in self.required:
+            if name not in data:
+                return ValidationError('%r is a required property' % name,\
+                                    validator='required', validator_value=list(self.required),\
+                                    instance=data, schema_path=deque(['required']))
+
+        for name, types, type_checks, enum, enum_set in self.properties:
+            if name not in data:
+                continue
+            value = data[name]
+            if type_checks is not None and not self.is_type(value, type_checks):
+                return ValidationError(_utils.types_msg(value, types), validator='type',\
+                                    validator_value=types, instance=value, path=deque([name]),\
+                                    schema_path=deque(['properties', name, 'type']))
+            if enum_set is not None and not self.in_enum(value, enum_set):
+                return ValidationError('%r is not one of %r' % (value, enum), validator='enum',\
+                                    validator_value=enum, instance=value, path=deque([name]),\
+                                    schema_path=deque(['properties', name, 'enum']))
+        return None
+
+    @staticmethod
+    def in_enum(value, enum_set):
+        try:
+            return value in enum_set
+        except TypeError:
+            return False    # unhashable: a list or object is never in a hashable enum
+
+
+# Kept apart from the VALIDATOR_CACHE so pre-checks don't evict validators
+PRECHECK_CACHE = ValidatorCache(\
+    max_size=getattr(settings, 'VALIDATOR_CACHE_MAX_SIZE', DEFAULT_CACHE_MAX_SIZE),\
+    ttl=getattr(settings, 'VALIDATOR_CACHE_TTL', DEFAULT_CACHE_TTL))
+
+
+def get_schema_precheck(schema_dict, cache_key=None, summary=None):
+    """
+    Return a (cached) SchemaPrecheck for "schema_dict", made from the
+    stored "summary" if there is one.  "cache_key" is as for
+    utils.get_schema_validator
+    """
+    if cache_key is None:
+        cache_key = get_schema_content_key(schema_dict)
+
+    return PRECHECK_CACHE.get_or_build(cache_key,\
+                    lambda: SchemaPrecheck(summary or build_schema_precheck(schema_dict)))
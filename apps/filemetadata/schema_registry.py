@@ -0,0 +1,298 @@
+"""
+Process-wide registry of published MetadataSchema objects
+
+Schemas are indexed by slug and then by sorted version, so the API can
+find "the latest version" or an exact version without a query:
+
+    SCHEMA_REGISTRY.get_schema('example')           # latest published version
+    SCHEMA_REGISTRY.get_schema('example', '2.0')
+
+Every published schema is loaded at once, when the worker starts
+(config/wsgi.py) or on first use.  The full load goes through the
+RESPONSE_CACHE: when every worker starts at once after a deploy, one
+of them reads the schemas from the database (single-flight lock) and
+the others reuse its result from the shared cache.  A process forked after the load,
+e.g. a gunicorn --preload worker, loads them again on first use and
+starts its own listener (below).  Schema versions rarely change, so
+entries are only dropped when a schema is saved or deleted:
+    - the post_save/post_delete signals mark the schema's slug stale in
+      this process, which reloads just that slug on its next lookup
+    - once the transaction commits, the change is published on a Redis
+      channel.  Every worker, on every node, listens to that channel
+      and marks the slug stale too.
+
+Redis is used when the "default" cache (SCHEMA_REGISTRY_CACHE_ALIAS) is
+django_redis, as in production.  Without it (e.g. local development
+with a single process) only the local registry is updated.
+
+As a safety net, e.g. for QuerySet.update() calls that send no
+signals, the whole registry is reloaded every SCHEMA_REGISTRY_MAX_AGE
+seconds.
+"""
+import bisect
+import json
+import logging
+import os
+import threading
+import time
+from decimal import Decimal, InvalidOperation
+from django.conf import settings
+from django.db import transaction, DatabaseError
+from django.db.models.signals import post_save, post_delete
+from django.dispatch import receiver
+from apps.filemetadata.models import MetadataSchema
+from apps.filemetadata.response_cache import RESPONSE_CACHE
+
+LOGGER = logging.getLogger(__name__)
+
+REGISTRY_CHANNEL = 'filemetadata:schema-registry'
+
+DEFAULT_REGISTRY_MAX_AGE = 60 * 60     # seconds
+
+# seconds to wait before reconnecting to Redis
+LISTENER_RETRY_WAIT = 5
+
+
+def get_redis_client():
+    """
+    Redis client of the django_redis cache, or None if the cache isn't django_redis
+    """
+    cache_alias = getattr(settings, 'SCHEMA_REGISTRY_CACHE_ALIAS', 'default')
+    cache_backend = settings.CACHES.get(cache_alias, {}).get('BACKEND', '')
+    if not cache_backend.startswith('django_redis.'):
+        return None
+
+    from django_redis import get_redis_connection
+    return get_redis_connection(cache_alias)
+
+
+def read_published_schemas():
+    return list(MetadataSchema.objects.filter(published=True).order_by('slug', 'version'))
+
+
+class SchemaRegistry(object):
+    """
+    Published schemas by slug, each slug's versions sorted ascending
+    """
+    def __init__(self, max_age=DEFAULT_REGISTRY_MAX_AGE):
+        self.max_age = max_age
+        self._lock = threading.RLock()
+
+        # slug -> ([versions], [MetadataSchema]), both sorted by version
+        self._schemas = {}
+        # schema id -> slug, to drop a schema whose slug changed
+        self._slugs_by_id = {}
+        # slug -> token.  Each invalidation makes a new token so a reload
+        # that started before it doesn't mark the slug fresh.
+        self._stale_slugs = {}
+
+        self._loaded_at = None
+        self._load_token = object()
+
+        self._listener_pid = None
+        # process that loaded the schemas: a worker forked after the
+        # load (gunicorn --preload) reloads, and starts its own listener
+        self._loaded_pid = None
+
+    def _set_slug(self, slug, schemas):
+        """
+        Replace a slug's schemas.  Call with the lock held.
+        """
+        for schema_id in [k for k, v in self._slugs_by_id.items() if v == slug]:
+            del self._slugs_by_id[schema_id]
+
+        if schemas:
+            self._schemas[slug] = ([x.version for x in schemas], schemas)
+            for mschema in schemas:
+                self._slugs_by_id[mschema.id] = slug
+        else:
+            self._schemas.pop(slug, None)
+
+    def load(self):
+        """
+        Load every published schema
+        """
+        with self._lock:
+            load_token = self._load_token
+            stale_at_start = dict(self._stale_slugs)
+
+        schemas_by_slug = {}
+        for mschema in RESPONSE_CACHE.get_or_build(('schema-registry',), read_published_schemas):
+            schemas_by_slug.setdefault(mschema.slug, []).append(mschema)
+
+        with self._lock:
+            self._schemas = {}
+            self._slugs_by_id = {}
+            for slug, schemas in schemas_by_slug.items():
+                self._set_slug(slug, schemas)
+
+            # keep the slugs invalidated while loading
+            for slug, token in stale_at_start.items():
+                if self._stale_slugs.get(slug) is token:
+                    del self._stale_slugs[slug]
+            if self._load_token is load_token:
+                self._loaded_at = time.time()
+                self._loaded_pid = os.getpid()
+
+        self.start_listener()
+
+    def reload_slug(self, slug):
+        """
+        Load the published versions of one slug
+        """
+        with self._lock:
+            token = self._stale_slugs.get(slug)
+
+        schemas = list(MetadataSchema.objects.filter(slug=slug, published=True).order_by('version'))
+
+        with self._lock:
+            self._set_slug(slug, schemas)
+            if self._stale_slugs.get(slug) is token:
+                self._stale_slugs.pop(slug, None)
+
+    def is_expired(self):
+        if self._loaded_at is None or self._loaded_pid != os.getpid():
+            return True
+        return self.max_age is not None and (time.time() - self._loaded_at) > self.max_age
+
+    def get_versions(self, slug):
+        """
+        ([versions], [MetadataSchema]) of a slug's published schemas
+        """
+        if self.is_expired():
+            self.load()
+        if slug in self._stale_slugs:
+            self.reload_slug(slug)
+
+        return self._schemas.get(slug, ([], []))
+
+    def get_schema(self, slug, version=None):
+        """
+        The published MetadataSchema with this slug and version, or the
+        latest version if "version" is None.  None if there isn't one.
+        """
+        versions, schemas = self.get_versions(slug)
+        if not schemas:
+            return None
+        if version is None:
+            return schemas[-1]
+
+        try:
+            version = Decimal(version)
+        except InvalidOperation:
+            return None
+        idx = bisect.bisect_left(versions, version)
+        if idx < len(versions) and versions[idx] == version:
+            return schemas[idx]
+        return None
+
+    def invalidate(self, schema_id=None, slug=None):
+        """
+        Mark a schema's slugs (current and, if it changed, previous) stale
+        """
+        with self._lock:
+            slugs = set([slug]) if slug else set()
+            if schema_id in self._slugs_by_id:
+                slugs.add(self._slugs_by_id[schema_id])
+            for stale_slug in slugs:
+                self._stale_slugs[stale_slug] = object()
+
+    def clear(self):
+        """
+        Reload everything on the next lookup
+        """
+        with self._lock:
+            self._schemas = {}
+            self._slugs_by_id = {}
+            self._stale_slugs = {}
+            self._loaded_at = None
+            self._load_token = object()
+
+    def handle_message(self, message_data):
+        """
+        Apply an invalidation published by publish_invalidation()
+        """
+        try:
+            message = json.loads(message_data.decode('utf-8')\
+                                if isinstance(message_data, bytes) else message_data)
+            self.invalidate(schema_id=message.get('id'), slug=message.get('slug'))
+        except (ValueError, AttributeError):
+            LOGGER.warning('Ignored schema registry message: %r', message_data)
+
+    def start_listener(self):
+        """
+        Listen for invalidations from other workers, once per process
+        """
+        if self._listener_pid == os.getpid():
+            return
+        redis_client = get_redis_client()
+        if redis_client is None:
+            return
+
+        self._listener_pid = os.getpid()
+        listener = threading.Thread(target=self.listen, args=(redis_client,),\
+                                    name='schema-registry-listener')
+        listener.daemon = True
+        listener.start()
+
+    def listen(self, redis_client):
+        """
+        Apply the messages on REGISTRY_CHANNEL, reconnecting if Redis goes away
+        """
+        is_reconnect = False
+        while True:
+            try:
+                pubsub = redis_client.pubsub(ignore_subscribe_messages=True)
+                pubsub.subscribe(REGISTRY_CHANNEL)
+                if is_reconnect:
+                    # messages may have been missed while disconnected
+                    self.clear()
+                is_reconnect = True
+                for message in pubsub.listen():
+                    if message.get('type') == 'message':
+                        self.handle_message(message['data'])
+            except Exception:
+                LOGGER.exception('Schema registry listener lost its Redis connection')
+                time.sleep(LISTENER_RETRY_WAIT)
+
+
+SCHEMA_REGISTRY = SchemaRegistry(max_age=getattr(settings, 'SCHEMA_REGISTRY_MAX_AGE',\
+                                                DEFAULT_REGISTRY_MAX_AGE))
+
+
+def publish_invalidation(schema_id, slug):
+    """
+    Tell the other workers that a schema changed
+    """
+    redis_client = get_redis_client()
+    if redis_client is None:
+        return
+    try:
+        redis_client.publish(REGISTRY_CHANNEL, json.dumps(dict(id=schema_id, slug=slug)))
+    except Exception:
+        LOGGER.exception('Could not publish a schema registry invalidation')
+
+
+def warm_schema_registry():
+    """
+    Load the registry when a worker starts, from the shared cache if
+    another worker already read it.  If the database isn't ready, it's
+    loaded on first use instead.
+    """
+    try:
+        SCHEMA_REGISTRY.load()
+    except DatabaseError:
+        LOGGER.warning('Schema registry not loaded at startup', exc_info=True)
+
+
+@receiver(post_save, sender=MetadataSchema)
+@receiver(post_delete, sender=MetadataSchema)
+def invalidate_saved_schema(sender, instance, **kwargs):
+    schema_id, slug = instance.id, instance.slug
+    SCHEMA_REGISTRY.invalidate(schema_id=schema_id, slug=slug)
+
+    def on_commit():
+        # again, in case another thread reloaded the uncommitted rows
+        SCHEMA_REGISTRY.invalidate(schema_id=schema_id, slug=slug)
+        publish_invalidation(schema_id, slug)
+    transaction.on_commit(on_commit)
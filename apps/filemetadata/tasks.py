@@ -0,0 +1,148 @@
+"""
+Celery tasks to revalidate a schema's FileMetadata after the schema is saved
+
+    revalidate_schema_filemetadata(schema_id)
+        - creates a SchemaRevalidationReport
+        - splits the schema's FileMetadata into primary key ranges
+        - runs revalidate_filemetadata_chunk for each range, in parallel,
+          as a chord whose callback, finish_revalidation_report,
+          combines the chunk results into the report
+"""
+import json
+from collections import OrderedDict
+from celery import shared_task, chord
+from django.db import connection
+from django.utils import timezone
+from apps.filemetadata.models import MetadataSchema, FileMetadata, SchemaRevalidationReport,\
+    REVALIDATION_STATUS_COMPLETE, REVALIDATION_STATUS_FAILED
+from apps.filemetadata.utils import validate_filemetadata
+
+# primary key range of FileMetadata per chunk task
+REVALIDATION_CHUNK_SIZE = 5000
+
+# invalid records kept in a report
+REVALIDATION_SAMPLE_SIZE = 25
+
+
+def get_id_ranges(min_id, max_id, chunk_size=None):
+    """
+    [(start id, end id), ...] covering min_id to max_id, end ids excluded
+    """
+    if chunk_size is None:
+        chunk_size = REVALIDATION_CHUNK_SIZE
+    return [(start_id, min(start_id + chunk_size, max_id + 1))\
+            for start_id in range(min_id, max_id + 1, chunk_size)]
+
+
+@shared_task
+def revalidate_filemetadata_chunk(schema_id, start_id, end_id):
+    """
+    Validate the schema's FileMetadata with ids from start_id up to end_id.
+    Returns dict(num_checked=.., num_invalid=.., invalid_samples=[..])
+    """
+    mschema = MetadataSchema.objects.get(pk=schema_id)
+    schema_dict = mschema.get_schema_dict()
+    cache_key = mschema.get_validator_cache_key()
+
+    # key order doesn't matter here: on PostgreSQL read the jsonb copy,
+    # decoded by psycopg2, instead of the ordered text
+    metadata_column = 'metadata_jsonb' if connection.vendor == 'postgresql' else 'metadata'
+
+    # the installation limits the scan to its partition (see partitioning.py)
+    fm_rows = FileMetadata.objects.filter(schema_id=schema_id, id__gte=start_id, id__lt=end_id,\
+                        dataverse_installation_id=mschema.dataverse_installation_id)\
+                        .order_by('id')\
+                        .values_list('id', 'datafile_id', 'version', metadata_column)
+
+    num_checked = 0
+    num_invalid = 0
+    invalid_samples = []
+    for fm_id, datafile_id, version, metadata in fm_rows.iterator():
+        if metadata is None:
+            # a row whose jsonb copy was never filled
+            metadata = FileMetadata.objects.get(pk=fm_id).metadata
+        elif isinstance(metadata, str):
+            # values_list() skips the JSONField's decoding
+            metadata = json.loads(metadata, object_pairs_hook=OrderedDict)
+
+        num_checked += 1
+        success, err_msgs = validate_filemetadata(schema_dict, metadata, cache_key=cache_key)
+        if success:
+            continue
+
+        num_invalid += 1
+        if len(invalid_samples) < REVALIDATION_SAMPLE_SIZE:
+            invalid_samples.append(OrderedDict([('id', fm_id),\
+                                            ('datafile_id', datafile_id),\
+                                            ('version', version),\
+                                            ('errors', err_msgs)]))
+
+    return dict(num_checked=num_checked,\
+                num_invalid=num_invalid,\
+                invalid_samples=invalid_samples)
+
+
+@shared_task
+def finish_revalidation_report(chunk_results, report_id):
+    """
+    Combine the chunk results into the report
+    """
+    report = SchemaRevalidationReport.objects.get(pk=report_id)
+
+    invalid_samples = []
+    for result in chunk_results:
+        report.num_checked += result['num_checked']
+        report.num_invalid += result['num_invalid']
+        invalid_samples.extend(result['invalid_samples'])
+
+    report.invalid_samples = sorted(invalid_samples, key=lambda x: x['id'])[:REVALIDATION_SAMPLE_SIZE]
+    report.status = REVALIDATION_STATUS_COMPLETE
+    report.finished = timezone.now()
+    report.save()
+    return report.id
+
+
+@shared_task
+def mark_revalidation_failed(task_id, report_id):
+    """
+    Error callback of the chord
+    """
+    SchemaRevalidationReport.objects.filter(pk=report_id)\
+        .update(status=REVALIDATION_STATUS_FAILED, finished=timezone.now())
+
+
+@shared_task
+def revalidate_schema_filemetadata(schema_id):
+    """
+    Start revalidating all of the schema's FileMetadata, return the report id
+    """
+    mschema = MetadataSchema.objects.filter(pk=schema_id)\
+                        .only('id', 'schema_hash', 'dataverse_installation_id').first()
+    if mschema is None:
+        return None     # deleted since the task was queued
+
+    id_range = FileMetadata.objects.filter(schema_id=schema_id,\
+                        dataverse_installation_id=mschema.dataverse_installation_id)\
+                        .order_by('id')\
+                        .values_list('id', flat=True)
+    min_id = id_range.first()
+    max_id = id_range.last()
+
+    id_ranges = []
+    if min_id is not None:
+        id_ranges = get_id_ranges(min_id, max_id)
+
+    report = SchemaRevalidationReport.objects.create(schema_id=schema_id,\
+                                            schema_hash=mschema.schema_hash,\
+                                            num_chunks=len(id_ranges))
+    if not id_ranges:
+        finish_revalidation_report([], report.id)
+        return report.id
+
+    chunk_tasks = [revalidate_filemetadata_chunk.s(schema_id, start_id, end_id)\
+                    for start_id, end_id in id_ranges]
+    finish_task = finish_revalidation_report.s(report.id)
+    finish_task.link_error(mark_revalidation_failed.s(report.id))
+    chord(chunk_tasks)(finish_task)
+
+    return report.id
@@ -0,0 +1,103 @@
+from django.contrib.auth import get_user_model
+from django.core.urlresolvers import reverse
+from django.db import connection
+from django.test import TestCase, override_settings
+from django.test.utils import CaptureQueriesContext
+from apps.filemetadata.models import MetadataSchema, FileMetadata
+
+ADMIN_MIDDLEWARE = ['django.contrib.sessions.middleware.SessionMiddleware',\
+    'django.contrib.auth.middleware.AuthenticationMiddleware',\
+    'django.contrib.messages.middleware.MessageMiddleware']
+
+# "table"."column" of the JSON columns that list pages must not fetch
+JSON_COLUMN_SQL = ['"filemetadata_filemetadata"."metadata"',\
+    '"filemetadata_filemetadata"."metadata_jsonb"',\
+    '"filemetadata_metadataschema"."schema"',\
+    '"filemetadata_metadataschema"."schema_json"',\
+    '"filemetadata_metadataschema"."schema_json_pretty"',\
+    '"filemetadata_metadataschema"."schema_jsonb"',\
+    '"filemetadata_metadataschema"."schema_json_gzip"',\
+    '"filemetadata_metadataschema"."schema_json_br"']
+
+
+@override_settings(MIDDLEWARE_CLASSES=ADMIN_MIDDLEWARE)
+class AdminChangelistTestCase(TestCase):
+
+    fixtures = ['test_schemas.json']
+
+    def setUp(self):
+        get_user_model().objects.create_superuser('admin', 'admin@example.com', 'pw')
+        self.client.login(username='admin', password='pw')
+
+    def add_filemetadata(self, num_rows):
+        start = FileMetadata.objects.count()
+        for datafile_id in range(start, start + num_rows):
+            FileMetadata.objects.create(schema=MetadataSchema.objects.get(pk=1 + datafile_id % 3),\
+                                    datafile_id=datafile_id,\
+                                    metadata={'id': datafile_id, 'name': 'n'})
+
+    def get_changelist_queries(self, url_name):
+        with CaptureQueriesContext(connection) as queries:
+            resp = self.client.get(reverse(url_name))
+        self.assertEqual(resp.status_code, 200)
+        return [x['sql'] for x in queries.captured_queries]
+
+    def test_01_filemetadata_changelist(self):
+        """The number of queries doesn't grow with the rows and no JSON is fetched"""
+        url_name = 'admin:filemetadata_filemetadata_changelist'
+        self.add_filemetadata(2)
+        num_queries = len(self.get_changelist_queries(url_name))
+
+        self.add_filemetadata(10)
+        queries = self.get_changelist_queries(url_name)
+        self.assertEqual(len(queries), num_queries)
+        for sql in queries:
+            for column_sql in JSON_COLUMN_SQL:
+                self.assertNotIn(column_sql, sql)
+
+    def test_02_schema_changelist(self):
+        """The schema list page doesn't fetch the schema JSON"""
+        for sql in self.get_changelist_queries('admin:filemetadata_metadataschema_changelist'):
+            for column_sql in JSON_COLUMN_SQL:
+                self.assertNotIn(column_sql, sql)
+
+    def test_03_change_form(self):
+        """The change form still has the metadata"""
+        self.add_filemetadata(1)
+        fmeta = FileMetadata.objects.first()
+        resp = self.client.get(reverse('admin:filemetadata_filemetadata_change', args=(fmeta.id,)))
+        self.assertContains(resp, '&quot;name&quot;:&quot;n&quot;')
+
+    def test_04_change_form_saves_version(self):
+        """Metadata edited in the admin is saved as a new version"""
+        self.add_filemetadata(1)
+        fmeta = FileMetadata.objects.first()
+        change_url = reverse('admin:filemetadata_filemetadata_change', args=(fmeta.id,))
+        form_data = dict(schema=fmeta.schema_id, datafile_id=fmeta.datafile_id, published='on',\
+                        metadata='{"id": 0, "name": "edited"}')
+        resp = self.client.post(change_url, form_data)
+        self.assertEqual(resp.status_code, 302)
+        fmeta = FileMetadata.objects.get(pk=fmeta.id)
+        self.assertEqual((fmeta.version, fmeta.metadata['name']), (2, 'edited'))
+        self.assertEqual(fmeta.revisions.get().version, 1)
+
+        # unchanged metadata: the other fields are still saved
+        resp = self.client.post(change_url, dict(form_data, datafile_id=5))
+        self.assertEqual(resp.status_code, 302)
+        fmeta = FileMetadata.objects.get(pk=fmeta.id)
+        self.assertEqual((fmeta.version, fmeta.datafile_id), (2, 5))
+
+    def test_05_change_form_version_taken(self):
+        """An edit whose next version is already its own row is a form error, not a 500"""
+        self.add_filemetadata(1)
+        fmeta = FileMetadata.objects.first()
+        FileMetadata.objects.create(schema=fmeta.schema, datafile_id=fmeta.datafile_id, version=2,\
+                                metadata={'id': 0, 'name': 'v2'})
+        change_url = reverse('admin:filemetadata_filemetadata_change', args=(fmeta.id,))
+        resp = self.client.post(change_url, dict(schema=fmeta.schema_id,\
+                                                datafile_id=fmeta.datafile_id, published='on',\
+                                                metadata='{"id": 0, "name": "edited"}'))
+        self.assertEqual(resp.status_code, 200)
+        self.assertContains(resp, 'Version 2 of this file metadata is already saved')
+        fmeta = FileMetadata.objects.get(pk=fmeta.id)
+        self.assertEqual((fmeta.version, fmeta.metadata['name']), (1, 'n'))
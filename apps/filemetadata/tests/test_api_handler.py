@@ -0,0 +1,49 @@
+import json
+from django.core.urlresolvers import set_urlconf
+from django.test import TestCase, RequestFactory
+from apps.filemetadata.api_handler import SchemaAPIHandler
+from apps.filemetadata.schema_registry import SCHEMA_REGISTRY
+from apps.filemetadata.views import validate
+
+
+class SchemaAPIHandlerTestCase(TestCase):
+
+    fixtures = ['test_schemas.json']
+
+    def setUp(self):
+        SCHEMA_REGISTRY.clear()
+        self.handler = SchemaAPIHandler()
+        self.handler.load_middleware()
+        self.factory = RequestFactory()
+
+    def tearDown(self):
+        set_urlconf(None)
+
+    def test_01_short_middleware_list(self):
+        """Only the API middleware is loaded, and views aren't made atomic"""
+        with self.settings(SCHEMA_API_MIDDLEWARE_CLASSES=()):
+            self.handler.load_middleware()
+        self.assertEqual(self.handler._request_middleware, [])
+        self.assertEqual(self.handler._response_middleware, [])
+        self.assertIs(self.handler.make_view_atomic(validate), validate)
+
+    def test_02_schema_paths(self):
+        """Schema GETs and validation are served at their usual paths, nothing else"""
+        resp = self.handler.get_response(self.factory.get('/api/metadata/schema/example/1.00'))
+        self.assertEqual(resp.status_code, 200)
+        self.assertEqual(json.loads(resp.content.decode('utf-8'))['self']['url'],\
+                        '/api/metadata/schema/example/1.00')
+        resp = self.handler.get_response(self.factory.get('/api/metadata/schema-list'))
+        self.assertEqual(resp.status_code, 200)
+
+        # no CSRF middleware, no session cookie
+        resp = self.handler.get_response(\
+                    self.factory.post('/api/metadata/schema/example/1.00/validate',\
+                                    json.dumps({'id': 1}), content_type='application/json'))
+        self.assertEqual(resp.status_code, 200)
+        self.assertTrue(json.loads(resp.content.decode('utf-8'))['valid'])
+        self.assertNotIn('Set-Cookie', resp)
+
+        for path in ['/api/metadata/file-metadata/search', '/admin/']:
+            resp = self.handler.get_response(self.factory.get(path))
+            self.assertEqual(resp.status_code, 404)
@@ -0,0 +1,105 @@
+import csv
+import gzip
+import io
+import json
+import os
+import shutil
+import tempfile
+from collections import OrderedDict
+from django.core.management import call_command
+from django.contrib.auth import get_user_model
+from django.contrib.auth.models import Permission
+from django.core.urlresolvers import reverse
+from django.test import TestCase, override_settings
+from apps.filemetadata.models import MetadataSchema, FileMetadata
+from apps.filemetadata.bulk_export import get_export_queryset, iter_export_rows,\
+    parse_modified_since, iter_export_blocks
+
+AUTH_MIDDLEWARE = ['django.contrib.sessions.middleware.SessionMiddleware',\
+    'django.contrib.auth.middleware.AuthenticationMiddleware']
+
+class ExportFileMetadataTestCase(TestCase):
+
+    fixtures = ['test_schemas.json']
+
+    def setUp(self):
+        for schema_id, datafile_id in [(2, 1), (2, 2), (3, 3)]:
+            FileMetadata.objects.create(schema=MetadataSchema.objects.get(pk=schema_id),\
+                        datafile_id=datafile_id,\
+                        metadata=OrderedDict([('name', 'n'), ('id', datafile_id)]))
+
+    def test_01_chunked_rows(self):
+        """Rows are read in id order across chunks"""
+        rows = list(iter_export_rows(get_export_queryset(), chunk_size=2))
+        self.assertEqual([x[3] for x in rows], [1, 2, 3])
+
+        fm_qs = get_export_queryset(schema='example', schema_version='2')
+        self.assertEqual(fm_qs.count(), 2)
+        self.assertEqual(get_export_queryset(installation='other').count(), 0)
+        self.assertEqual(get_export_queryset(modified_since=parse_modified_since('2999-01-01')).count(), 0)
+        self.assertRaises(ValueError, parse_modified_since, 'yesterday')
+
+    def test_02_blocks(self):
+        """Lines are joined into blocks and optionally gzipped"""
+        lines = ['%s\n' % x for x in range(100)]
+        blocks = list(iter_export_blocks(lines, block_size=50))
+        self.assertTrue(len(blocks) > 1)
+        self.assertEqual(b''.join(blocks).decode('utf-8'), ''.join(lines))
+
+        gzip_data = b''.join(iter_export_blocks(lines, use_gzip=True, block_size=50))
+        self.assertEqual(gzip.decompress(gzip_data).decode('utf-8'), ''.join(lines))
+
+    def test_03_command(self):
+        """Export to a gzipped NDJSON file and to CSV"""
+        tmp_dir = tempfile.mkdtemp()
+        try:
+            ndjson_fname = os.path.join(tmp_dir, 'export.ndjson.gz')
+            call_command('export_filemetadata', ndjson_fname, gzip=True)
+            with gzip.open(ndjson_fname, 'rt', encoding='utf-8') as export_file:
+                records = [json.loads(x, object_pairs_hook=OrderedDict) for x in export_file]
+            self.assertEqual([x['datafile_id'] for x in records], [1, 2, 3])
+            self.assertEqual(records[0]['schema'], 'example')
+            self.assertEqual(records[0]['schema_version'], 2.0)
+            self.assertEqual(list(records[0]['metadata'].keys()), ['name', 'id'])
+
+            csv_fname = os.path.join(tmp_dir, 'export.csv')
+            call_command('export_filemetadata', csv_fname, format='csv', schema_version='3')
+            with open(csv_fname, encoding='utf-8', newline='') as export_file:
+                rows = list(csv.DictReader(export_file))
+            self.assertEqual(len(rows), 1)
+            self.assertEqual(rows[0]['published'], 'true')
+            self.assertEqual(json.loads(rows[0]['metadata']), {'name': 'n', 'id': 3})
+        finally:
+            shutil.rmtree(tmp_dir)
+
+    def test_04_view(self):
+        """Streaming export API"""
+        export_url = reverse('export_filemetadata')
+        resp = self.client.get(export_url, {'schema': 'example'})
+        self.assertEqual(resp.status_code, 200)
+        self.assertEqual(resp['Content-Type'], 'application/x-ndjson')
+        lines = b''.join(resp.streaming_content).decode('utf-8').splitlines()
+        self.assertEqual(len(lines), 3)
+
+        resp = self.client.get(export_url, {'format': 'csv', 'gzip': ''})
+        self.assertEqual(resp['Content-Type'], 'application/gzip')
+        csv_text = gzip.decompress(b''.join(resp.streaming_content)).decode('utf-8')
+        self.assertEqual(len(list(csv.reader(io.StringIO(csv_text)))), 4)
+
+        for params in [{'format': 'xml'}, {'modified_since': 'x'}, {'schema_version': 'x'}]:
+            self.assertEqual(self.client.get(export_url, params).status_code, 400)
+
+    @override_settings(MIDDLEWARE_CLASSES=AUTH_MIDDLEWARE)
+    def test_05_view_unpublished(self):
+        """Unpublished FileMetadata are only exported for users who may change them"""
+        FileMetadata.objects.filter(datafile_id=2).update(published=False)
+        export_url = reverse('export_filemetadata')
+        resp = self.client.get(export_url)
+        records = [json.loads(x) for x in b''.join(resp.streaming_content).decode('utf-8').splitlines()]
+        self.assertEqual([x['datafile_id'] for x in records], [1, 3])
+
+        user = get_user_model().objects.create_user('editor', 'editor@example.com', 'pw')
+        user.user_permissions.add(Permission.objects.get(codename='change_filemetadata'))
+        self.client.login(username='editor', password='pw')
+        resp = self.client.get(export_url)
+        self.assertEqual(len(b''.join(resp.streaming_content).decode('utf-8').splitlines()), 3)
@@ -0,0 +1,75 @@
+import json
+import os
+import shutil
+import tempfile
+from django.core.management import call_command
+from django.test import TestCase
+from django.utils.six import StringIO
+from apps.filemetadata.models import FileMetadata
+
+
+class ImportFileMetadataTestCase(TestCase):
+
+    fixtures = ['test_schemas.json']
+
+    def setUp(self):
+        self.tmp_dir = tempfile.mkdtemp()
+        self.errors_fname = os.path.join(self.tmp_dir, 'errors.ndjson')
+
+    def tearDown(self):
+        shutil.rmtree(self.tmp_dir)
+
+    def write_input(self, fname, content):
+        input_fname = os.path.join(self.tmp_dir, fname)
+        with open(input_fname, 'w', encoding='utf-8') as input_file:
+            input_file.write(content)
+        return input_fname
+
+    def run_import(self, input_fname, **options):
+        stdout = StringIO()
+        call_command('import_filemetadata', input_fname, errors=self.errors_fname,\
+                    stdout=stdout, **options)
+        with open(self.errors_fname, encoding='utf-8') as errors_file:
+            rejects = [json.loads(line) for line in errors_file]
+        return stdout.getvalue(), rejects
+
+    def test_01_ndjson(self):
+        """NDJSON records are validated, imported in batches and rejects written out"""
+        lines = [{'schema': 'example', 'schema_version': 2, 'datafile_id': 1,\
+                  'metadata': {'id': 1, 'name': 'n'}},
+                 {'schema': 'example', 'schema_version': 2, 'datafile_id': 2,\
+                  'metadata': {'id': 'x', 'name': 'n'}},
+                 {'schema': 'example', 'datafile_id': 3, 'published': False,\
+                  'metadata': {'id': 3, 'name': 'n', 'price': 1}},
+                 {'schema': 'example', 'schema_version': 2, 'datafile_id': 1,\
+                  'metadata': {'id': 1, 'name': 'n'}},
+                 {'schema': 'nope', 'datafile_id': 4, 'metadata': {}}]
+        content = '\n'.join(json.dumps(x) for x in lines) + '\n\n{not json\n'
+        input_fname = self.write_input('metadata.ndjson', content)
+
+        output, rejects = self.run_import(input_fname, batch_size=2, workers=1)
+        self.assertIn('Imported: 2, rejected: 4', output)
+
+        fm_latest = FileMetadata.objects.get(datafile_id=3)
+        self.assertEqual(str(fm_latest.schema.version), '3.00')
+        self.assertEqual(fm_latest.published, False)
+        self.assertEqual(fm_latest.metadata_jsonb, {'id': 3, 'name': 'n', 'price': 1})
+        self.assertEqual(fm_latest.indexed_values.get(pointer='/price').value, '1')
+
+        self.assertEqual([x['line'] for x in rejects], [2, 4, 5, 7])
+        self.assertEqual(rejects[0]['errors'][0], 'Error Location: id')
+        self.assertEqual(rejects[3]['record'], '{not json')
+
+    def test_02_csv_with_pool(self):
+        """CSV input validated in worker processes"""
+        content = 'datafile_id,version,metadata\n'\
+                  '10,1,"{""id"": 10, ""name"": ""n""}"\n'\
+                  '11,1,"{""name"": ""n""}"\n'
+        input_fname = self.write_input('metadata.csv', content)
+
+        output, rejects = self.run_import(input_fname, workers=2,\
+                                        schema='example', schema_version='2')
+        self.assertIn('Imported: 1, rejected: 1', output)
+        self.assertEqual(FileMetadata.objects.get(datafile_id=10).metadata['id'], 10)
+        self.assertEqual(rejects[0]['line'], 3)
+        self.assertEqual(rejects[0]['errors'][0], "Error: 'id' is a required property")
@@ -0,0 +1,118 @@
+import json
+from django.core.urlresolvers import reverse
+from django.test import TestCase, override_settings
+from apps.filemetadata.json_patch import make_json_patch, apply_json_patch, JsonPatchError
+from apps.filemetadata.metadata_history import save_metadata_version, get_metadata_version,\
+    diff_metadata_versions, VersionTakenError
+from apps.filemetadata.models import MetadataSchema, FileMetadata, FileMetadataRevision
+
+
+class JsonPatchTestCase(TestCase):
+
+    def test_01_diff_and_apply(self):
+        """Applying the diff of two documents gives the second one"""
+        pairs = [({'a': 1, 'b': [1, 2, 3], 'c': {'d': 'x'}},\
+                {'a': 1.5, 'b': [1, 4], 'c': {'e/f': None}, 'g': True}),\
+                ({'a': [1]}, {'a': [1, 2, [3]]}),\
+                ({'a': 1}, {'a': True}),\
+                ([], {'a': 1}),\
+                ({'a': {'b': 1}}, {'a': {'b': 1}})]
+        for source, target in pairs:
+            patch = make_json_patch(source, target)
+            self.assertEqual(json.dumps(apply_json_patch(source, patch), sort_keys=True),\
+                            json.dumps(target, sort_keys=True))
+        self.assertEqual(make_json_patch({'a': {'b': 1}}, {'a': {'b': 1}}), [])
+
+    def test_02_rfc6902_operations(self):
+        """move, copy and test operations, and invalid patches"""
+        doc = {'a': {'b': [1, 2]}, 'c': 'x'}
+        patched = apply_json_patch(doc, [{'op': 'move', 'from': '/c', 'path': '/a/c'},\
+                                        {'op': 'copy', 'from': '/a/b/0', 'path': '/a/b/-'},\
+                                        {'op': 'test', 'path': '/a/c', 'value': 'x'}])
+        self.assertEqual(patched, {'a': {'b': [1, 2, 1], 'c': 'x'}})
+        self.assertEqual(doc, {'a': {'b': [1, 2]}, 'c': 'x'})
+
+        for patch in [[{'op': 'remove', 'path': '/nope'}],\
+                    [{'op': 'test', 'path': '/c', 'value': 'y'}],\
+                    [{'op': 'add', 'path': '/a/b/5', 'value': 1}],\
+                    [{'op': 'jump', 'path': '/c'}],\
+                    {'op': 'add'}]:
+            with self.assertRaises(JsonPatchError):
+                apply_json_patch(doc, patch)
+
+
+@override_settings(FILEMETADATA_SNAPSHOT_INTERVAL=3)
+class MetadataHistoryTestCase(TestCase):
+
+    fixtures = ['test_schemas.json']
+
+    def setUp(self):
+        self.fmeta = FileMetadata.objects.create(schema=MetadataSchema.objects.get(pk=2),\
+                                            datafile_id=1,\
+                                            metadata={'id': 1, 'name': 'v1', 'tags': []})
+        self.all_metadata = [self.fmeta.metadata]
+        for version in range(2, 9):
+            metadata = {'id': 1, 'name': 'v%s' % version, 'tags': list(range(version))}
+            save_metadata_version(self.fmeta, metadata)
+            self.all_metadata.append(metadata)
+
+    def test_01_versions(self):
+        """Every version can be rebuilt from patches and snapshots"""
+        self.assertEqual(self.fmeta.version, 8)
+        self.assertEqual(FileMetadataRevision.objects.count(), 7)
+        self.assertEqual(list(FileMetadataRevision.objects.filter(is_snapshot=True)\
+                            .order_by('version').values_list('version', flat=True)), [3, 6])
+
+        fmeta = FileMetadata.objects.get(pk=self.fmeta.pk)
+        for version, metadata in enumerate(self.all_metadata, 1):
+            self.assertEqual(dict(get_metadata_version(fmeta, version)), metadata)
+        with self.assertRaises(ValueError):
+            get_metadata_version(fmeta, 9)
+
+        # unchanged metadata isn't a new version
+        save_metadata_version(fmeta, self.all_metadata[-1])
+        self.assertEqual(fmeta.version, 8)
+
+        self.assertEqual(diff_metadata_versions(fmeta, 7, 8),\
+                        [{'op': 'replace', 'path': '/name', 'value': 'v8'},\
+                        {'op': 'add', 'path': '/tags/7', 'value': 7}])
+
+    def test_02_views(self):
+        """List, fetch and diff versions through the API"""
+        kwargs = dict(file_metadata_id=self.fmeta.pk)
+        resp = self.client.get(reverse('view_filemetadata_versions', kwargs=kwargs))
+        versions = json.loads(resp.content.decode('utf-8'))['versions']
+        self.assertEqual([x['version'] for x in versions], list(range(1, 9)))
+
+        resp = self.client.get(versions[1]['url'])
+        self.assertEqual(json.loads(resp.content.decode('utf-8'))['metadata'],\
+                        self.all_metadata[1])
+        resp = self.client.get(reverse('view_filemetadata_version',\
+                                    kwargs=dict(kwargs, version=20)))
+        self.assertEqual(resp.status_code, 404)
+
+        diff_url = reverse('diff_filemetadata_versions', kwargs=kwargs)
+        resp = self.client.get(diff_url, {'from': 1})
+        self.assertEqual(resp['Content-Type'], 'application/json-patch+json')
+        patch = json.loads(resp.content.decode('utf-8'))
+        self.assertEqual(apply_json_patch(self.all_metadata[0], patch), self.all_metadata[-1])
+        self.assertEqual(self.client.get(diff_url, {'from': 'x'}).status_code, 400)
+
+    def test_04_next_version_taken(self):
+        """A row already holding the next version stops the save, nothing is written"""
+        taken = FileMetadata.objects.create(schema=self.fmeta.schema, datafile_id=1, version=9,\
+                                        metadata={'id': 1, 'name': 'own row'})
+        with self.assertRaisesRegex(VersionTakenError, 'Version 9 .*\\(id %s\\)' % taken.id):
+            save_metadata_version(self.fmeta, {'id': 1, 'name': 'v9'})
+        fmeta = FileMetadata.objects.get(pk=self.fmeta.pk)
+        self.assertEqual((fmeta.version, fmeta.metadata['name']), (8, 'v8'))
+        self.assertEqual(FileMetadataRevision.objects.count(), 7)
+
+    def test_03_views_unpublished(self):
+        """The history of unpublished FileMetadata isn't shown to anonymous users"""
+        FileMetadata.objects.filter(pk=self.fmeta.pk).update(published=False)
+        kwargs = dict(file_metadata_id=self.fmeta.pk)
+        for url in [reverse('view_filemetadata_versions', kwargs=kwargs),\
+                    reverse('view_filemetadata_version', kwargs=dict(kwargs, version=1)),\
+                    reverse('diff_filemetadata_versions', kwargs=kwargs) + '?from=1']:
+            self.assertEqual(self.client.get(url).status_code, 404)
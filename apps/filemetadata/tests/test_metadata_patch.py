@@ -0,0 +1,199 @@
+import json
+from django.contrib.auth import get_user_model
+from django.contrib.auth.models import Permission
+from django.core.urlresolvers import reverse
+from django.test import TestCase, override_settings
+from apps.filemetadata.json_patch import apply_json_patch, apply_merge_patch, JsonPatchFormatError
+from apps.filemetadata.metadata_patch import apply_metadata_patch, get_validation_targets,\
+    validate_patched_metadata, PATCH_TYPE_JSON_PATCH, PATCH_TYPE_MERGE_PATCH
+from apps.filemetadata.models import MetadataSchema, FileMetadata
+
+NESTED_SCHEMA = {'type': 'object',\
+                'properties': {'id': {'type': 'integer'},\
+                            'creator': {'type': 'object',\
+                                        'properties': {'name': {'type': 'string'},\
+                                                        'email': {'type': 'string'}},\
+                                        'required': ['name']},\
+                            'keywords': {'type': 'array', 'items': {'type': 'string'}},\
+                            'license': {'$ref': '#/definitions/license'}},\
+                'required': ['id'],\
+                'definitions': {'license': {'enum': ['CC0', 'CC-BY']}}}
+
+# "tags" may be an object of integers or an array of strings
+EITHER_SCHEMA = {'type': 'object',\
+                'properties': {'tags': {'type': ['object', 'array'],\
+                                        'additionalProperties': {'type': 'integer'},\
+                                        'items': {'type': 'string'}}}}
+
+AUTH_MIDDLEWARE = ['django.contrib.sessions.middleware.SessionMiddleware',\
+    'django.contrib.auth.middleware.AuthenticationMiddleware']
+
+
+class MetadataPatchTestCase(TestCase):
+
+    def test_01_merge_patch(self):
+        """RFC 7396: nulls remove members, objects merge, the rest replaces"""
+        doc = {'a': 1, 'b': {'c': 2, 'd': 3}, 'e': [1]}
+        self.assertEqual(apply_merge_patch(doc, {'a': None, 'b': {'c': None, 'x': 1}, 'e': [2]}),\
+                        {'b': {'d': 3, 'x': 1}, 'e': [2]})
+        self.assertEqual(apply_merge_patch(doc, [1]), [1])
+        self.assertEqual(doc, {'a': 1, 'b': {'c': 2, 'd': 3}, 'e': [1]})
+
+    def test_02_validation_targets(self):
+        """Only the changed subtrees, and member sets, are validated"""
+        doc = {'id': 1, 'creator': {'name': 'x'}, 'keywords': ['a'], 'license': 'CC0'}
+
+        patched, changes = apply_metadata_patch(doc, [{'op': 'replace', 'path': '/creator/name',\
+                                                    'value': 'y'}], PATCH_TYPE_JSON_PATCH)
+        self.assertEqual([(x[0], x[1]) for x in get_validation_targets(NESTED_SCHEMA, patched, changes)],\
+                        [(['creator', 'name'], ['properties', 'creator', 'properties', 'name'])])
+
+        patched, changes = apply_metadata_patch(doc, {'creator': {'name': None}}, PATCH_TYPE_MERGE_PATCH)
+        self.assertEqual([(x[0], x[1]) for x in get_validation_targets(NESTED_SCHEMA, patched, changes)],\
+                        [(['creator'], ['properties', 'creator', '(members)']),\
+                        (['creator', 'name'], ['properties', 'creator', 'properties', 'name'])])
+
+        patched, changes = apply_metadata_patch(doc, [{'op': 'add', 'path': '/keywords/-',\
+                                                    'value': 'b'}], PATCH_TYPE_JSON_PATCH)
+        self.assertEqual([x[0] for x in get_validation_targets(NESTED_SCHEMA, patched, changes)],\
+                        [['keywords', '-']])
+
+        # "$ref" is checked against the whole property
+        patched, changes = apply_metadata_patch(doc, {'license': 'MIT'}, PATCH_TYPE_MERGE_PATCH)
+        self.assertEqual([x[0] for x in get_validation_targets(NESTED_SCHEMA, patched, changes)],\
+                        [['license']])
+
+        # a replaced root validates everything
+        patched, changes = apply_metadata_patch(doc, [{'op': 'replace', 'path': '',\
+                                                    'value': {'id': 2}}], PATCH_TYPE_JSON_PATCH)
+        self.assertEqual(get_validation_targets(NESTED_SCHEMA, patched, changes), [([], [], NESTED_SCHEMA)])
+
+    def test_03_validate_patched(self):
+        """Errors in the changed subtrees are found, with their full path"""
+        doc = {'id': 1, 'creator': {'name': 'x'}, 'keywords': ['a'], 'license': 'CC0'}
+        checks = [([{'op': 'add', 'path': '/keywords/-', 'value': 5}], False),\
+                ([{'op': 'remove', 'path': '/creator/name'}], False),\
+                ([{'op': 'add', 'path': '/creator/email', 'value': 'a@b.c'}], True),\
+                ([{'op': 'replace', 'path': '/license', 'value': 'MIT'}], False),\
+                ([{'op': 'replace', 'path': '/license', 'value': 'CC-BY'}], True),\
+                ([{'op': 'remove', 'path': '/id'}], False)]
+        for patch, expected in checks:
+            patched, changes = apply_metadata_patch(doc, patch, PATCH_TYPE_JSON_PATCH)
+            is_valid, errors, _ = validate_patched_metadata(NESTED_SCHEMA, patched, changes)
+            self.assertEqual(is_valid, expected, patch)
+
+        patched, changes = apply_metadata_patch(doc, {'keywords': ['a', 7]},\
+                                                PATCH_TYPE_MERGE_PATCH)
+        is_valid, errors, validated = validate_patched_metadata(NESTED_SCHEMA, patched, changes,\
+                                                            cache_key=('nested', 1))
+        self.assertFalse(is_valid)
+        self.assertEqual(errors[0], 'Error Location: keywords->1')
+        self.assertEqual(validated, ['/keywords'])
+
+    def test_04_malformed_pointers(self):
+        """Pointers that aren't strings starting with "/" are JsonPatchFormatErrors"""
+        doc = {'id': 1}
+        for patch in [[{'op': 'remove', 'path': 'id'}],\
+                    [{'op': 'remove', 'path': 5}],\
+                    [{'op': 'move', 'from': None, 'path': '/x'}],\
+                    [{'op': 'copy', 'path': '/x'}]]:
+            with self.assertRaises(JsonPatchFormatError):
+                apply_json_patch(doc, patch)
+            with self.assertRaises(JsonPatchFormatError):
+                apply_metadata_patch(doc, patch, PATCH_TYPE_JSON_PATCH)
+
+    def test_05_child_schema_by_node_type(self):
+        """Array elements are checked against "items", object members against the rest"""
+        checks = [({'tags': ['a']}, [{'op': 'add', 'path': '/tags/-', 'value': 'b'}], True),\
+                ({'tags': ['a']}, [{'op': 'add', 'path': '/tags/-', 'value': 2}], False),\
+                ({'tags': {'a': 1}}, [{'op': 'add', 'path': '/tags/b', 'value': 2}], True),\
+                ({'tags': {'a': 1}}, [{'op': 'add', 'path': '/tags/b', 'value': 'b'}], False)]
+        for doc, patch, expected in checks:
+            patched, changes = apply_metadata_patch(doc, patch, PATCH_TYPE_JSON_PATCH)
+            is_valid, _, _ = validate_patched_metadata(EITHER_SCHEMA, patched, changes)
+            self.assertEqual(is_valid, expected, patch)
+            self.assertEqual([x[1][-1] for x in get_validation_targets(EITHER_SCHEMA, patched,\
+                            changes)][-1], 'items' if patch[0]['path'].endswith('-')\
+                            else 'additionalProperties')
+
+
+@override_settings(MIDDLEWARE_CLASSES=AUTH_MIDDLEWARE)
+class PatchFileMetadataTestCase(TestCase):
+
+    fixtures = ['test_schemas.json']
+
+    def setUp(self):
+        user = get_user_model().objects.create_user('editor', 'editor@example.com', 'pw')
+        user.user_permissions.add(Permission.objects.get(codename='change_filemetadata'))
+        self.client.login(username='editor', password='pw')
+
+        # schema version 2: "id" (integer) and "name" are required, nothing else allowed
+        self.fmeta = FileMetadata.objects.create(schema=MetadataSchema.objects.get(pk=2),\
+                                            datafile_id=1,\
+                                            metadata={'id': 1, 'name': 'first'})
+        self.url = reverse('patch_filemetadata', kwargs=dict(file_metadata_id=self.fmeta.id))
+
+    def send_patch(self, patch, content_type=PATCH_TYPE_JSON_PATCH):
+        return self.client.generic('PATCH', self.url, json.dumps(patch), content_type=content_type)
+
+    def test_01_patch_saves_new_version(self):
+        """A valid patch is saved as the next version"""
+        response = self.send_patch([{'op': 'replace', 'path': '/name', 'value': 'second'}])
+        self.assertEqual(response.status_code, 200)
+        info = json.loads(response.content.decode('utf-8'))
+        self.assertEqual(info['version'], 2)
+        self.assertEqual(info['validated'], ['/name'])
+        self.assertEqual(info['metadata'], {'id': 1, 'name': 'second'})
+
+        response = self.send_patch({'id': 2}, content_type=PATCH_TYPE_MERGE_PATCH)
+        self.assertEqual(response.status_code, 200)
+        fmeta = FileMetadata.objects.get(pk=self.fmeta.id)
+        self.assertEqual(fmeta.version, 3)
+        self.assertEqual(fmeta.metadata, {'id': 2, 'name': 'second'})
+        self.assertEqual(fmeta.revisions.count(), 2)
+
+    def test_02_patch_errors(self):
+        """Bad patches are refused and nothing is saved"""
+        checks = [([{'op': 'replace', 'path': '/id', 'value': 'one'}], PATCH_TYPE_JSON_PATCH, 422),\
+                ({'name': None}, PATCH_TYPE_MERGE_PATCH, 422),\
+                ({'extra': 1}, PATCH_TYPE_MERGE_PATCH, 422),\
+                ([{'op': 'remove', 'path': '/missing'}], PATCH_TYPE_JSON_PATCH, 409),\
+                ([{'op': 'test', 'path': '/id', 'value': 2}], PATCH_TYPE_JSON_PATCH, 409),\
+                ([{'op': 'remove', 'path': 'id'}], PATCH_TYPE_JSON_PATCH, 400),\
+                ([{'op': 'remove', 'path': ['id']}], PATCH_TYPE_JSON_PATCH, 400),\
+                ({'op': 'remove', 'path': '/id'}, PATCH_TYPE_JSON_PATCH, 400),\
+                ({'id': 2}, 'application/json', 415)]
+        for patch, content_type, status in checks:
+            response = self.send_patch(patch, content_type=content_type)
+            self.assertEqual(response.status_code, status, patch)
+            self.assertFalse(json.loads(response.content.decode('utf-8'))['valid'])
+
+        response = self.client.generic('PATCH', self.url, '{not json',\
+                                    content_type=PATCH_TYPE_JSON_PATCH)
+        self.assertEqual(response.status_code, 400)
+        self.assertEqual(self.client.get(self.url).status_code, 405)
+
+        fmeta = FileMetadata.objects.get(pk=self.fmeta.id)
+        self.assertEqual((fmeta.version, fmeta.metadata), (1, {'id': 1, 'name': 'first'}))
+
+    def test_03_patch_needs_permission(self):
+        """Anonymous users and users without the change permission can't PATCH"""
+        patch = [{'op': 'replace', 'path': '/name', 'value': 'second'}]
+        self.client.logout()
+        self.assertEqual(self.send_patch(patch).status_code, 401)
+
+        get_user_model().objects.create_user('reader', 'reader@example.com', 'pw')
+        self.client.login(username='reader', password='pw')
+        self.assertEqual(self.send_patch(patch).status_code, 403)
+        self.assertEqual(FileMetadata.objects.get(pk=self.fmeta.id).version, 1)
+
+    def test_04_next_version_taken(self):
+        """A next version saved as its own row is a 409 naming it, not a server error"""
+        FileMetadata.objects.create(schema=self.fmeta.schema, datafile_id=1, version=2,\
+                                metadata={'id': 1, 'name': 'other'})
+        response = self.send_patch([{'op': 'replace', 'path': '/name', 'value': 'second'}])
+        self.assertEqual(response.status_code, 409)
+        self.assertIn('Version 2 ', json.loads(response.content.decode('utf-8'))['errors'][0])
+        fmeta = FileMetadata.objects.get(pk=self.fmeta.id)
+        self.assertEqual((fmeta.version, fmeta.metadata), (1, {'id': 1, 'name': 'first'}))
+        self.assertEqual(fmeta.revisions.count(), 0)
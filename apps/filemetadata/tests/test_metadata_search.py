@@ -0,0 +1,121 @@
+import json
+from django.contrib.auth import get_user_model
+from django.contrib.auth.models import Permission
+from django.test import TestCase, override_settings
+from django.core.urlresolvers import reverse
+from apps.filemetadata.models import MetadataSchema, FileMetadata, FileMetadataValue
+from apps.filemetadata.json_pointer import parse_json_pointer, format_json_pointer, flatten_metadata
+from apps.filemetadata.metadata_search import filter_metadata_contains, filter_metadata_pointer,\
+    parse_metadata_query
+
+AUTH_MIDDLEWARE = ['django.contrib.sessions.middleware.SessionMiddleware',\
+    'django.contrib.auth.middleware.AuthenticationMiddleware']
+
+
+class MetadataSearchTestCase(TestCase):
+    """
+    Runs against the FileMetadataValue side table (sqlite)
+    """
+    fixtures = ['test_schemas.json']
+
+    def setUp(self):
+        mschema = MetadataSchema.objects.get(pk=1)
+        self.fm1 = FileMetadata.objects.create(schema=mschema, datafile_id=1,\
+                    metadata={'id': 1, 'name': 'alpha', 'tags': ['raw', 'x'],\
+                              'instrument': {'name': 'X', 'a/b': 2.0}})
+        self.fm2 = FileMetadata.objects.create(schema=mschema, datafile_id=2,\
+                    metadata={'id': 2, 'name': 'beta', 'tags': ['clean'],\
+                              'instrument': {'name': 'Y'}})
+
+    def get_ids(self, fm_qs):
+        return sorted(fm_qs.values_list('id', flat=True))
+
+    def test_01_json_pointer(self):
+        """Parse, format and flatten JSON pointers"""
+        self.assertEqual(parse_json_pointer('/a/b~1c/~0d'), ['a', 'b/c', '~d'])
+        self.assertEqual(parse_json_pointer(''), [])
+        self.assertRaises(ValueError, parse_json_pointer, 'a/b')
+        self.assertEqual(format_json_pointer(['a', 'b/c', 0]), '/a/b~1c/0')
+        self.assertEqual(sorted(flatten_metadata({'a': [1, {'b': None}], 'c': 1.0})),\
+                        [('/a/0', '1'), ('/a/1/b', 'null'), ('/c', '1')])
+
+    def test_02_side_table_maintained(self):
+        """The side table follows each save"""
+        self.assertEqual(self.fm1.indexed_values.filter(pointer='/instrument/a~1b').get().value, '2')
+
+        self.fm1.metadata = {'id': 1}
+        self.fm1.save()
+        self.assertEqual(list(self.fm1.indexed_values.values_list('pointer', 'value')), [('/id', '1')])
+
+        fm1_id = self.fm1.id
+        self.fm1.delete()
+        self.assertEqual(FileMetadataValue.objects.filter(file_metadata_id=fm1_id).count(), 0)
+
+        FileMetadata.objects.filter(pk=self.fm2.id).delete()
+        self.assertEqual(FileMetadataValue.objects.count(), 0)
+
+    def test_03_contains(self):
+        """Containment, including array elements"""
+        fm_qs = FileMetadata.objects.all()
+        self.assertEqual(self.get_ids(filter_metadata_contains(fm_qs, {'instrument': {'name': 'X'}})),\
+                        [self.fm1.id])
+        self.assertEqual(self.get_ids(filter_metadata_contains(fm_qs, {'tags': ['x', 'raw'], 'id': 1})),\
+                        [self.fm1.id])
+        self.assertEqual(self.get_ids(filter_metadata_contains(fm_qs, {'tags': ['x', 'clean']})), [])
+        self.assertEqual(self.get_ids(filter_metadata_contains(fm_qs, {})), [self.fm1.id, self.fm2.id])
+        self.assertRaises(ValueError, filter_metadata_contains, fm_qs, {'tags': [{'a': 1}]})
+
+    def test_04_pointer(self):
+        """Pointer equality; 2 and 2.0 match"""
+        fm_qs = FileMetadata.objects.all()
+        self.assertEqual(self.get_ids(filter_metadata_pointer(fm_qs, '/instrument/a~1b', 2)), [self.fm1.id])
+        self.assertEqual(self.get_ids(filter_metadata_pointer(fm_qs, '/tags/0', 'clean')), [self.fm2.id])
+        self.assertEqual(self.get_ids(filter_metadata_pointer(fm_qs, '/name', 'gamma')), [])
+        self.assertRaises(ValueError, filter_metadata_pointer, fm_qs, '/instrument', {'name': 'X'})
+
+    def test_05_parse_query(self):
+        """Search box queries"""
+        self.assertEqual(parse_metadata_query('/name=alpha'), ('/name', 'alpha'))
+        self.assertEqual(parse_metadata_query('/id=1'), ('/id', 1))
+        self.assertEqual(parse_metadata_query('/id="1"'), ('/id', '1'))
+        self.assertEqual(parse_metadata_query(' {"id": 1} '), (None, {'id': 1}))
+        for query in ['name=alpha', '/name', '{"id": ']:
+            self.assertRaises(ValueError, parse_metadata_query, query)
+
+    def test_06_search_view(self):
+        """Search API with paging"""
+        search_url = reverse('search_filemetadata')
+        resp = self.client.get(search_url, {'q': ['{"tags": ["raw"]}', '/instrument/name=X']})
+        self.assertEqual(resp.status_code, 200)
+        results = json.loads(resp.content.decode('utf-8'))
+        self.assertEqual([x['id'] for x in results['results']], [self.fm1.id])
+        self.assertEqual(results['results'][0]['metadata']['name'], 'alpha')
+        self.assertEqual(results['next_after'], None)
+
+        resp = self.client.get(search_url, {'q': '{}', 'limit': 1})
+        results = json.loads(resp.content.decode('utf-8'))
+        self.assertEqual([x['id'] for x in results['results']], [self.fm1.id])
+        self.assertEqual(results['next_after'], self.fm1.id)
+
+        resp = self.client.get(search_url, {'q': '{}', 'after': results['next_after']})
+        results = json.loads(resp.content.decode('utf-8'))
+        self.assertEqual([x['id'] for x in results['results']], [self.fm2.id])
+
+        for params in [{}, {'q': 'name'}, {'q': '{}', 'limit': 0}, {'q': '{}', 'after': 'x'}]:
+            self.assertEqual(self.client.get(search_url, params).status_code, 400)
+
+    @override_settings(MIDDLEWARE_CLASSES=AUTH_MIDDLEWARE)
+    def test_07_search_unpublished(self):
+        """Unpublished FileMetadata are only found by users who may change them"""
+        FileMetadata.objects.filter(pk=self.fm2.id).update(published=False)
+        search_url = reverse('search_filemetadata')
+        resp = self.client.get(search_url, {'q': '{}'})
+        results = json.loads(resp.content.decode('utf-8'))
+        self.assertEqual([x['id'] for x in results['results']], [self.fm1.id])
+
+        user = get_user_model().objects.create_user('editor', 'editor@example.com', 'pw')
+        user.user_permissions.add(Permission.objects.get(codename='change_filemetadata'))
+        self.client.login(username='editor', password='pw')
+        resp = self.client.get(search_url, {'q': '{}'})
+        results = json.loads(resp.content.decode('utf-8'))
+        self.assertEqual([x['id'] for x in results['results']], [self.fm1.id, self.fm2.id])
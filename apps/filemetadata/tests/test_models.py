@@ -0,0 +1,69 @@
+import pickle
+from collections import OrderedDict
+from django.test import TestCase, override_settings
+from apps.filemetadata.fields import LazyJSONField
+from apps.filemetadata.models import MetadataSchema, FileMetadata
+
+
+class JSONBStorageTestCase(TestCase):
+
+    fixtures = ['test_schemas.json']
+
+    def test_01_jsonb_copy_on_save(self):
+        """The jsonb columns are filled on save; the text columns keep key order"""
+        mschema = MetadataSchema.objects.get(pk=1)
+        mschema.save()
+
+        metadata = OrderedDict([('name', 'n'), ('id', 1)])
+        fmeta = FileMetadata.objects.create(schema=mschema, datafile_id=10, metadata=metadata)
+
+        fmeta = FileMetadata.objects.get(pk=fmeta.pk)
+        self.assertEqual(list(fmeta.metadata.keys()), ['name', 'id'])
+        self.assertEqual(fmeta.metadata_jsonb, {'name': 'n', 'id': 1})
+
+        mschema = MetadataSchema.objects.get(pk=1)
+        self.assertEqual(mschema.schema_jsonb['required'], ['id'])
+
+
+class LazyJSONFieldTestCase(TestCase):
+
+    fixtures = ['test_schemas.json']
+
+    def setUp(self):
+        self.fmeta = FileMetadata.objects.create(schema_id=1, datafile_id=10,\
+                        metadata=OrderedDict([('name', 'n'), ('id', 1)]))
+
+    def test_01_decoded_on_first_access(self):
+        """Loaded rows keep the JSON text until the field is read"""
+        fmeta = FileMetadata.objects.get(pk=self.fmeta.pk)
+        self.assertEqual(LazyJSONField.get_raw_json(fmeta, 'metadata'), '{"name":"n","id":1}')
+
+        self.assertEqual(type(fmeta.metadata), OrderedDict)
+        self.assertEqual(list(fmeta.metadata.keys()), ['name', 'id'])
+        self.assertEqual(LazyJSONField.get_raw_json(fmeta, 'metadata'), None)
+
+        mschema = MetadataSchema.objects.get(pk=1)
+        self.assertEqual(mschema.title, 'example')
+        self.assertTrue(LazyJSONField.get_raw_json(mschema, 'schema'))
+        self.assertEqual(mschema.schema['required'], ['id'])
+
+    def test_02_save_and_pickle(self):
+        """Undecoded JSON is saved and pickled as is"""
+        fmeta = FileMetadata.objects.get(pk=self.fmeta.pk)
+        metadata_field = FileMetadata._meta.get_field('metadata')
+        raw_value = metadata_field.pre_save(fmeta, False)
+        self.assertEqual(metadata_field.get_db_prep_value(raw_value, None), '{"name":"n","id":1}')
+
+        fmeta = pickle.loads(pickle.dumps(fmeta))
+        self.assertEqual(fmeta.metadata['id'], 1)
+
+        fmeta.metadata = {'id': 2}
+        fmeta.save()
+        self.assertEqual(FileMetadata.objects.get(pk=fmeta.pk).metadata, {'id': 2})
+
+    @override_settings(JSON_FIELD_PLAIN_DICTS=True)
+    def test_03_plain_dicts(self):
+        """Plain dict decoding"""
+        fmeta = FileMetadata.objects.get(pk=self.fmeta.pk)
+        self.assertEqual(type(fmeta.metadata), dict)
+        self.assertEqual(fmeta.metadata, {'name': 'n', 'id': 1})
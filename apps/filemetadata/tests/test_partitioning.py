@@ -0,0 +1,48 @@
+from django.db import connection
+from django.test import TestCase
+from apps.filemetadata.bulk_export import get_export_queryset
+from apps.filemetadata.models import MetadataSchema, FileMetadata
+from apps.filemetadata.partitioning import get_installation_partition_name,\
+    supports_partitioning, get_partition_strategy, partition_filemetadata, ERR_MSG_UNSUPPORTED
+
+
+class PartitionKeyTestCase(TestCase):
+
+    fixtures = ['test_schemas.json']
+
+    def test_01_installation_copied_from_schema(self):
+        """FileMetadata rows carry their schema's installation"""
+        mschema = MetadataSchema.objects.get(pk=2)
+        fmeta = FileMetadata.objects.create(schema=mschema, datafile_id=1,\
+                                        metadata={'id': 1, 'name': 'n'})
+        FileMetadata.bulk_create_indexed([FileMetadata(schema=mschema, datafile_id=2,\
+                                                    metadata={'id': 2, 'name': 'n'})])
+        self.assertEqual(fmeta.dataverse_installation_id, mschema.dataverse_installation_id)
+        self.assertEqual(get_export_queryset(installation=mschema.dataverse_installation_id)\
+                        .count(), 2)
+
+        # changing the schema's installation moves its rows
+        mschema.dataverse_installation_id = 'other-dataverse'
+        mschema.save()
+        self.assertEqual(set(FileMetadata.objects.values_list('dataverse_installation_id',\
+                                                            flat=True)),\
+                        set(['other-dataverse']))
+        self.assertEqual(get_export_queryset(installation='other-dataverse').count(), 2)
+
+    def test_02_partition_names(self):
+        """Partition names are valid PostgreSQL identifiers, unique per installation"""
+        names = [get_installation_partition_name(x) for x in\
+                ['harvard-dataverse', 'Harvard Dataverse', 'x' * 255]]
+        self.assertEqual(len(set(names)), 3)
+        for name in names:
+            self.assertTrue(len(name) <= 63)
+        self.assertTrue(names[0].startswith('filemetadata_filemetadata_i_harvard_dataverse_'))
+
+    def test_03_needs_postgresql(self):
+        """Other databases keep a plain table"""
+        if connection.vendor == 'postgresql':
+            return
+        self.assertFalse(supports_partitioning(connection))
+        self.assertEqual(get_partition_strategy(connection), None)
+        with self.assertRaisesRegex(ValueError, ERR_MSG_UNSUPPORTED):
+            partition_filemetadata(connection)
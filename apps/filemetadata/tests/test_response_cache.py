@@ -0,0 +1,47 @@
+from unittest import mock
+from django.test import TestCase
+from apps.filemetadata import response_cache
+from apps.filemetadata.models import MetadataSchema
+from apps.filemetadata.response_cache import RESPONSE_CACHE
+
+
+class ResponseCacheTestCase(TestCase):
+
+    fixtures = ['test_schemas.json']
+
+    def setUp(self):
+        RESPONSE_CACHE.invalidate()
+        self.build = mock.Mock(side_effect=lambda: 'built %s' % self.build.call_count)
+
+    def test_01_cache_aside(self):
+        """Values are built once and retired when a schema is saved"""
+        self.assertEqual(RESPONSE_CACHE.get_or_build(('k', 1), self.build), 'built 1')
+        self.assertEqual(RESPONSE_CACHE.get_or_build(('k', 1), self.build), 'built 1')
+        self.assertEqual(RESPONSE_CACHE.get_or_build(('k', 2), self.build), 'built 2')
+
+        MetadataSchema.objects.get(pk=1).delete()
+        self.assertEqual(RESPONSE_CACHE.get_or_build(('k', 1), self.build), 'built 3')
+
+    def test_02_single_flight(self):
+        """While another worker rebuilds, the stale value is served"""
+        RESPONSE_CACHE.get_or_build(('k',), self.build)
+        key = RESPONSE_CACHE.make_key(RESPONSE_CACHE.get_generation(), ('k',))
+        RESPONSE_CACHE.cache.add(key + ':lock', 1)
+
+        with mock.patch.object(RESPONSE_CACHE, 'should_refresh_early', return_value=True):
+            self.assertEqual(RESPONSE_CACHE.get_or_build(('k',), self.build), 'built 1')
+            RESPONSE_CACHE.cache.delete(key + ':lock')
+            self.assertEqual(RESPONSE_CACHE.get_or_build(('k',), self.build), 'built 2')
+        self.assertEqual(self.build.call_count, 2)
+
+        # a missing value: wait for the lock holder, then build it anyway
+        with mock.patch.object(response_cache, 'LOCK_WAIT', 0.1):
+            other_key = RESPONSE_CACHE.make_key(RESPONSE_CACHE.get_generation(), ('missing',))
+            RESPONSE_CACHE.cache.add(other_key + ':lock', 1)
+            self.assertEqual(RESPONSE_CACHE.get_or_build(('missing',), self.build), 'built 3')
+
+    def test_03_early_refresh(self):
+        """The chance of an early refresh grows as expiry nears"""
+        with mock.patch('random.random', return_value=0.5):
+            self.assertFalse(RESPONSE_CACHE.should_refresh_early(10.0 ** 10, 1.0))
+            self.assertTrue(RESPONSE_CACHE.should_refresh_early(0, 1.0))
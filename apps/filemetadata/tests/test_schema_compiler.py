@@ -0,0 +1,125 @@
+from collections import OrderedDict
+import jsonschema
+from django.test import TestCase, override_settings
+from apps.filemetadata.models import MetadataSchema
+from apps.filemetadata.schema_compiler import compile_schema, CompiledValidator,\
+    UnsupportedSchemaError
+from apps.filemetadata.utils import validate_filemetadata, format_error_message, get_schema_validator,\
+    CHOSEN_VALIDATOR_CLASS, VALIDATION_ENGINE_COMPILED
+from apps.filemetadata.validator_cache import VALIDATOR_CACHE
+
+# (schema, [instances to check])
+SCHEMA_CASES = [
+    ({'type': 'object',
+      'properties': OrderedDict([('id', {'type': 'integer'}),
+                                 ('name', {'type': 'string', 'minLength': 2, 'maxLength': 5}),
+                                 ('price', {'type': 'number', 'minimum': 0, 'exclusiveMinimum': True}),
+                                 ('tags', {'type': 'array', 'items': {'type': 'string'},
+                                           'minItems': 1, 'uniqueItems': True})]),
+      'required': ['id', 'name']},
+     [{'id': 1, 'name': 'ab'}, {'id': 1.0, 'name': 'ab'}, {'id': True, 'name': 'ab'},
+      {'name': 'ab'}, {'id': 1}, {'id': 1, 'name': 'abcdef'}, {'id': 1, 'name': 'a'},
+      {'id': 1, 'name': 'ab', 'price': 0}, {'id': 1, 'name': 'ab', 'price': 0.5},
+      {'id': 1, 'name': 'ab', 'tags': []}, {'id': 1, 'name': 'ab', 'tags': ['a', 'a']},
+      {'id': 1, 'name': 'ab', 'tags': ['a', 3]}, [], 'text', None]),
+
+    ({'type': ['string', 'null'], 'enum': ['a', 'b', None, 1], 'pattern': '^a'},
+     ['a', 'b', None, 'c', 1, True, 1.0]),
+
+    ({'type': 'number', 'maximum': 10, 'exclusiveMaximum': False, 'multipleOf': 2.5},
+     [10, 7.5, 5, 3, 12.5, False, '5']),
+
+    ({'type': 'integer', 'multipleOf': 3, 'maximum': 9, 'exclusiveMaximum': True},
+     [3, 9, 4, -6]),
+
+    ({'properties': {'a': {'type': 'string'}},
+      'patternProperties': OrderedDict([('^x-', {'type': 'integer'})]),
+      'additionalProperties': False,
+      'minProperties': 1, 'maxProperties': 2},
+     [{'a': 'v'}, {'x-1': 1}, {'x-1': 'one'}, {'b': 1}, {}, {'a': 'v', 'x-1': 1, 'x-2': 2}]),
+
+    ({'additionalProperties': {'type': 'boolean'}, 'properties': {'a': {}}},
+     [{'a': 1, 'b': True}, {'b': 'no'}]),
+
+    ({'items': [{'type': 'string'}, {'type': 'integer'}], 'additionalItems': False},
+     [['a', 1], ['a'], [1], ['a', 1, 2], []]),
+
+    ({'items': [{'type': 'string'}], 'additionalItems': {'type': 'integer'}, 'maxItems': 3},
+     [['a', 1, 2], ['a', 'b'], ['a', 1, 2, 3]]),
+
+    ({'dependencies': OrderedDict([('a', ['b', 'c']), ('d', {'required': ['e']})])},
+     [{'a': 1, 'b': 1, 'c': 1}, {'a': 1, 'b': 1}, {'d': 1}, {'d': 1, 'e': 1}, {}]),
+
+    ({'allOf': [{'type': 'integer'}, {'minimum': 2}],
+      'not': {'enum': [5]}},
+     [2, 1, 5, 'x']),
+
+    ({'anyOf': [{'type': 'string'}, {'type': 'integer', 'minimum': 3}]},
+     ['x', 4, 1, None]),
+
+    ({'oneOf': [{'type': 'integer'}, {'minimum': 2}]},
+     [1, 3, 2.5, 'x']),
+
+    ({'definitions': {'node': {'type': 'object',
+                               'properties': {'child': {'$ref': '#/definitions/node'},
+                                              'value': {'type': 'integer'}}}},
+      '$ref': '#/definitions/node'},
+     [{'value': 1, 'child': {'value': 2}}, {'child': {'child': {'value': 'x'}}}]),
+]
+
+
+class SchemaCompilerTestCase(TestCase):
+
+    fixtures = ['test_schemas.json']
+
+    def get_first_error(self, validator, instance):
+        try:
+            validator.validate(instance)
+        except jsonschema.exceptions.ValidationError as err:
+            return format_error_message(err)
+        return None
+
+    def test_01_same_results_as_jsonschema(self):
+        """Compiled validators accept, reject and report like jsonschema"""
+        for schema, instances in SCHEMA_CASES:
+            compiled_validator = compile_schema(schema)
+            jsonschema_validator = CHOSEN_VALIDATOR_CLASS(schema)
+            for instance in instances:
+                self.assertEqual(self.get_first_error(compiled_validator, instance),\
+                                self.get_first_error(jsonschema_validator, instance),\
+                                msg='schema: %s, instance: %r' % (schema, instance))
+
+    def test_02_fixture_schemas(self):
+        """Compile the fixture schemas"""
+        for mschema in MetadataSchema.objects.all():
+            compiled_validator = compile_schema(mschema.schema)
+            jsonschema_validator = CHOSEN_VALIDATOR_CLASS(mschema.schema)
+            for instance in [{'id': 1, 'name': 'n', 'price': 1, 'tags': ['a']},\
+                            {'id': 'x'}, {}, {'id': 1, 'price': 0}]:
+                self.assertEqual(compiled_validator.is_valid(instance),\
+                                jsonschema_validator.is_valid(instance))
+
+    def test_03_unsupported(self):
+        """Remote refs, nested ids and unknown types are not compiled"""
+        for schema in [{'$ref': 'http://json-schema.org/draft-04/schema#'},\
+                       {'properties': {'a': {'id': 'http://example.com/a', 'type': 'string'}}},\
+                       {'type': 'any'},\
+                       {'minimum': 'zero'},\
+                       {'pattern': '('}]:
+            self.assertRaises(UnsupportedSchemaError, compile_schema, schema)
+
+    @override_settings(VALIDATION_ENGINE=VALIDATION_ENGINE_COMPILED)
+    def test_04_compiled_engine(self):
+        """validate_filemetadata with the compiled engine, including the fallback"""
+        VALIDATOR_CACHE.clear()
+        schema = {'properties': {'id': {'type': 'integer'}}, 'required': ['id']}
+        self.assertEqual(validate_filemetadata(schema, {'id': 1}), (True, None))
+
+        valid, msg = validate_filemetadata(schema, {'id': 'x'})
+        self.assertEqual(valid, False)
+        self.assertEqual(msg[0], 'Error Location: id')
+
+        VALIDATOR_CACHE.clear()
+        remote_schema = {'$ref': 'http://json-schema.org/draft-04/schema#'}
+        self.assertFalse(isinstance(get_schema_validator(remote_schema), CompiledValidator))
+        self.assertTrue(isinstance(get_schema_validator(schema), CompiledValidator))
@@ -0,0 +1,87 @@
+import json
+from django.core.urlresolvers import reverse
+from django.test import TestCase, override_settings
+from jsonschema import Draft4Validator
+from apps.filemetadata.models import MetadataSchema
+from apps.filemetadata.schema_precheck import build_schema_precheck, SchemaPrecheck,\
+    PRECHECK_CACHE
+from apps.filemetadata.utils import validate_filemetadata
+
+PRECHECK_SCHEMA = {'type': 'object',\
+                'properties': {'id': {'type': 'integer'},\
+                            'size': {'type': ['number', 'null']},\
+                            'license': {'type': 'string', 'enum': ['CC0', 'CC-BY']},\
+                            'flag': {'enum': [1, 'x']},\
+                            'shape': {'enum': [[1, 2]]},\
+                            'owner': {'$ref': '#/definitions/owner', 'type': 'integer'}},\
+                'required': ['id'],\
+                'definitions': {'owner': {'type': 'string'}}}
+
+
+class SchemaPrecheckTestCase(TestCase):
+
+    fixtures = ['test_schemas.json']
+
+    def setUp(self):
+        PRECHECK_CACHE.clear()
+
+    def test_01_summary(self):
+        """Required keys, types and hashable enums are summarized; "$ref"s are skipped"""
+        summary = build_schema_precheck(PRECHECK_SCHEMA)
+        self.assertEqual(json.loads(json.dumps(summary)),\
+                        {'type': ['object'],\
+                        'required': ['id'],\
+                        'properties': {'id': {'type': ['integer']},\
+                                    'size': {'type': ['number', 'null']},\
+                                    'license': {'type': ['string'], 'enum': ['CC0', 'CC-BY']},\
+                                    'flag': {'enum': [1, 'x']}}})
+        self.assertEqual(build_schema_precheck({'$ref': '#/definitions/x'}), {})
+
+    def test_02_only_rejects_invalid_documents(self):
+        """Everything the pre-check rejects also fails the full validation, with the same error"""
+        precheck = SchemaPrecheck(build_schema_precheck(PRECHECK_SCHEMA))
+        validator = Draft4Validator(PRECHECK_SCHEMA)
+        documents = [{'id': 1}, {'id': True}, {'id': 1.0}, {'size': 1},\
+                    {'id': 1, 'size': None}, {'id': 1, 'size': '1'},\
+                    {'id': 1, 'license': 'MIT'}, {'id': 1, 'license': 3},\
+                    {'id': 1, 'flag': True}, {'id': 1, 'flag': [1]}, {'id': 1, 'flag': 'y'},\
+                    {'id': 1, 'owner': 'x'}, {'id': 1, 'shape': [1, 3]}, [], 'x']
+        rejected = 0
+        for document in documents:
+            precheck_err = precheck.check(document)
+            if precheck_err is None:
+                continue
+            rejected += 1
+            full_err = next(validator.iter_errors(document))
+            self.assertEqual((precheck_err.message, list(precheck_err.path)),\
+                            (full_err.message, list(full_err.path)), document)
+        self.assertEqual(rejected, 10)
+
+        # left to the full validator
+        self.assertIsNone(precheck.check({'id': 1, 'shape': [1, 3]}))
+        self.assertFalse(validator.is_valid({'id': 1, 'shape': [1, 3]}))
+
+    def test_03_stored_on_save(self):
+        """The summary is stored on save and used by the validation"""
+        mschema = MetadataSchema.objects.get(pk=2)
+        self.assertIsNone(mschema.schema_precheck)
+        mschema.save()
+        mschema = MetadataSchema.objects.get(pk=2)
+        self.assertEqual(mschema.schema_precheck['required'], ['id', 'name'])
+
+        success, err_msgs = validate_filemetadata(mschema.get_schema_dict(), {'id': 'one'},\
+                                    cache_key=mschema.get_validator_cache_key(),\
+                                    precheck=mschema.get_schema_precheck())
+        self.assertFalse(success)
+        self.assertEqual(err_msgs[0], "Error: 'name' is a required property")
+
+        validate_url = reverse('validate_filemetadata',\
+                        kwargs=dict(schema_name_slug='example', version='2.00'))
+        for use_precheck in (True, False):
+            with override_settings(VALIDATION_PRECHECK=use_precheck):
+                resp = self.client.post(validate_url, json.dumps({'name': 'x', 'id': '1'}),\
+                                    content_type='application/json')
+            verdict = json.loads(resp.content.decode('utf-8'))
+            self.assertFalse(verdict['valid'])
+            self.assertEqual(verdict['errors'][:2], ['Error Location: id',\
+                                                    "Error: '1' is not of type 'integer'"])
@@ -0,0 +1,94 @@
+import json
+from decimal import Decimal
+from unittest import mock
+from django.test import TestCase
+from apps.filemetadata.models import MetadataSchema
+from apps.filemetadata.response_cache import RESPONSE_CACHE
+from apps.filemetadata import schema_registry
+from apps.filemetadata.schema_registry import SCHEMA_REGISTRY, REGISTRY_CHANNEL
+
+
+class SchemaRegistryTestCase(TestCase):
+
+    fixtures = ['test_schemas.json']
+
+    def setUp(self):
+        # the registry and the cache outlive the rollback of each test
+        SCHEMA_REGISTRY.clear()
+        RESPONSE_CACHE.invalidate()
+
+    def test_01_lookups_without_queries(self):
+        """Latest and exact versions come from memory once loaded"""
+        SCHEMA_REGISTRY.load()
+        with self.assertNumQueries(0):
+            self.assertEqual(SCHEMA_REGISTRY.get_schema('example').version, Decimal('3.00'))
+            self.assertEqual(SCHEMA_REGISTRY.get_schema('example', '2').id, 2)
+            self.assertEqual(SCHEMA_REGISTRY.get_schema('example', '2.5'), None)
+            self.assertEqual(SCHEMA_REGISTRY.get_schema('example', 'x'), None)
+            self.assertEqual(SCHEMA_REGISTRY.get_schema('missing'), None)
+
+    def test_02_invalidated_on_save_and_delete(self):
+        """Saves and deletes reload the slug"""
+        SCHEMA_REGISTRY.load()
+        mschema = MetadataSchema.objects.get(pk=3)
+        mschema.published = False
+        mschema.save()
+        with self.assertNumQueries(1):
+            self.assertEqual(SCHEMA_REGISTRY.get_schema('example').id, 2)
+
+        # a changed title changes the slug
+        mschema = MetadataSchema.objects.get(pk=2)
+        mschema.title = 'renamed'
+        mschema.save()
+        self.assertEqual(SCHEMA_REGISTRY.get_schema('example').id, 1)
+        self.assertEqual(SCHEMA_REGISTRY.get_schema('renamed').id, 2)
+
+        MetadataSchema.objects.get(pk=1).delete()
+        self.assertEqual(SCHEMA_REGISTRY.get_schema('example'), None)
+
+    def test_03_redis_messages(self):
+        """Changes are published after commit and applied from other workers"""
+        redis_client = mock.Mock()
+        with mock.patch.object(schema_registry, 'get_redis_client', return_value=redis_client):
+            schema_registry.publish_invalidation(2, 'example')
+        channel, message = redis_client.publish.call_args[0]
+        self.assertEqual(channel, REGISTRY_CHANNEL)
+
+        SCHEMA_REGISTRY.load()
+        MetadataSchema.objects.filter(pk=3).update(published=False)
+        self.assertEqual(SCHEMA_REGISTRY.get_schema('example').id, 3)
+
+        SCHEMA_REGISTRY.handle_message(message.encode('utf-8'))
+        self.assertEqual(SCHEMA_REGISTRY.get_schema('example').id, 2)
+
+        SCHEMA_REGISTRY.handle_message(b'not json')
+        self.assertEqual(json.loads(message), {'id': 2, 'slug': 'example'})
+
+    def test_04_forked_worker_reloads(self):
+        """A process forked after the load reloads and starts its own listener"""
+        SCHEMA_REGISTRY.load()
+        SCHEMA_REGISTRY._loaded_pid = -1    # loaded by the parent process
+        with mock.patch.object(SCHEMA_REGISTRY, 'start_listener') as start_listener:
+            # reloaded from the shared cache
+            with self.assertNumQueries(0):
+                self.assertEqual(SCHEMA_REGISTRY.get_schema('example').id, 3)
+            self.assertEqual(start_listener.call_count, 1)
+            with self.assertNumQueries(0):
+                SCHEMA_REGISTRY.get_schema('example')
+
+    def test_05_load_through_shared_cache(self):
+        """Workers starting together read the schemas from the database once"""
+        with self.assertNumQueries(1):
+            SCHEMA_REGISTRY.load()
+        SCHEMA_REGISTRY.clear()     # another worker
+        with self.assertNumQueries(0):
+            SCHEMA_REGISTRY.load()
+        self.assertEqual(SCHEMA_REGISTRY.get_schema('example', '2').id, 2)
+
+        # a saved schema retires the shared copy
+        mschema = MetadataSchema.objects.get(pk=3)
+        mschema.published = False
+        mschema.save()
+        SCHEMA_REGISTRY.clear()
+        SCHEMA_REGISTRY.load()
+        self.assertEqual(SCHEMA_REGISTRY.get_schema('example').id, 2)
@@ -0,0 +1,68 @@
+from unittest import mock
+from django.test import TestCase, override_settings
+from apps.filemetadata.models import MetadataSchema, FileMetadata, SchemaRevalidationReport,\
+    REVALIDATION_STATUS_COMPLETE
+from apps.filemetadata import tasks
+from apps.filemetadata.tasks import get_id_ranges, revalidate_schema_filemetadata
+
+
+@override_settings(CELERY_ALWAYS_EAGER=True)
+class RevalidationTaskTestCase(TestCase):
+
+    fixtures = ['test_schemas.json']
+
+    def setUp(self):
+        mschema = MetadataSchema.objects.get(pk=2)
+        for datafile_id in range(1, 8):
+            metadata = {'id': datafile_id, 'name': 'n'}
+            if datafile_id % 3 == 0:
+                metadata = {'id': 'not an integer', 'name': 'n'}
+            FileMetadata.objects.create(schema=mschema, datafile_id=datafile_id, metadata=metadata)
+
+    def test_01_id_ranges(self):
+        """Primary key ranges cover min to max"""
+        self.assertEqual(get_id_ranges(1, 7, 3), [(1, 4), (4, 7), (7, 8)])
+        self.assertEqual(get_id_ranges(5, 5, 3), [(5, 6)])
+
+    def test_02_revalidate_in_chunks(self):
+        """Chunk results are combined into the report"""
+        with mock.patch.object(tasks, 'REVALIDATION_CHUNK_SIZE', 2),\
+            mock.patch.object(tasks, 'REVALIDATION_SAMPLE_SIZE', 1):
+            report_id = revalidate_schema_filemetadata.delay(2).get()
+
+        report = SchemaRevalidationReport.objects.get(pk=report_id)
+        self.assertEqual(report.status, REVALIDATION_STATUS_COMPLETE)
+        self.assertEqual(report.num_chunks, 4)
+        self.assertEqual(report.num_checked, 7)
+        self.assertEqual(report.num_invalid, 2)
+        self.assertEqual(len(report.invalid_samples), 1)
+        self.assertEqual(report.invalid_samples[0]['datafile_id'], 3)
+        self.assertEqual(report.invalid_samples[0]['errors'][0], 'Error Location: id')
+        self.assertTrue(report.finished)
+
+    def test_03_no_filemetadata(self):
+        """A schema without FileMetadata gets an empty, complete report"""
+        report = SchemaRevalidationReport.objects.get(pk=revalidate_schema_filemetadata(1))
+        self.assertEqual((report.status, report.num_chunks, report.num_checked),\
+                        (REVALIDATION_STATUS_COMPLETE, 0, 0))
+
+    def test_04_scheduled_on_save(self):
+        """Saving a published schema queues a revalidation after commit"""
+        mschema = MetadataSchema.objects.get(pk=2)
+        with mock.patch('django.db.transaction.on_commit') as on_commit,\
+            mock.patch.object(tasks.revalidate_schema_filemetadata, 'delay') as delay:
+            mschema.save()
+            for call_args in on_commit.call_args_list:
+                call_args[0][0]()
+            delay.assert_called_once_with(2)
+
+            delay.reset_mock()
+            on_commit.reset_mock()
+            mschema.published = False
+            mschema.save()
+            with override_settings(REVALIDATE_ON_SCHEMA_SAVE=False):
+                mschema.published = True
+                mschema.save()
+            for call_args in on_commit.call_args_list:
+                call_args[0][0]()
+            self.assertEqual(delay.call_count, 0)
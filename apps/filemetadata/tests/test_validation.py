@@ -0,0 +1,97 @@
+from django.test import TestCase
+from apps.filemetadata.models import MetadataSchema
+from apps.filemetadata.utils import validate_filemetadata, get_schema_validator,\
+    find_validation_errors, format_error_object, ERROR_MODE_COLLECT
+from apps.filemetadata.validator_cache import ValidatorCache, VALIDATOR_CACHE
+
+
+class ValidatorCacheTestCase(TestCase):
+
+    fixtures = ['test_schemas.json']
+
+    def setUp(self):
+        VALIDATOR_CACHE.clear()
+
+    def test_01_validator_reused(self):
+        """Validators are reused for the same schema version"""
+        mschema = MetadataSchema.objects.get(pk=1)
+        cache_key = mschema.get_validator_cache_key()
+
+        validator = get_schema_validator(mschema.schema, cache_key)
+        validator2 = get_schema_validator(mschema.schema, cache_key)
+        self.assertIs(validator, validator2)
+
+        valid, msg = validate_filemetadata(mschema.schema, {'id': 1}, cache_key)
+        self.assertEqual(valid, True)
+        self.assertEqual(len(VALIDATOR_CACHE), 1)
+
+        valid, msg = validate_filemetadata(mschema.schema, {'id': 'one'}, cache_key)
+        self.assertEqual(valid, False)
+
+    def test_02_content_key(self):
+        """Unkeyed schemas are cached by content"""
+        schema = {'$schema': 'http://json-schema.org/draft-04/schema#', 'type': 'object'}
+        validator = get_schema_validator(schema)
+        validator2 = get_schema_validator(dict(schema))
+        self.assertIs(validator, validator2)
+
+    def test_03_invalidate_on_save(self):
+        """Saving a schema drops its cached validators"""
+        mschema = MetadataSchema.objects.get(pk=1)
+        get_schema_validator(mschema.schema, mschema.get_validator_cache_key())
+        self.assertEqual(len(VALIDATOR_CACHE), 1)
+
+        mschema.save()
+        self.assertEqual(len(VALIDATOR_CACHE), 0)
+
+    def test_04_lru_and_ttl(self):
+        """Cache is bounded by size and age"""
+        vcache = ValidatorCache(max_size=2, ttl=None)
+        vcache.set('a', 1)
+        vcache.set('b', 2)
+        vcache.get('a')
+        vcache.set('c', 3)
+        self.assertEqual(vcache.get('b'), None)
+        self.assertEqual(vcache.get('a'), 1)
+        self.assertEqual(vcache.get('c'), 3)
+
+        vcache = ValidatorCache(max_size=2, ttl=-1)
+        vcache.set('a', 1)
+        self.assertEqual(vcache.get('a'), None)
+
+
+class ErrorModeTestCase(TestCase):
+
+    schema = {'$schema': 'http://json-schema.org/draft-04/schema#',\
+            'type': 'object',\
+            'properties': {'id': {'type': 'integer'},\
+                        'tags': {'type': 'array', 'items': {'type': 'string'}},\
+                        'size': {'anyOf': [{'type': 'integer'}, {'type': 'null'}]}},\
+            'required': ['id', 'name']}
+
+    def test_01_fail_fast(self):
+        """The default mode stops at the first error"""
+        errs, is_truncated = find_validation_errors(self.schema, {'id': 'x', 'tags': [1, 2]})
+        self.assertEqual(len(errs), 1)
+        self.assertFalse(is_truncated)
+        self.assertEqual(find_validation_errors(self.schema, {'id': 1, 'name': 'x'}), ([], False))
+
+    def test_02_collect(self):
+        """The collect mode reports every error, most relevant first, as objects"""
+        document = {'tags': ['a', 1, 2], 'size': 'big'}
+        errs, is_truncated = find_validation_errors(self.schema, document, mode=ERROR_MODE_COLLECT)
+        self.assertFalse(is_truncated)
+        details = [format_error_object(x) for x in errs]
+        self.assertEqual([(x['pointer'], x['keyword']) for x in details],\
+                        [('', 'required'), ('', 'required'), ('/size', 'type'),\
+                        ('/tags/1', 'type'), ('/tags/2', 'type')])
+        self.assertEqual(details[2]['schema_pointer'], '/properties/size/anyOf/0/type')
+        self.assertEqual(details[3]['message'], "1 is not of type 'string'")
+
+        errs, is_truncated = find_validation_errors(self.schema, document,\
+                                                mode=ERROR_MODE_COLLECT, max_errors=2)
+        self.assertEqual((len(errs), is_truncated), (2, True))
+
+        errs, is_truncated = find_validation_errors(self.schema, document,\
+                                                mode=ERROR_MODE_COLLECT, time_budget=-1)
+        self.assertEqual((len(errs), is_truncated), (1, True))
@@ -0,0 +1,432 @@
+import gzip
+import json
+import re
+from django.core.urlresolvers import reverse
+from django.db import connection
+from django.test import TestCase
+from django.test.utils import CaptureQueriesContext
+from apps.filemetadata.compression import choose_encoding
+from apps.filemetadata.models import MetadataSchema
+from apps.filemetadata.response_cache import RESPONSE_CACHE
+from apps.filemetadata.schema_registry import SCHEMA_REGISTRY
+from apps.filemetadata.views import ERR_MSG_NO_DATA, ERR_MSG_INVALID_JSON,\
+    VALIDATE_DEFERRED_FIELDS
+
+
+class ViewSchemaTestCase(TestCase):
+
+    fixtures = ['test_schemas.json']
+
+    def setUp(self):
+        # the registry and the cache outlive the rollback of each test
+        SCHEMA_REGISTRY.clear()
+        RESPONSE_CACHE.invalidate()
+        self.schema_url = reverse('view_schema_with_identifier',\
+                                kwargs=dict(schema_name_slug='example', version='1.00'))
+
+    def test_01_stored_schema_json(self):
+        """Schema JSON is stored on save and sent as is"""
+        mschema = MetadataSchema.objects.get(pk=1)
+        mschema.save()
+        self.assertEqual(mschema.schema_json, mschema.as_json())
+        self.assertEqual(mschema.schema_json_pretty, mschema.as_json(indent=4))
+
+        resp = self.client.get(self.schema_url)
+        self.assertEqual(resp.status_code, 200)
+        self.assertEqual(resp.content.decode('utf-8'), mschema.schema_json)
+
+        resp = self.client.get(self.schema_url, {'pretty': 1})
+        self.assertEqual(resp.content.decode('utf-8'), mschema.schema_json_pretty)
+
+    def test_02_unstored_schema_json(self):
+        """Rows without stored JSON fall back to as_json()"""
+        MetadataSchema.objects.filter(pk=1).update(schema_json='', schema_json_pretty='')
+        SCHEMA_REGISTRY.clear()     # update() sends no signals
+        RESPONSE_CACHE.invalidate()
+        mschema = MetadataSchema.objects.get(pk=1)
+
+        resp = self.client.get(self.schema_url)
+        self.assertEqual(resp.status_code, 200)
+        self.assertEqual(resp.content.decode('utf-8'), mschema.as_json())
+
+    def test_03_conditional_get(self):
+        """ETag and Last-Modified answer repeat requests with a 304"""
+        MetadataSchema.objects.get(pk=1).save()
+        resp = self.client.get(self.schema_url)
+        self.assertEqual(resp.status_code, 200)
+        etag = resp['ETag']
+        self.assertTrue(resp.has_header('Last-Modified'))
+
+        # answered from the schema registry
+        with self.assertNumQueries(0):
+            resp = self.client.get(self.schema_url, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(resp.status_code, 304)
+        self.assertEqual(resp.content, b'')
+
+        resp = self.client.get(self.schema_url, HTTP_IF_MODIFIED_SINCE=resp['Last-Modified'])
+        self.assertEqual(resp.status_code, 304)
+
+        # pretty JSON has its own ETag
+        resp = self.client.get(self.schema_url, {'pretty': 1}, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(resp.status_code, 200)
+
+        # editing the schema changes the ETag
+        mschema = MetadataSchema.objects.get(pk=1)
+        mschema.description = 'changed'
+        mschema.save()
+        resp = self.client.get(self.schema_url, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(resp.status_code, 200)
+        self.assertNotEqual(resp['ETag'], etag)
+
+    def test_04_schema_list_conditional_get(self):
+        """The schema list ETag changes when a schema is unpublished"""
+        list_url = reverse('view_schema_list')
+        resp = self.client.get(list_url)
+        self.assertEqual(resp.status_code, 200)
+        etag = resp['ETag']
+
+        resp = self.client.get(list_url, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(resp.status_code, 304)
+
+        MetadataSchema.objects.filter(pk=1).update(published=False)
+        RESPONSE_CACHE.invalidate()
+        resp = self.client.get(list_url, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(resp.status_code, 200)
+
+
+    def test_05_immutable_versions(self):
+        """Published versions are cached for good, unpublished ones are revalidated"""
+        MetadataSchema.objects.get(pk=1).save()
+        resp = self.client.get(self.schema_url)
+        self.assertIn('immutable', resp['Cache-Control'])
+        self.assertIn('max-age=31536000', resp['Cache-Control'])
+        self.assertIn('public', resp['Cache-Control'])
+
+        resp = self.client.get(self.schema_url, HTTP_IF_NONE_MATCH=resp['ETag'])
+        self.assertEqual(resp.status_code, 304)
+        self.assertIn('immutable', resp['Cache-Control'])
+
+        mschema = MetadataSchema.objects.get(pk=1)
+        mschema.published = False
+        mschema.save()
+        resp = self.client.get(self.schema_url)
+        self.assertEqual(resp.status_code, 200)
+        self.assertNotIn('immutable', resp['Cache-Control'])
+        self.assertIn('max-age=0', resp['Cache-Control'])
+
+        resp = self.client.get(reverse('view_schema_list'))
+        self.assertIn('must-revalidate', resp['Cache-Control'])
+        self.assertFalse(self.client.get(reverse('view_schema_list'), {'limit': 0})\
+                        .has_header('Cache-Control'))
+
+
+    def test_06_precompressed_variants(self):
+        """Clients accepting gzip get the variant compressed on save"""
+        mschema = MetadataSchema.objects.get(pk=1)
+        mschema.save()
+        resp = self.client.get(self.schema_url)
+        self.assertFalse(resp.has_header('Content-Encoding'))
+        self.assertEqual(resp['Vary'], 'Accept-Encoding')
+
+        with self.assertNumQueries(0):
+            gzip_resp = self.client.get(self.schema_url, HTTP_ACCEPT_ENCODING='gzip, deflate')
+        self.assertEqual(gzip_resp['Content-Encoding'], 'gzip')
+        self.assertEqual(gzip.decompress(gzip_resp.content).decode('utf-8'), mschema.schema_json)
+        self.assertNotEqual(gzip_resp['ETag'], resp['ETag'])
+
+        resp = self.client.get(self.schema_url, {'pretty': 1}, HTTP_ACCEPT_ENCODING='gzip')
+        self.assertEqual(gzip.decompress(resp.content).decode('utf-8'),\
+                        mschema.schema_json_pretty)
+
+        resp = self.client.get(self.schema_url, HTTP_ACCEPT_ENCODING='gzip;q=0, identity')
+        self.assertFalse(resp.has_header('Content-Encoding'))
+
+        variants = {'gzip': b'', 'br': b''}
+        self.assertEqual(choose_encoding('gzip, br', variants), 'br')
+        self.assertEqual(choose_encoding('gzip, br;q=0.5', variants), 'gzip')
+        self.assertEqual(choose_encoding('*', {'gzip': b''}), 'gzip')
+        self.assertEqual(choose_encoding('br', {'gzip': b''}), None)
+
+    def test_07_unpublished_conditional_get(self):
+        """Schemas outside the registry answer a 304 without loading their JSON"""
+        mschema = MetadataSchema.objects.get(pk=1)
+        mschema.published = False
+        mschema.save()
+        resp = self.client.get(self.schema_url, HTTP_ACCEPT_ENCODING='gzip')
+        self.assertEqual(resp['Content-Encoding'], 'gzip')
+
+        with CaptureQueriesContext(connection) as queries:
+            resp = self.client.get(self.schema_url, HTTP_ACCEPT_ENCODING='gzip',\
+                                HTTP_IF_NONE_MATCH=resp['ETag'])
+        self.assertEqual(resp.status_code, 304)
+        schema_sql = [x['sql'] for x in queries.captured_queries\
+                    if 'FROM "filemetadata_metadataschema"' in x['sql']]
+        self.assertEqual(len(schema_sql), 1)
+        # the compressed variants are only tested for NULL
+        selected_sql = re.sub(r'"\w+"\."\w+" IS NOT NULL', '', schema_sql[0])
+        for column in ['schema', 'schema_json', 'schema_json_gzip']:
+            self.assertNotIn('"filemetadata_metadataschema"."%s"' % column, selected_sql)
+
+    def test_08_missing_schema_not_cached(self):
+        """A 404 is not cached: the schema is found once it's added"""
+        url = reverse('view_schema_with_identifier',\
+                    kwargs=dict(schema_name_slug='example', version='9.00'))
+        self.assertEqual(self.client.get(url).status_code, 404)
+
+        MetadataSchema.objects.filter(pk=1).update(version='9.00', published=False)
+        self.assertEqual(self.client.get(url).status_code, 200)
+
+
+class ViewLatestSchemaTestCase(TestCase):
+
+    fixtures = ['test_schemas.json']
+
+    def setUp(self):
+        SCHEMA_REGISTRY.clear()
+        RESPONSE_CACHE.invalidate()
+        self.latest_url = reverse('view_latest_schema', kwargs=dict(schema_name_slug='example'))
+        for mschema in MetadataSchema.objects.all():
+            mschema.save()
+
+    def test_01_latest_published(self):
+        """The latest published version, with short-lived caching"""
+        resp = self.client.get(self.latest_url)
+        self.assertEqual(resp.status_code, 200)
+        self.assertEqual(json.loads(resp.content.decode('utf-8'))['self']['version'], 3.0)
+        self.assertTrue(resp['Content-Location'].endswith('/schema/example/3.00'))
+        self.assertIn('max-age=60', resp['Cache-Control'])
+        self.assertIn('must-revalidate', resp['Cache-Control'])
+
+        resp = self.client.get(self.latest_url, HTTP_IF_NONE_MATCH=resp['ETag'])
+        self.assertEqual(resp.status_code, 304)
+        self.assertIn('max-age=60', resp['Cache-Control'])
+
+    def test_02_moves_with_publishing(self):
+        """Unpublishing the latest version moves the target"""
+        resp = self.client.get(self.latest_url)
+        etag = resp['ETag']
+
+        mschema = MetadataSchema.objects.get(pk=3)
+        mschema.published = False
+        mschema.save()
+
+        resp = self.client.get(self.latest_url, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(resp.status_code, 200)
+        self.assertTrue(resp['Content-Location'].endswith('/schema/example/2.00'))
+
+        MetadataSchema.objects.update(published=False)
+        SCHEMA_REGISTRY.clear()
+        RESPONSE_CACHE.invalidate()
+        self.assertEqual(self.client.get(self.latest_url).status_code, 404)
+
+
+class ViewSchemaListTestCase(TestCase):
+
+    fixtures = ['test_schemas.json']
+
+    def setUp(self):
+        SCHEMA_REGISTRY.clear()
+        RESPONSE_CACHE.invalidate()
+        self.list_url = reverse('view_schema_list')
+        for mschema in MetadataSchema.objects.all():
+            mschema.save()
+
+    def get_json(self, resp):
+        content = b''.join(resp.streaming_content) if resp.streaming else resp.content
+        return json.loads(content.decode('utf-8'))
+
+    def test_01_full_list(self):
+        """Send every published schema"""
+        resp = self.client.get(self.list_url)
+        self.assertEqual(resp.status_code, 200)
+        schemas = self.get_json(resp)
+        self.assertEqual([x['self']['version'] for x in schemas], [3.0, 2.0, 1.0])
+
+        # same output as json.dumps(..., indent=4)
+        resp = self.client.get(self.list_url, {'pretty': 1})
+        content = b''.join(resp.streaming_content).decode('utf-8')
+        self.assertEqual(content, json.dumps(json.loads(content), indent=4))
+
+    def test_02_keyset_pages(self):
+        """Page through the list with limit and cursor"""
+        resp = self.client.get(self.list_url, {'limit': 2, 'fields': 'title,version,url'})
+        page = self.get_json(resp)
+        self.assertEqual([x['version'] for x in page], [3.0, 2.0])
+        self.assertEqual(list(page[0].keys()), ['title', 'version', 'url'])
+        self.assertTrue('rel="next"' in resp['Link'])
+
+        resp = self.client.get(self.list_url, {'limit': 2, 'fields': 'title,version,url',\
+                                            'cursor': resp['X-Next-Cursor']})
+        page = self.get_json(resp)
+        self.assertEqual([x['version'] for x in page], [1.0])
+        self.assertFalse(resp.has_header('Link'))
+
+    def test_03_bad_parameters(self):
+        """Invalid limit, cursor or fields"""
+        for params in [{'limit': 0}, {'limit': 'x'}, {'cursor': 'nope'}, {'fields': 'schema'}]:
+            resp = self.client.get(self.list_url, params)
+            self.assertEqual(resp.status_code, 400)
+
+    def test_04_cached_pages(self):
+        """Pages are cached until a schema is saved, the full list is streamed"""
+        params = {'limit': 5, 'fields': 'title,version'}
+        self.assertEqual(len(self.get_json(self.client.get(self.list_url, params))), 3)
+        # with the parameters in another order
+        with self.assertNumQueries(0):
+            resp = self.client.get(self.list_url + '?fields=title,version&limit=5&unknown=1')
+        self.assertEqual(len(self.get_json(resp)), 3)
+
+        mschema = MetadataSchema.objects.get(pk=1)
+        mschema.published = False
+        mschema.save()
+        self.assertEqual(len(self.get_json(self.client.get(self.list_url, params))), 2)
+
+        resp = self.client.get(self.list_url)
+        self.assertTrue(resp.streaming)
+        self.assertEqual(len(self.get_json(resp)), 2)
+
+    def test_05_conditional_get_skips_rendering(self):
+        """A 304 comes from the cached list state, without a query"""
+        etag = self.client.get(self.list_url)['ETag']
+        with self.assertNumQueries(0):
+            resp = self.client.get(self.list_url, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(resp.status_code, 304)
+
+        # deleting a schema changes the ETag
+        MetadataSchema.objects.get(pk=2).delete()
+        resp = self.client.get(self.list_url, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(resp.status_code, 200)
+        self.assertNotEqual(resp['ETag'], etag)
+
+
+class ValidateViewTestCase(TestCase):
+
+    fixtures = ['test_schemas.json']
+
+    def setUp(self):
+        SCHEMA_REGISTRY.clear()
+        self.validate_url = reverse('validate_filemetadata',\
+                                kwargs=dict(schema_name_slug='example', version='1.00'))
+
+    def test_01_validate_json_body(self):
+        """Validate metadata sent as an application/json body"""
+        resp = self.client.post(self.validate_url, json.dumps({'id': 7}),\
+                                content_type='application/json')
+        self.assertEqual(resp.status_code, 200)
+        verdict = json.loads(resp.content.decode('utf-8'))
+        self.assertEqual(verdict['valid'], True)
+        self.assertEqual(verdict['errors'], [])
+        self.assertEqual(verdict['schema']['slug'], 'example')
+
+        resp = self.client.post(self.validate_url, json.dumps({'name': 'no id'}),\
+                                content_type='application/json')
+        verdict = json.loads(resp.content.decode('utf-8'))
+        self.assertEqual(verdict['valid'], False)
+        self.assertTrue(len(verdict['errors']) > 0)
+
+    def test_02_validate_form_data(self):
+        """Validate metadata sent in the form-encoded "data" field"""
+        resp = self.client.post(self.validate_url, {'data': json.dumps({'id': 7})})
+        self.assertEqual(resp.status_code, 200)
+        verdict = json.loads(resp.content.decode('utf-8'))
+        self.assertEqual(verdict['valid'], True)
+
+    def test_03_validate_bad_input(self):
+        """Missing or invalid JSON data"""
+        resp = self.client.post(self.validate_url, {})
+        self.assertEqual(resp.status_code, 400)
+        self.assertEqual(json.loads(resp.content.decode('utf-8'))['errors'], [ERR_MSG_NO_DATA])
+
+        resp = self.client.post(self.validate_url, 'howdy', content_type='application/json')
+        self.assertEqual(resp.status_code, 400)
+        self.assertEqual(json.loads(resp.content.decode('utf-8'))['errors'], [ERR_MSG_INVALID_JSON])
+
+        resp = self.client.post(self.validate_url, b'{"id": "\xff"}', content_type='application/json')
+        self.assertEqual(resp.status_code, 400)
+        self.assertEqual(json.loads(resp.content.decode('utf-8'))['errors'], [ERR_MSG_INVALID_JSON])
+
+    def test_05_error_modes(self):
+        """Every error with "errors=all", machine readable details in both modes"""
+        url = reverse('validate_filemetadata',\
+                    kwargs=dict(schema_name_slug='example', version='3.00'))
+        body = json.dumps({'id': 'x', 'price': -1, 'tags': []})
+        verdict = json.loads(self.client.post(url, body, content_type='application/json')\
+                            .content.decode('utf-8'))
+        self.assertEqual(len(verdict['error_details']), 1)
+
+        resp = self.client.post(url + '?errors=all', body, content_type='application/json')
+        verdict = json.loads(resp.content.decode('utf-8'))
+        self.assertFalse(verdict['valid'])
+        self.assertFalse(verdict['errors_truncated'])
+        self.assertEqual(sorted((x['pointer'], x['keyword']) for x in verdict['error_details']),\
+                        [('', 'required'), ('/id', 'type'), ('/price', 'minimum'),\
+                        ('/tags', 'minItems')])
+
+        resp = self.client.post(url + '?errors=all&max_errors=2', body,\
+                                content_type='application/json')
+        verdict = json.loads(resp.content.decode('utf-8'))
+        self.assertEqual((len(verdict['error_details']), verdict['errors_truncated']), (2, True))
+
+        for query in ['?errors=some', '?errors=all&max_errors=0', '?errors=all&max_errors=x']:
+            resp = self.client.post(url + query, body, content_type='application/json')
+            self.assertEqual(resp.status_code, 400)
+
+    def test_06_validate_defers_stored_json(self):
+        """Unpublished schemas are read without their stored JSON copies"""
+        MetadataSchema.objects.filter(pk=1).update(published=False)
+        RESPONSE_CACHE.invalidate()     # update() sends no signals
+        SCHEMA_REGISTRY.load()
+        with CaptureQueriesContext(connection) as queries:
+            resp = self.client.post(self.validate_url, json.dumps({'id': 7}),\
+                                    content_type='application/json')
+        self.assertEqual(resp.status_code, 200)
+        schema_sql = [x['sql'] for x in queries.captured_queries\
+                    if 'FROM "filemetadata_metadataschema"' in x['sql']]
+        self.assertEqual(len(schema_sql), 1)
+        for column in VALIDATE_DEFERRED_FIELDS:
+            self.assertNotIn('"%s"' % column, schema_sql[0])
+
+    def test_04_validate_unknown_schema(self):
+        """Unknown schema versions are a 404"""
+        url = reverse('validate_filemetadata',\
+                    kwargs=dict(schema_name_slug='example', version='9.00'))
+        resp = self.client.post(url, json.dumps({'id': 7}), content_type='application/json')
+        self.assertEqual(resp.status_code, 404)
+
+
+class ValidateBatchViewTestCase(TestCase):
+
+    fixtures = ['test_schemas.json']
+
+    def setUp(self):
+        SCHEMA_REGISTRY.clear()
+        self.batch_url = reverse('validate_filemetadata_batch',\
+                                kwargs=dict(schema_name_slug='example', version='1.00'))
+
+    def get_verdicts(self, resp):
+        content = b''.join(resp.streaming_content).decode('utf-8')
+        return [json.loads(line) for line in content.splitlines()]
+
+    def test_01_validate_ndjson(self):
+        """One streamed verdict per NDJSON line"""
+        body = '\n'.join([json.dumps({'id': 1}), 'howdy', '', json.dumps({'id': 'x'})])
+        resp = self.client.post(self.batch_url, body, content_type='application/x-ndjson')
+        self.assertEqual(resp.status_code, 200)
+
+        verdicts = self.get_verdicts(resp)
+        self.assertEqual([v['index'] for v in verdicts], [0, 1, 2])
+        self.assertEqual([v['valid'] for v in verdicts], [True, False, False])
+        self.assertEqual(verdicts[1]['errors'], [ERR_MSG_INVALID_JSON])
+
+    def test_02_validate_json_array(self):
+        """One streamed verdict per JSON array element"""
+        body = json.dumps([{'id': 1}, {'id': 2}, {}])
+        resp = self.client.post(self.batch_url, body, content_type='application/json')
+        verdicts = self.get_verdicts(resp)
+        self.assertEqual([v['valid'] for v in verdicts], [True, True, False])
+
+        resp = self.client.post(self.batch_url, json.dumps({'id': 1}),\
+                                content_type='application/json')
+        verdicts = self.get_verdicts(resp)
+        self.assertEqual(len(verdicts), 1)
+        self.assertEqual(verdicts[0]['valid'], False)
@@ -1,14 +1,32 @@
 from django.conf.urls import url
 
-from apps.filemetadata.views import view_schema, view_schema_list
+from apps.filemetadata.views import view_schema, view_latest_schema, validate,\
+    validate_batch
+from apps.filemetadata.views_schema_list import view_schema_list
+from apps.filemetadata.views_filemetadata import search_filemetadata,\
+    export_filemetadata, view_filemetadata_versions, view_filemetadata_version,\
+    diff_filemetadata_versions, patch_filemetadata
 #from apps.filemetadata.views_add import add_schema
 
-urlpatterns = [
+# The read-only schema and validation hot paths, also served
+# on their own by config/wsgi_api.py (see urls_api.py)
+schema_urlpatterns = [
+    url(r'^schema/(?P<schema_name_slug>(\w|-){4,150})/(?P<version>\d+(\.\d{0,2}|))/validate/?$', validate, name='validate_filemetadata'),
+    url(r'^schema/(?P<schema_name_slug>(\w|-){4,150})/(?P<version>\d+(\.\d{0,2}|))/validate-batch/?$', validate_batch, name='validate_filemetadata_batch'),
+    url(r'^schema/(?P<schema_name_slug>(\w|-){4,150})/(?P<version>\d+(\.\d{0,2}|))/?$', view_schema, name='view_schema_with_identifier'),
+    url(r'^schema/(?P<schema_name_slug>(\w|-){4,150})/?$', view_latest_schema, name='view_latest_schema'),
+    url(r'^schema-list/?$', view_schema_list, name='view_schema_list'),
+]
+
+urlpatterns = schema_urlpatterns + [
 
     #url(r'^add-schema', add_schema, name='add_schema'),
-    url(r'^schema/(?P<schema_name_slug>(\w|-){4,150})/(?P<version>\d+(\.\d{0,2}|))/?$', view_schema, name='view_schema_with_identifier'),
-    #url(r'^schema/(?P<schema_name_slug>(\w|-){4,150})/?$', view_schema, name='view_schema'),
-    #url(r'^schema-list$', view_schema_list, name='view_schema_list'),
+    url(r'^file-metadata/search/?$', search_filemetadata, name='search_filemetadata'),
+    url(r'^file-metadata/export/?$', export_filemetadata, name='export_filemetadata'),
+    url(r'^file-metadata/(?P<file_metadata_id>\d+)/?$', patch_filemetadata, name='patch_filemetadata'),
+    url(r'^file-metadata/(?P<file_metadata_id>\d+)/versions/?$', view_filemetadata_versions, name='view_filemetadata_versions'),
+    url(r'^file-metadata/(?P<file_metadata_id>\d+)/versions/(?P<version>\d+)/?$', view_filemetadata_version, name='view_filemetadata_version'),
+    url(r'^file-metadata/(?P<file_metadata_id>\d+)/diff/?$', diff_filemetadata_versions, name='diff_filemetadata_versions'),
     #url(r'^tsv-json-form/$', view_json_form, name='view_json_form'),
     #url(r'^make-json-schema/$', view_make_json_schema, name='view_make_json_schema'),
     #url(r'^make-all-json-schemas/$', view_make_all_json_schemas, name='view_make_all_json_schemas'),
@@ -0,0 +1,11 @@
+"""
+URLs of the lightweight schema API application (config/wsgi_api.py):
+the schema GETs and validation, at the same paths as in config/urls.py
+"""
+from django.conf.urls import include, url
+
+from apps.filemetadata.urls import schema_urlpatterns
+
+urlpatterns = [
+    url(r'^api/metadata/', include(schema_urlpatterns)),
+]
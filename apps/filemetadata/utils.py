@@ -5,16 +5,41 @@ See jsonschema docs for error breakdown:
 https://python-jsonschema.readthedocs.org/en/latest/errors/#module-jsonschema
 """
 import json
+import time
 import jsonschema
 from collections import OrderedDict
 from jsonschema import Draft4Validator
+from jsonschema.exceptions import best_match, relevance
+from django.conf import settings
 from apps.proj_utils.msg_util import msg, msgt
+from apps.filemetadata.json_pointer import format_json_pointer
+from apps.filemetadata.validator_cache import VALIDATOR_CACHE, get_schema_content_key
+from apps.filemetadata.schema_compiler import compile_schema, UnsupportedSchemaError
+from apps.filemetadata.schema_precheck import get_schema_precheck
 
 
 # JSON Schema validator information
 CHOSEN_VALIDATOR_CLASS = Draft4Validator
 ERR_NOTE_VALIDATOR_TYPE = '(Note: JSON schema Draft 4 validation was used)'
 
+# Validation engines, chosen with settings.VALIDATION_ENGINE
+#   - jsonschema: CHOSEN_VALIDATOR_CLASS
+#   - compiled: schema_compiler.compile_schema, falling back to
+#       CHOSEN_VALIDATOR_CLASS for schemas it can't compile
+VALIDATION_ENGINE_JSONSCHEMA = 'jsonschema'
+VALIDATION_ENGINE_COMPILED = 'compiled'
+VALIDATION_ENGINES = [VALIDATION_ENGINE_JSONSCHEMA, VALIDATION_ENGINE_COMPILED]
+
+# Error modes, see find_validation_errors
+#   - fail-fast: the first error only, the cheapest (e.g. bulk ingest)
+#   - collect: every error, up to settings.VALIDATION_MAX_ERRORS and within
+#       settings.VALIDATION_ERROR_TIME_BUDGET seconds, most relevant first
+ERROR_MODE_FAIL_FAST = 'fail-fast'
+ERROR_MODE_COLLECT = 'collect'
+ERROR_MODES = [ERROR_MODE_FAIL_FAST, ERROR_MODE_COLLECT]
+DEFAULT_MAX_ERRORS = 100
+DEFAULT_ERROR_TIME_BUDGET = 2.0     # seconds
+
 # General error messages for Null (None) values
 ERR_MSG_JSON_CONVERSION_FAILED = 'The schema could not be converted to JSON.'
 ERR_MSG_SCHEMA_NONE = 'The schema was None (or null)'
@@ -39,8 +64,8 @@ def format_error_message(jsonschema_err):
         " or jsonschema.exceptions.ValidationError ")
 
     err_msgs = []
-    if jsonschema_err.path:
-        path_as_strings = [str(x) for x in jsonschema_err.path]
+    if jsonschema_err.absolute_path:
+        path_as_strings = [str(x) for x in jsonschema_err.absolute_path]
         err_msg = 'Error Location: %s' % '->'.join(path_as_strings)
         err_msgs.append(err_msg)
     err_msgs.append('Error: %s' % jsonschema_err.message)
@@ -48,6 +73,35 @@ def format_error_message(jsonschema_err):
 
     return err_msgs
 
+
+def format_error_messages(jsonschema_errs):
+    """
+    Formatted error messages for a list of errors, with one validator note
+    """
+    err_msgs = []
+    for jsonschema_err in jsonschema_errs:
+        err_msgs += format_error_message(jsonschema_err)[:-1]
+    if err_msgs:
+        err_msgs.append(ERR_NOTE_VALIDATOR_TYPE)
+    return err_msgs
+
+
+def format_error_object(jsonschema_err):
+    """
+    A jsonschema error as a JSON ready object:
+        {"pointer": "/tags/0",      # JSON pointer to the invalid value
+         "keyword": "type",         # failed schema keyword
+         "message": "5 is not of type 'string'",
+         "schema_pointer": "/properties/tags/items/type"}
+    """
+    keyword = jsonschema_err.validator
+    return OrderedDict([('pointer', format_json_pointer(jsonschema_err.absolute_path)),\
+                        ('keyword', keyword if isinstance(keyword, str) else None),\
+                        ('message', jsonschema_err.message),\
+                        ('schema_pointer',\
+                            format_json_pointer(jsonschema_err.absolute_schema_path))])
+
+
 def validate_schema_string(schema_string):
     """
     Convert schema_string to a python OrderedDict
@@ -90,30 +144,148 @@ def validate_schema(schema_dict):
         return False, format_error_message(schema_err)
 
 
-def validate_filemetadata(schema_dict, data_dict):
+def get_validation_engine():
     """
-    (a) Validate a JSON schema and then
-    (b) Validate data against that JSON schema
+    Return the engine selected by settings.VALIDATION_ENGINE
+    """
+    engine = getattr(settings, 'VALIDATION_ENGINE', VALIDATION_ENGINE_JSONSCHEMA)
+    assert engine in VALIDATION_ENGINES,\
+        'settings.VALIDATION_ENGINE must be one of: %s' % VALIDATION_ENGINES
+    return engine
+
+
+def build_validator(schema_dict, engine=VALIDATION_ENGINE_JSONSCHEMA):
+    """
+    Build a validator for "schema_dict" using the given engine
+    """
+    if engine == VALIDATION_ENGINE_COMPILED:
+        try:
+            return compile_schema(schema_dict)
+        except UnsupportedSchemaError:
+            pass    # use jsonschema instead
+
+    return CHOSEN_VALIDATOR_CLASS(schema_dict)
+
+
+def get_schema_validator(schema_dict, cache_key=None, engine=None):
+    """
+    Return a (cached) validator for "schema_dict"
+
+    "cache_key" identifies the schema, e.g. MetadataSchema.get_validator_cache_key().
+    If it isn't given, a hash of the schema content is used.
+    "engine" defaults to settings.VALIDATION_ENGINE
+    """
+    if cache_key is None:
+        cache_key = get_schema_content_key(schema_dict)
+
+    if engine is None:
+        engine = get_validation_engine()
+
+    return VALIDATOR_CACHE.get_or_build(cache_key + (engine,),
+                                        lambda: build_validator(schema_dict, engine))
+
+
+def get_error_limits(max_errors=None, time_budget=None):
+    """
+    (max errors, time budget in seconds) for the collect mode,
+    defaulting to the settings
     """
+    if max_errors is None:
+        max_errors = getattr(settings, 'VALIDATION_MAX_ERRORS', DEFAULT_MAX_ERRORS)
+    if time_budget is None:
+        time_budget = getattr(settings, 'VALIDATION_ERROR_TIME_BUDGET', DEFAULT_ERROR_TIME_BUDGET)
+    return max(1, max_errors), time_budget
+
+
+def collect_validation_errors(validator, data_dict, max_errors, time_budget):
+    """
+    (up to "max_errors" errors, most relevant first, True if some were left out).
+    The time budget is checked between errors, and the first one is
+    always kept so an invalid document is never reported as valid.
+    """
+    deadline = time.time() + time_budget if time_budget else None
+    errs = []
+    is_truncated = False
+    for validation_err in validator.iter_errors(data_dict):
+        if len(errs) == max_errors or\
+            (errs and deadline is not None and time.time() > deadline):
+            is_truncated = True
+            break
+        errs.append(validation_err)
+
+    # jsonschema's relevance: errors nearer the document root first, and
+    # equally relevant errors in the order found.  best_match() then
+    # picks the likeliest cause inside "anyOf"/"oneOf" errors
+    errs.sort(key=relevance, reverse=True)
+    return [best_match([x]) for x in errs], is_truncated
+
+
+def find_validation_errors(schema_dict, data_dict, cache_key=None, precheck=None,\
+                        mode=ERROR_MODE_FAIL_FAST, max_errors=None, time_budget=None):
+    """
+    ([jsonschema errors], True if some were left out) of data validated
+    against a schema; no errors if it's valid.
+
+    fail-fast: the pre-check (unless settings.VALIDATION_PRECHECK is
+        False, see schema_precheck.py) and then the validator of
+        settings.VALIDATION_ENGINE, stopping at the first error
+    collect: jsonschema's iter_errors(), limited by "max_errors" and
+        "time_budget" (see get_error_limits)
+    """
+    assert mode in ERROR_MODES, 'mode must be one of: %s' % ERROR_MODES
+
     if schema_dict is None:
-        return False, [ERR_MSG_SCHEMA_NONE]
+        return [jsonschema.exceptions.SchemaError(ERR_MSG_SCHEMA_NONE)], False
 
     if data_dict is None:
-        return False, [ERR_MSG_DATA_NONE]
+        return [jsonschema.exceptions.ValidationError(ERR_MSG_DATA_NONE)], False
 
     try:
-        el_validator = CHOSEN_VALIDATOR_CLASS(schema_dict)
+        if mode == ERROR_MODE_COLLECT:
+            validator = get_schema_validator(schema_dict, cache_key,\
+                                        engine=VALIDATION_ENGINE_JSONSCHEMA)
+            return collect_validation_errors(validator, data_dict,\
+                                            *get_error_limits(max_errors, time_budget))
+
+        if getattr(settings, 'VALIDATION_PRECHECK', True):
+            if precheck is None:
+                precheck = get_schema_precheck(schema_dict, cache_key)
+            precheck_err = precheck.check(data_dict)
+            if precheck_err is not None:
+                return [precheck_err], False
+
+        el_validator = get_schema_validator(schema_dict, cache_key)
         el_validator.validate(data_dict)
-        return True, None
+        return [], False
     except jsonschema.exceptions.SchemaError as schema_err:
         #
         # The schema did not pass Validation
-        return False, format_error_message(schema_err)
+        return [schema_err], False
 
     except jsonschema.exceptions.ValidationError as validation_err:
         #
         # The data did not validate against the schema
-        return False, format_error_message(validation_err)
+        return [validation_err], False
+
+
+def validate_filemetadata(schema_dict, data_dict, cache_key=None, precheck=None):
+    """
+    (a) Validate a JSON schema and then
+    (b) Validate data against that JSON schema
+
+    (valid, formatted messages of the first error), see find_validation_errors.
+    The validator is reused across calls--see get_schema_validator.
+    """
+    if schema_dict is None:
+        return False, [ERR_MSG_SCHEMA_NONE]
+
+    if data_dict is None:
+        return False, [ERR_MSG_DATA_NONE]
+
+    errs, _ = find_validation_errors(schema_dict, data_dict, cache_key, precheck)
+    if not errs:
+        return True, None
+    return False, format_error_message(errs[0])
 
 
 """
@@ -0,0 +1,97 @@
+"""
+Process-wide cache of compiled JSON schema validators
+
+Building a validator for every call to validate_filemetadata is wasted
+work when most requests hit the same few schema versions.  Validators
+are cached by a key describing the schema's identity:
+    - (schema pk, version, modified timestamp) for saved MetadataSchema objects
+    - a hash of the schema content for anything else
+
+The cache is bounded: the least recently used entries are evicted once
+"max_size" is reached and entries older than "ttl" seconds are rebuilt.
+"""
+import hashlib
+import json
+import threading
+import time
+from collections import OrderedDict
+from django.conf import settings
+
+DEFAULT_CACHE_MAX_SIZE = 128
+DEFAULT_CACHE_TTL = 60 * 60     # seconds
+
+
+def get_schema_content_key(schema_dict):
+    """
+    Fallback cache key for a schema that isn't (or may not be) saved:
+    a sha1 of the schema's JSON
+    """
+    schema_string = json.dumps(schema_dict, sort_keys=True, default=str)
+    return ('content', hashlib.sha1(schema_string.encode('utf-8')).hexdigest())
+
+
+class ValidatorCache(object):
+    """
+    Thread-safe LRU cache with a time-to-live for each entry
+    """
+    def __init__(self, max_size=DEFAULT_CACHE_MAX_SIZE, ttl=DEFAULT_CACHE_TTL):
+        self.max_size = max_size
+        self.ttl = ttl
+        self._entries = OrderedDict()   # key -> (created, validator)
+        self._lock = threading.Lock()
+
+    def __len__(self):
+        return len(self._entries)
+
+    def get(self, key):
+        """
+        Return the cached validator or None if it's missing or expired
+        """
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                return None
+
+            created, validator = entry
+            if self.ttl is not None and (time.time() - created) > self.ttl:
+                del self._entries[key]
+                return None
+
+            self._entries.move_to_end(key)
+            return validator
+
+    def set(self, key, validator):
+        with self._lock:
+            self._entries[key] = (time.time(), validator)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_size:
+                self._entries.popitem(last=False)
+
+    def get_or_build(self, key, build_func):
+        """
+        Return the cached validator, building and storing it if needed.
+        "build_func" is called outside the lock.
+        """
+        validator = self.get(key)
+        if validator is None:
+            validator = build_func()
+            self.set(key, validator)
+        return validator
+
+    def invalidate_schema(self, schema_id):
+        """
+        Remove every entry for a MetadataSchema primary key
+        """
+        with self._lock:
+            stale_keys = [k for k in self._entries if k[0] == schema_id]
+            for k in stale_keys:
+                del self._entries[k]
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+
+VALIDATOR_CACHE = ValidatorCache(\
+    max_size=getattr(settings, 'VALIDATOR_CACHE_MAX_SIZE', DEFAULT_CACHE_MAX_SIZE),\
+    ttl=getattr(settings, 'VALIDATOR_CACHE_TTL', DEFAULT_CACHE_TTL))
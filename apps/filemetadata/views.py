@@ -2,42 +2,300 @@
 import json
 from collections import OrderedDict
 from decimal import Decimal
-from django.http import HttpResponse, Http404
-from django.views.decorators.http import require_POST, require_GET
+from django.db.models import BooleanField, Case, Value, When
+from django.http import HttpResponse, StreamingHttpResponse, Http404
+from django.views.decorators.csrf import csrf_exempt
+from django.utils.cache import patch_vary_headers
+from django.views.decorators.http import require_POST, require_GET, condition
+from .compression import choose_encoding, ENCODING_GZIP, ENCODING_BROTLI
+from .http_caching import patch_schema_version_lifetime, patch_latest_schema_lifetime
 from .models import MetadataSchema
+from .response_cache import RESPONSE_CACHE
+from .schema_registry import SCHEMA_REGISTRY
+from .utils import find_validation_errors, format_error_messages, format_error_object,\
+    get_error_limits, ERROR_MODE_FAIL_FAST, ERROR_MODE_COLLECT
 
-@require_GET
-def view_schema_list(request):
+ERR_MSG_NO_DATA = 'You did not supply data to validate'
+ERR_MSG_INVALID_JSON = 'The data you sent was not valid JSON'
+ERR_MSG_NOT_JSON_ARRAY = 'The data you sent was not a JSON array'
+ERR_MSG_BAD_ERROR_MODE = 'The "errors" parameter must be "first" or "all"'
+ERR_MSG_BAD_MAX_ERRORS = 'The "max_errors" must be an integer from 1 to %s'
 
-    if 'pretty' in request.GET:
-        indent=4
-    else:
-        indent=None
+# Columns the validate views don't need: only "schema" is validated against
+VALIDATE_DEFERRED_FIELDS = ('schema_json', 'schema_json_pretty', 'schema_json_gzip',\
+    'schema_json_pretty_gzip', 'schema_json_br', 'schema_json_pretty_br', 'schema_jsonb')
 
-    l = [m.as_dict() for m in MetadataSchema.objects.filter(published=True).all()]
+# "errors" GET parameter -> error mode, see utils.find_validation_errors
+ERROR_MODE_PARAMS = {'first': ERROR_MODE_FAIL_FAST, 'all': ERROR_MODE_COLLECT}
 
-    return HttpResponse(json.dumps(l, indent=indent), content_type='application/json')
+NDJSON_CONTENT_TYPES = ['application/x-ndjson', 'application/jsonlines']
 
 
-@require_GET
-def view_schema(request, schema_name_slug=None, version=None):
+def get_schema_queryset(schema_name_slug, version=None):
+    """
+    MetadataSchema objects matching a slug and version.
+    Without a version: the published versions, latest first
+    (uses the (slug, published, version) index)
+    """
     schema_qs = MetadataSchema.objects.filter(slug=schema_name_slug)
     if version:
-        version_num = Decimal(version)
-        print ('version_num', version_num)
-        schema_qs = schema_qs.filter(version=version_num)
+        return schema_qs.filter(version=Decimal(version))
+    return schema_qs.filter(published=True).order_by('-version')
+
+
+def get_schema_or_404(schema_name_slug, version=None, deferred_fields=()):
+    """
+    Retrieve a MetadataSchema by slug and version,
+    or the latest published version if there's no version
+
+    Published schemas come from the SCHEMA_REGISTRY, without a query.
+    For the others, "deferred_fields" are columns that aren't needed,
+    e.g. the "schema" JSON when only the stored JSON strings are sent
+    """
+    schema_info = SCHEMA_REGISTRY.get_schema(schema_name_slug, version)
+    if schema_info is not None:
+        return schema_info
+
+    schema_qs = get_schema_queryset(schema_name_slug, version)
+    if deferred_fields:
+        schema_qs = schema_qs.defer(*deferred_fields)
 
     schema_info = schema_qs.first()
     if schema_info is None:
         raise Http404('Schema not found')
 
+    return schema_info
+
+
+def get_schema_identity(schema_info):
+    """
+    Short description of the schema used in API responses
+    """
+    return OrderedDict([('slug', schema_info.slug),\
+                    ('version', float(schema_info.version)),\
+                    ('url', schema_info.get_api_url())])
+
+
+def get_request_content_type(request):
+    """
+    Return the request's media type without parameters, e.g. "application/json"
+    """
+    content_type = request.META.get('CONTENT_TYPE', '')
+    return content_type.split(';')[0].strip().lower()
+
+
+def is_json_request(request):
+    """
+    Was the request body sent as "application/json"?
+    """
+    return get_request_content_type(request) == 'application/json'
+
+
+def get_error_mode(params):
+    """
+    (error mode, max errors) from the GET parameters, raise ValueError if they're invalid.
+        - errors: "first" (default, stop at the first error) or "all"
+        - max_errors: with "all", at most settings.VALIDATION_MAX_ERRORS
+    """
+    mode = ERROR_MODE_PARAMS.get(params.get('errors', 'first'))
+    if mode is None:
+        raise ValueError(ERR_MSG_BAD_ERROR_MODE)
+
+    max_errors_limit, _ = get_error_limits()
+    if not params.get('max_errors'):
+        return mode, max_errors_limit
+    try:
+        max_errors = int(params['max_errors'])
+    except ValueError:
+        raise ValueError(ERR_MSG_BAD_MAX_ERRORS % max_errors_limit)
+    if max_errors < 1 or max_errors > max_errors_limit:
+        raise ValueError(ERR_MSG_BAD_MAX_ERRORS % max_errors_limit)
+    return mode, max_errors
+
+
+def get_error_verdict(validation_errs, is_truncated):
+    """
+    [("valid", ...), ("errors", [formatted messages]),
+     ("error_details", [machine readable errors]), ("errors_truncated", ...)]
+    """
+    return [('valid', not validation_errs),\
+            ('errors', format_error_messages(validation_errs)),\
+            ('error_details', [format_error_object(x) for x in validation_errs]),\
+            ('errors_truncated', is_truncated)]
+
+
+def json_error_response(err_msg, status=400):
+    """
+    Return an error message formatted as JSON
+    """
+    return HttpResponse(json.dumps(dict(valid=False, errors=[err_msg])),\
+                    status=status,\
+                    content_type='application/json')
+
+
+# ------------------------------------------
+# ETag and Last-Modified for conditional GETs.
+# Published schemas come from the SCHEMA_REGISTRY.  For the others the
+# ETag info is read from the small columns (schema_hash, modified, ...)
+# and whether each compressed variant is stored, so a 304 never loads
+# the schema JSON.  Only a 200 reads the stored JSON, rendered once and
+# kept in the RESPONSE_CACHE.  Missing schemas are never cached.
+# ------------------------------------------
+def get_variant_flags(pretty):
+    """
+    {"has_<encoding>": expression} telling if each compressed variant is stored
+    """
+    suffix = '_pretty' if pretty else ''
+    return dict(('has_%s' % encoding,\
+                Case(When(**{'schema_json%s_%s__isnull' % (suffix, encoding): False,\
+                            'then': Value(True)}),\
+                    default=Value(False), output_field=BooleanField()))\
+                for encoding in (ENCODING_GZIP, ENCODING_BROTLI))
+
+
+def get_schema_etag_info(request, schema_name_slug=None, version=None):
+    """
+    dict(id, schema_hash, modified, version, published, encodings) of the
+    requested schema, None if there's none.  Looked up once per request.
+    """
+    if not hasattr(request, '_schema_etag_info'):
+        pretty = 'pretty' in request.GET
+        schema_info = SCHEMA_REGISTRY.get_schema(schema_name_slug, version)
+        if schema_info is not None:
+            request._schema_etag_info = dict(id=schema_info.id,\
+                            schema_hash=schema_info.schema_hash,\
+                            modified=schema_info.modified,\
+                            version=schema_info.version,\
+                            published=schema_info.published,\
+                            encodings=list(schema_info.get_schema_json_variants(pretty=pretty)))
+        else:
+            variant_flags = get_variant_flags(pretty)
+            row = get_schema_queryset(schema_name_slug, version)\
+                    .annotate(**variant_flags)\
+                    .values('id', 'schema_hash', 'modified', 'version', 'published',\
+                            *variant_flags.keys())\
+                    .first()
+            if row is not None:
+                row['encodings'] = [x[len('has_'):] for x in variant_flags if row.pop(x)]
+            request._schema_etag_info = row
+    return request._schema_etag_info
+
+
+def build_schema_response(schema_info, pretty):
+    """
+    Stored JSON and its compressed variants of a schema
+    """
+    return dict(body=schema_info.get_schema_json(pretty=pretty),\
+                variants=schema_info.get_schema_json_variants(pretty=pretty))
+
+
+def load_schema_response(schema_id, pretty):
+    """
+    build_schema_response() of a schema read from the database
+    """
+    unused_suffix = '' if pretty else '_pretty'
+    deferred_fields = ['schema'] + ['schema_json%s%s' % (unused_suffix, x)\
+                                    for x in ('', '_gzip', '_br')]
+    schema_info = MetadataSchema.objects.defer(*deferred_fields).filter(pk=schema_id).first()
+    if schema_info is None:
+        raise Http404('Schema not found')     # deleted meanwhile, not cached
+    return build_schema_response(schema_info, pretty)
+
+
+def get_schema_response(request, schema_name_slug=None, version=None):
+    """
+    build_schema_response() of the requested schema, looked up once per request.
+    Raise Http404 if there's no schema.
+    """
+    if not hasattr(request, '_schema_response'):
+        etag_info = get_schema_etag_info(request, schema_name_slug, version)
+        if etag_info is None:
+            raise Http404('Schema not found')
+
+        pretty = 'pretty' in request.GET
+        schema_info = SCHEMA_REGISTRY.get_schema(schema_name_slug, version)
+        if schema_info is not None:
+            request._schema_response = build_schema_response(schema_info, pretty)
+        else:
+            # keyed by the schema found, so "1" and "1.00" share an entry
+            request._schema_response = RESPONSE_CACHE.get_or_build(\
+                            ('schema', etag_info['id'], etag_info['schema_hash'], int(pretty)),\
+                            lambda: load_schema_response(etag_info['id'], pretty))
+    return request._schema_response
+
+
+def schema_etag(request, schema_name_slug=None, version=None):
+    etag_info = get_schema_etag_info(request, schema_name_slug, version)
+    if etag_info is None or not etag_info['schema_hash']:
+        return None
+    etag = etag_info['schema_hash']
     if 'pretty' in request.GET:
-        indent=4
-    else:
-        indent=None
+        etag = '%s-pretty' % etag
+    # each encoding is a different representation
+    encoding = choose_encoding(request.META.get('HTTP_ACCEPT_ENCODING', ''),\
+                            etag_info['encodings'])
+    if encoding:
+        etag = '%s-%s' % (etag, encoding)
+    return etag
 
-    #return render(schema_info.as_json(), mimetype='json'
-    return HttpResponse(schema_info.as_json(indent=indent), content_type='application/json')
+
+def schema_last_modified(request, schema_name_slug=None, version=None):
+    etag_info = get_schema_etag_info(request, schema_name_slug, version)
+    if etag_info is None:
+        return None
+    return etag_info['modified']
+
+
+@condition(etag_func=schema_etag, last_modified_func=schema_last_modified)
+def send_schema(request, schema_name_slug=None, version=None):
+    """
+    Send the schema JSON stored when it was saved, or a 304.
+    Clients accepting gzip or brotli get the variant compressed on save.
+    """
+    schema_response = get_schema_response(request, schema_name_slug, version)
+    encoding = choose_encoding(request.META.get('HTTP_ACCEPT_ENCODING', ''),\
+                            schema_response['variants'])
+    if encoding is None:
+        return HttpResponse(schema_response['body'], content_type='application/json')
+
+    response = HttpResponse(schema_response['variants'][encoding],\
+                        content_type='application/json')
+    response['Content-Encoding'] = encoding
+    return response
+
+
+@require_GET
+def view_schema(request, schema_name_slug=None, version=None):
+    """
+    Send a schema version.  Published versions don't change,
+    so clients and proxies may keep them (see http_caching.py)
+    """
+    response = send_schema(request, schema_name_slug, version)
+
+    etag_info = get_schema_etag_info(request, schema_name_slug, version)
+    patch_schema_version_lifetime(response, etag_info['published'])
+    patch_vary_headers(response, ('Accept-Encoding',))
+    return response
+
+
+@require_GET
+def view_latest_schema(request, schema_name_slug=None):
+    """
+    Send the latest published version of a schema.
+
+    The answer changes when a new version is published, so caches may
+    only keep it for settings.SCHEMA_LATEST_MAX_AGE seconds before
+    revalidating with the ETag.  "Content-Location" gives the version's own URL.
+    """
+    response = send_schema(request, schema_name_slug)
+
+    patch_latest_schema_lifetime(response)
+    patch_vary_headers(response, ('Accept-Encoding',))
+    etag_info = get_schema_etag_info(request, schema_name_slug)
+    if etag_info is not None:
+        response['Content-Location'] = MetadataSchema.format_api_url(schema_name_slug,\
+                                                                etag_info['version'])
+    return response
 
 
 @require_GET
@@ -62,31 +320,130 @@ def view_schema_data(request, schema_name_slug, datafile_id):
     return HttpResponse(schema_info.as_json(indent=indent), content_type='application/json')
 
 
+@csrf_exempt
 @require_POST
 def validate(request, schema_name_slug, version):
-    schema_qs = MetadataSchema.objects.filter(slug=schema_name_slug)
-    if version:
-        version_num = Decimal(version)
-        print ('version_num', version_num)
-        schema_qs = schema_qs.filter(version=version_num)
+    """
+    Validate JSON metadata against a schema version.
 
-    schema_info = schema_qs.first()
-    if schema_info is None:
-        raise Http404('Schema not found')
+    The metadata may be sent as the raw request body
+    (Content-Type: application/json) or in a form-encoded "data" field.
+    By default validation stops at the first error; "?errors=all"
+    reports them all, most relevant first (see get_error_mode).
+
+    Response: {"valid": true|false, "errors": [...],
+               "error_details": [{"pointer": ..., "keyword": ..., ...}],
+               "errors_truncated": true|false, "schema": {...}}
+    """
+    try:
+        mode, max_errors = get_error_mode(request.GET)
+    except ValueError as err:
+        return json_error_response(str(err))
+
+    schema_info = get_schema_or_404(schema_name_slug, version,\
+                            VALIDATE_DEFERRED_FIELDS)
 
     # get JSON data out of the post
-    if 'data' not in request.POST:
-        return HttpResponse('You did not supply data to validate')
+    if is_json_request(request):
+        json_data = request.body
+    elif 'data' in request.POST:
+        json_data = request.POST['data']
+    else:
+        return json_error_response(ERR_MSG_NO_DATA)
 
-    json_data = request.POST['data']
     try:
+        if isinstance(json_data, bytes):
+            # a UnicodeDecodeError is a ValueError too
+            json_data = json_data.decode(request.encoding or 'utf-8')
         data_dict = json.loads(json_data, object_pairs_hook=OrderedDict)
-    except:
-        return HttpResponse('The data you sent was not valid JSON')
+    except ValueError:
+        return json_error_response(ERR_MSG_INVALID_JSON)
+
+    validation_errs, is_truncated = find_validation_errors(schema_info.get_schema_dict(),\
+                                    data_dict,\
+                                    cache_key=schema_info.get_validator_cache_key(),\
+                                    precheck=schema_info.get_schema_precheck(),\
+                                    mode=mode, max_errors=max_errors)
+
+    verdict = OrderedDict(get_error_verdict(validation_errs, is_truncated) +\
+                    [('schema', get_schema_identity(schema_info))])
+
+    return HttpResponse(json.dumps(verdict), content_type='application/json')
+
+
+def iter_batch_documents(request):
+    """
+    Yield (data_dict, err_msg) for each document in a batch request body.
+
+    NDJSON bodies are read line by line; other bodies
+    must hold a JSON array of documents.
+    """
+    if get_request_content_type(request) in NDJSON_CONTENT_TYPES:
+        for line in request:
+            line = line.strip()
+            if not line:
+                continue
+            try:
+                yield json.loads(line.decode('utf-8'), object_pairs_hook=OrderedDict), None
+            except ValueError:
+                yield None, ERR_MSG_INVALID_JSON
+        return
+
+    try:
+        data_list = json.loads(request.body.decode(request.encoding or 'utf-8'),\
+                        object_pairs_hook=OrderedDict)
+    except ValueError:
+        yield None, ERR_MSG_INVALID_JSON
+        return
+
+    if not isinstance(data_list, list):
+        yield None, ERR_MSG_NOT_JSON_ARRAY
+        return
+
+    for data_dict in data_list:
+        yield data_dict, None
+
+
+@csrf_exempt
+@require_POST
+def validate_batch(request, schema_name_slug, version):
+    """
+    Validate many metadata documents against one schema version.
+
+    The body is NDJSON (Content-Type: application/x-ndjson)
+    or a JSON array.  One NDJSON verdict is streamed back per document:
+        {"index": 0, "valid": true|false, "errors": [...], "error_details": [...],
+         "errors_truncated": true|false}
+    The "errors" and "max_errors" GET parameters are as for validate.
+    """
+    try:
+        mode, max_errors = get_error_mode(request.GET)
+    except ValueError as err:
+        return json_error_response(str(err))
+
+    schema_info = get_schema_or_404(schema_name_slug, version,\
+                            VALIDATE_DEFERRED_FIELDS)
+    schema_dict = schema_info.get_schema_dict()
+    cache_key = schema_info.get_validator_cache_key()
+    precheck = schema_info.get_schema_precheck()
+
+    def verdict_lines():
+        for idx, (data_dict, err_msg) in enumerate(iter_batch_documents(request)):
+            if err_msg is not None:
+                verdict = OrderedDict([('index', idx),\
+                                ('valid', False),\
+                                ('errors', [err_msg]),\
+                                ('error_details', []),\
+                                ('errors_truncated', False)])
+            else:
+                validation_errs, is_truncated = find_validation_errors(schema_dict, data_dict,\
+                                                cache_key=cache_key, precheck=precheck,\
+                                                mode=mode, max_errors=max_errors)
+                verdict = OrderedDict([('index', idx)] +\
+                                get_error_verdict(validation_errs, is_truncated))
+            yield json.dumps(verdict) + '\n'
 
-    #try:
-    #schema_info
-    return HttpResponse('validate it')
+    return StreamingHttpResponse(verdict_lines(), content_type='application/x-ndjson')
 
 #@require_POST
 #def add_schema(request):
@@ -0,0 +1,344 @@
+"""
+FileMetadata API views
+
+search_filemetadata: search by the content of the metadata.
+GET parameters:
+    - q: one or more queries, all of which must match.  Either
+        "/json/pointer=value" (value as JSON, or a plain string) or a
+        JSON object the metadata must contain, e.g. {"instrument": "X"}
+    - schema: schema slug
+    - version: schema version, used with "schema"
+    - installation: Dataverse installation id of the schema
+    - limit: page size (default 100, at most 1000)
+    - after: the "next_after" id from the previous page
+Unpublished FileMetadata are only found by users who may change them.
+
+export_filemetadata: stream every matching FileMetadata, see bulk_export.
+GET parameters:
+    - schema, schema_version: schema slug and version
+    - installation: Dataverse installation id of the schema
+    - modified_since: date or datetime
+    - format: "ndjson" (default) or "csv"
+    - gzip: send the export gzip compressed
+Unpublished FileMetadata are only exported for users who may change them.
+
+view_filemetadata_versions, view_filemetadata_version and
+diff_filemetadata_versions: the version history, see metadata_history.
+The history of unpublished FileMetadata is only shown to users who may
+change them.
+
+patch_filemetadata: PATCH the metadata with a JSON Patch
+(Content-Type: application/json-patch+json) or a JSON Merge Patch
+(Content-Type: application/merge-patch+json).  Only the changed parts
+are revalidated, see metadata_patch.  The result is saved as a new version.
+Only logged in users with the "filemetadata.change_filemetadata"
+permission may PATCH.
+"""
+import json
+from collections import OrderedDict
+from decimal import Decimal, InvalidOperation
+from django.core.urlresolvers import reverse
+from django.db import transaction
+from django.http import HttpResponse, StreamingHttpResponse, Http404
+from django.views.decorators.http import require_GET, require_http_methods
+from django.shortcuts import get_object_or_404
+from .models import FileMetadata, MetadataSchema
+from .json_patch import JsonPatchError, JsonPatchFormatError
+from .metadata_history import get_metadata_version, diff_metadata_versions, get_version_list,\
+    save_metadata_version, VersionTakenError
+from .metadata_patch import apply_metadata_patch, validate_patched_metadata, PATCH_TYPES,\
+    ERR_MSG_BAD_PATCH_TYPE
+from .views import get_request_content_type
+from .metadata_search import filter_metadata_query
+from .bulk_export import get_export_queryset, parse_modified_since, iter_export,\
+    EXPORT_FORMATS, EXPORT_FORMAT_NDJSON, EXPORT_CONTENT_TYPES, ERR_MSG_BAD_EXPORT_FORMAT
+
+DEFAULT_SEARCH_LIMIT = 100
+MAX_SEARCH_LIMIT = 1000
+
+ERR_MSG_NO_QUERY = 'Send at least one "q" query'
+ERR_MSG_BAD_SEARCH_LIMIT = 'The "limit" must be an integer from 1 to %s' % MAX_SEARCH_LIMIT
+ERR_MSG_BAD_AFTER = 'The "after" must be an integer'
+ERR_MSG_BAD_VERSION = 'The "version" must be a number'
+ERR_MSG_BAD_DIFF_VERSIONS = 'The "from" and "to" versions must be integers'
+ERR_MSG_INVALID_PATCH_JSON = 'The patch is not valid JSON'
+ERR_MSG_NOT_LOGGED_IN = 'Log in to change the metadata'
+ERR_MSG_NO_CHANGE_PERMISSION = 'You don\'t have permission to change the metadata'
+
+CHANGE_FILEMETADATA_PERMISSION = 'filemetadata.change_filemetadata'
+
+SEARCH_RESULT_COLUMNS = ['id', 'datafile_id', 'version', 'published', 'metadata',\
+    'schema__slug', 'schema__version']
+
+
+def get_change_permission_error(request):
+    """
+    (status, error message) if the user may not change FileMetadata, else None
+    """
+    user = getattr(request, 'user', None)
+    if user is None or not user.is_authenticated():
+        return 401, ERR_MSG_NOT_LOGGED_IN
+    if not user.has_perm(CHANGE_FILEMETADATA_PERMISSION):
+        return 403, ERR_MSG_NO_CHANGE_PERMISSION
+    return None
+
+
+def can_view_unpublished(request):
+    """
+    Unpublished FileMetadata are only shown to users who may change them
+    """
+    return get_change_permission_error(request) is None
+
+
+def parse_search_limit(limit):
+    if limit is None:
+        return DEFAULT_SEARCH_LIMIT
+    try:
+        limit = int(limit)
+    except ValueError:
+        raise ValueError(ERR_MSG_BAD_SEARCH_LIMIT)
+    if limit < 1 or limit > MAX_SEARCH_LIMIT:
+        raise ValueError(ERR_MSG_BAD_SEARCH_LIMIT)
+    return limit
+
+
+def get_search_queryset(params, include_unpublished=False):
+    """
+    FileMetadata matching the GET parameters, raise ValueError if they're invalid
+    """
+    queries = params.getlist('q')
+    if not queries:
+        raise ValueError(ERR_MSG_NO_QUERY)
+
+    fm_qs = FileMetadata.objects.all()
+    if not include_unpublished:
+        fm_qs = fm_qs.filter(published=True)
+    if params.get('schema'):
+        fm_qs = fm_qs.filter(schema__slug=params['schema'])
+        if params.get('version'):
+            try:
+                fm_qs = fm_qs.filter(schema__version=Decimal(params['version']))
+            except InvalidOperation:
+                raise ValueError(ERR_MSG_BAD_VERSION)
+    if params.get('installation'):
+        fm_qs = fm_qs.filter(dataverse_installation_id=params['installation'])
+
+    if params.get('after'):
+        try:
+            fm_qs = fm_qs.filter(id__gt=int(params['after']))
+        except ValueError:
+            raise ValueError(ERR_MSG_BAD_AFTER)
+
+    for query in queries:
+        fm_qs = filter_metadata_query(fm_qs, query)
+
+    return fm_qs
+
+
+def format_search_result(row):
+    """
+    One FileMetadata row, JSON ready
+    """
+    row = dict(zip(SEARCH_RESULT_COLUMNS, row))
+    metadata = row['metadata']
+    if isinstance(metadata, str):
+        # values_list() skips the JSONField's decoding
+        metadata = json.loads(metadata, object_pairs_hook=OrderedDict)
+    return OrderedDict([('id', row['id']),\
+                    ('schema', MetadataSchema.format_api_url(row['schema__slug'], row['schema__version'])),\
+                    ('datafile_id', row['datafile_id']),\
+                    ('version', row['version']),\
+                    ('published', row['published']),\
+                    ('metadata', metadata)])
+
+
+@require_GET
+def search_filemetadata(request):
+    """
+    Page of FileMetadata matching content queries, in id order.
+    Unpublished FileMetadata are only found by users who may change them.
+    """
+    try:
+        limit = parse_search_limit(request.GET.get('limit'))
+        fm_qs = get_search_queryset(request.GET,\
+                                include_unpublished=can_view_unpublished(request))
+    except ValueError as err:
+        return HttpResponse(json.dumps(dict(errors=[str(err)])),\
+                        status=400,\
+                        content_type='application/json')
+
+    rows = list(fm_qs.order_by('id').values_list(*SEARCH_RESULT_COLUMNS)[:limit + 1])
+    next_after = None
+    if len(rows) > limit:
+        rows = rows[:limit]
+        next_after = rows[-1][0]
+
+    results = OrderedDict([('results', [format_search_result(x) for x in rows]),\
+                        ('next_after', next_after)])
+    indent = 4 if 'pretty' in request.GET else None
+    return HttpResponse(json.dumps(results, indent=indent),\
+                    content_type='application/json')
+
+
+@require_GET
+def export_filemetadata(request):
+    """
+    Stream the matching FileMetadata as NDJSON or CSV.
+    Unpublished FileMetadata are only exported for users who may change them.
+    """
+    export_format = request.GET.get('format', EXPORT_FORMAT_NDJSON)
+    try:
+        if export_format not in EXPORT_FORMATS:
+            raise ValueError(ERR_MSG_BAD_EXPORT_FORMAT)
+        fm_qs = get_export_queryset(schema=request.GET.get('schema'),\
+                        schema_version=request.GET.get('schema_version'),\
+                        installation=request.GET.get('installation'),\
+                        modified_since=parse_modified_since(request.GET.get('modified_since')),\
+                        include_unpublished=can_view_unpublished(request))
+    except ValueError as err:
+        return HttpResponse(json.dumps(dict(errors=[str(err)])),\
+                        status=400,\
+                        content_type='application/json')
+
+    use_gzip = 'gzip' in request.GET
+    fname = 'filemetadata.%s' % export_format
+    if use_gzip:
+        content_type = 'application/gzip'
+        fname += '.gz'
+    else:
+        content_type = EXPORT_CONTENT_TYPES[export_format]
+
+    response = StreamingHttpResponse(iter_export(fm_qs, export_format, use_gzip),\
+                                content_type=content_type)
+    response['Content-Disposition'] = 'attachment; filename="%s"' % fname
+    return response
+
+
+def get_json_response(data, request, status=200, content_type='application/json'):
+    indent = 4 if 'pretty' in request.GET else None
+    return HttpResponse(json.dumps(data, indent=indent), status=status,\
+                    content_type=content_type)
+
+
+def get_visible_filemetadata(request, file_metadata_id):
+    """
+    The FileMetadata, or a 404 if it's unpublished and the user may not change it
+    """
+    fm_qs = FileMetadata.objects.all()
+    if not can_view_unpublished(request):
+        fm_qs = fm_qs.filter(published=True)
+    return get_object_or_404(fm_qs, pk=file_metadata_id)
+
+
+@require_GET
+def view_filemetadata_versions(request, file_metadata_id):
+    """
+    The versions of a FileMetadata, oldest first
+    """
+    fmeta = get_visible_filemetadata(request, file_metadata_id)
+    versions = [OrderedDict([('version', version),\
+                            ('modified', str(modified) if modified else None),\
+                            ('url', reverse('view_filemetadata_version',\
+                                    kwargs=dict(file_metadata_id=fmeta.id, version=version)))])\
+                for version, modified, _ in get_version_list(fmeta)]
+    return get_json_response(OrderedDict([('id', fmeta.id),\
+                                        ('version', fmeta.version),\
+                                        ('versions', versions)]), request)
+
+
+@require_GET
+def view_filemetadata_version(request, file_metadata_id, version):
+    """
+    The metadata of one version of a FileMetadata
+    """
+    fmeta = get_visible_filemetadata(request, file_metadata_id)
+    try:
+        metadata = get_metadata_version(fmeta, int(version))
+    except ValueError as err:
+        raise Http404(str(err))
+
+    return get_json_response(OrderedDict([('id', fmeta.id),\
+                                        ('version', int(version)),\
+                                        ('metadata', metadata)]), request)
+
+
+@require_GET
+def diff_filemetadata_versions(request, file_metadata_id):
+    """
+    JSON Patch (RFC 6902) from version "from" to version "to" (default: the latest)
+    """
+    fmeta = get_visible_filemetadata(request, file_metadata_id)
+    try:
+        from_version = int(request.GET.get('from', ''))
+        to_version = int(request.GET.get('to', fmeta.version))
+    except ValueError:
+        return get_json_response(dict(errors=[ERR_MSG_BAD_DIFF_VERSIONS]), request, status=400)
+
+    try:
+        patch = diff_metadata_versions(fmeta, from_version, to_version)
+    except ValueError as err:
+        raise Http404(str(err))
+
+    return get_json_response(patch, request, content_type='application/json-patch+json')
+
+
+@require_http_methods(['PATCH'])
+def patch_filemetadata(request, file_metadata_id):
+    """
+    Apply a JSON Patch or JSON Merge Patch to the metadata of a FileMetadata.
+
+    Response: {"id": 1, "version": 4, "valid": true, "validated": [...], "metadata": {...}}
+        - 400: the patch isn't valid JSON, or is a malformed JSON Patch
+        - 401/403: not logged in, or no permission to change FileMetadata
+        - 409: the patch doesn't apply to the metadata, or the next
+            version is already saved as a separate FileMetadata row
+        - 415: the Content-Type isn't a patch type
+        - 422: the patched metadata isn't valid; nothing is saved
+    """
+    permission_error = get_change_permission_error(request)
+    if permission_error:
+        status, err_msg = permission_error
+        return get_json_response(dict(valid=False, errors=[err_msg]), request, status=status)
+
+    patch_type = get_request_content_type(request)
+    if patch_type not in PATCH_TYPES:
+        return get_json_response(dict(valid=False, errors=[ERR_MSG_BAD_PATCH_TYPE]),\
+                            request, status=415)
+
+    try:
+        patch = json.loads(request.body.decode(request.encoding or 'utf-8'),\
+                        object_pairs_hook=OrderedDict)
+    except ValueError:
+        return get_json_response(dict(valid=False, errors=[ERR_MSG_INVALID_PATCH_JSON]),\
+                            request, status=400)
+
+    with transaction.atomic():
+        fmeta = get_object_or_404(FileMetadata.objects.select_for_update()\
+                                .select_related('schema'), pk=file_metadata_id)
+        try:
+            patched, changes = apply_metadata_patch(fmeta.metadata, patch, patch_type)
+        except JsonPatchFormatError as err:
+            return get_json_response(dict(valid=False, errors=[str(err)]), request, status=400)
+        except JsonPatchError as err:
+            return get_json_response(dict(valid=False, errors=[str(err)]), request, status=409)
+
+        mschema = fmeta.schema
+        is_valid, err_msgs, validated = validate_patched_metadata(mschema.get_schema_dict(),\
+                                                patched, changes,\
+                                                cache_key=mschema.get_validator_cache_key())
+        if not is_valid:
+            return get_json_response(OrderedDict([('valid', False),\
+                                                ('errors', err_msgs or []),\
+                                                ('validated', validated)]),\
+                                request, status=422)
+
+        try:
+            save_metadata_version(fmeta, patched)
+        except VersionTakenError as err:
+            return get_json_response(dict(valid=False, errors=[str(err)]), request, status=409)
+
+    return get_json_response(OrderedDict([('id', fmeta.id),\
+                                        ('version', fmeta.version),\
+                                        ('valid', True),\
+                                        ('validated', validated),\
+                                        ('metadata', fmeta.metadata)]), request)
@@ -0,0 +1,286 @@
+"""
+List of published schemas
+
+GET parameters:
+    - limit: page size.  Without it, every published schema is sent
+    - cursor: the "next" cursor from the previous page
+    - fields: comma-separated metadata columns to send instead of
+        the schema bodies, e.g. "fields=title,version,url"
+    - pretty: indent the JSON
+
+Pages use keyset pagination on the default ordering (title, -version),
+so a page costs the same no matter how deep it is.  The next page is
+given in the "Link" header (rel="next") and in "X-Next-Cursor".
+
+The ETag and Last-Modified come from the count, largest id and latest
+"modified" of the published schemas: one aggregate query, itself kept
+in the RESPONSE_CACHE, so a 304 or a cached page doesn't scan the
+schemas.  Pages ("limit") are kept in the RESPONSE_CACHE, keyed by the
+parsed parameters, until a schema is saved or deleted.  The full list
+is streamed, never cached.
+"""
+import base64
+import binascii
+import hashlib
+import json
+from collections import OrderedDict
+from decimal import Decimal, InvalidOperation
+from django.db.models import Count, Max, Q
+from django.http import HttpResponse, StreamingHttpResponse
+from django.views.decorators.http import require_GET, condition
+from .http_caching import patch_schema_list_lifetime
+from .models import MetadataSchema
+from .response_cache import RESPONSE_CACHE
+
+SCHEMA_LIST_FIELDS = ['id', 'title', 'slug', 'version', 'url', 'published',\
+    'dataverse_installation_id', 'contributor', 'description', 'created', 'modified']
+
+ERR_MSG_BAD_LIMIT = 'The "limit" must be a positive integer'
+ERR_MSG_BAD_CURSOR = 'The "cursor" is not valid'
+ERR_MSG_BAD_FIELDS = 'The "fields" must be one or more of: %s' % ', '.join(SCHEMA_LIST_FIELDS)
+
+
+def encode_list_cursor(title, version):
+    """
+    Opaque cursor pointing after the (title, version) row
+    """
+    cursor_json = json.dumps([title, str(version)])
+    return base64.urlsafe_b64encode(cursor_json.encode('utf-8')).decode('ascii')
+
+
+def decode_list_cursor(cursor):
+    """
+    Return the (title, version) in a cursor, raise ValueError if it's invalid
+    """
+    try:
+        title, version = json.loads(base64.urlsafe_b64decode(cursor.encode('ascii')).decode('utf-8'))
+        return title, Decimal(version)
+    except (ValueError, TypeError, UnicodeError, binascii.Error, InvalidOperation):
+        raise ValueError(ERR_MSG_BAD_CURSOR)
+
+
+def parse_limit(limit):
+    if limit is None:
+        return None
+    try:
+        limit = int(limit)
+    except ValueError:
+        raise ValueError(ERR_MSG_BAD_LIMIT)
+    if limit < 1:
+        raise ValueError(ERR_MSG_BAD_LIMIT)
+    return limit
+
+
+def parse_fields(fields):
+    if fields is None:
+        return None
+    field_names = [x.strip() for x in fields.split(',') if x.strip()]
+    if not field_names or [x for x in field_names if x not in SCHEMA_LIST_FIELDS]:
+        raise ValueError(ERR_MSG_BAD_FIELDS)
+    return field_names
+
+
+def format_list_item(row, field_names):
+    """
+    Metadata columns of one schema, JSON ready
+    """
+    item = OrderedDict()
+    for name in field_names:
+        if name == 'url':
+            item[name] = MetadataSchema.format_api_url(row['slug'], row['version'])
+        elif name == 'version':
+            item[name] = float(row['version'])
+        elif name in ('created', 'modified'):
+            item[name] = str(row[name])
+        else:
+            item[name] = row[name]
+    return item
+
+
+def iter_schema_json(schema_qs, pretty):
+    """
+    Stored JSON of each schema, one row at a time
+    """
+    json_column = 'schema_json_pretty' if pretty else 'schema_json'
+    for schema_id, schema_json in schema_qs.values_list('id', json_column).iterator():
+        if not schema_json:
+            # saved before the JSON was stored
+            schema_json = MetadataSchema.objects.get(pk=schema_id).get_schema_json(pretty)
+        yield schema_json
+
+
+def iter_schema_fields(schema_qs, field_names, pretty):
+    """
+    Selected metadata columns of each schema, one row at a time
+    """
+    db_fields = set(field_names) - set(['url'])
+    if 'url' in field_names:
+        db_fields.update(['slug', 'version'])
+
+    indent = 4 if pretty else None
+    for row in schema_qs.values(*db_fields).iterator():
+        yield json.dumps(format_list_item(row, field_names), indent=indent)
+
+
+def stream_json_array(json_items, pretty):
+    """
+    Join already serialized JSON items into an array.
+    The pretty output matches json.dumps(items, indent=4)
+    """
+    separator = ',\n' if pretty else ','
+    is_first = True
+    for json_item in json_items:
+        if is_first:
+            yield '[\n' if pretty else '['
+            is_first = False
+        else:
+            yield separator
+        if pretty:
+            json_item = '\n'.join('    ' + line for line in json_item.splitlines())
+        yield json_item
+
+    if is_first:
+        yield '[]'
+    else:
+        yield '\n]' if pretty else ']'
+
+
+def parse_list_query(query_params):
+    """
+    The list parameters: dict(pretty, limit, fields, cursor).
+    Raise ValueError if they're invalid.
+    """
+    cursor = query_params.get('cursor') or None
+    if cursor:
+        decode_list_cursor(cursor)
+    return dict(pretty='pretty' in query_params,\
+                limit=parse_limit(query_params.get('limit')),\
+                fields=parse_fields(query_params.get('fields')),\
+                cursor=cursor)
+
+
+def get_list_query(request):
+    """
+    parse_list_query() of this request, looked up once per request.
+    dict(error=...) if the parameters are invalid.
+    """
+    if not hasattr(request, '_schema_list_query'):
+        try:
+            request._schema_list_query = parse_list_query(request.GET)
+        except ValueError as err:
+            request._schema_list_query = dict(error=str(err))
+    return request._schema_list_query
+
+
+def get_list_key(query):
+    """
+    Cache key of a list query: only the known parameters, so the
+    order of the query string or unknown parameters don't matter
+    """
+    return ('schema-list', int(query['pretty']), query['limit'] or '',\
+            ','.join(query['fields'] or []), query['cursor'] or '')
+
+
+def build_list_state():
+    """
+    (count, largest id, latest modified) of the published schemas.
+    Adding, editing, unpublishing or deleting a schema changes it.
+    """
+    state = MetadataSchema.objects.filter(published=True)\
+                .aggregate(Count('id'), Max('id'), Max('modified'))
+    return (state['id__count'], state['id__max'], state['modified__max'])
+
+
+def get_schema_list_etag_info(request):
+    """
+    (hash, last modified) of the list for this request, looked up once per request
+    """
+    if not hasattr(request, '_schema_list_etag_info'):
+        query = get_list_query(request)
+        if 'error' in query:
+            request._schema_list_etag_info = (None, None)
+            return request._schema_list_etag_info
+
+        list_state = RESPONSE_CACHE.get_or_build(('schema-list-state',), build_list_state)
+        list_hash = hashlib.sha1(repr((get_list_key(query), list_state)).encode('utf-8'))
+        request._schema_list_etag_info = (list_hash.hexdigest(), list_state[2])
+
+    return request._schema_list_etag_info
+
+
+def get_list_json_items(query):
+    """
+    (serialized JSON items, next page cursor) of a list query
+    """
+    schema_qs = MetadataSchema.objects.filter(published=True).order_by('title', '-version')
+    if query['cursor']:
+        title, version = decode_list_cursor(query['cursor'])
+        schema_qs = schema_qs.filter(Q(title__gt=title) | Q(title=title, version__lt=version))
+
+    next_cursor = None
+    if query['limit']:
+        limit = query['limit']
+        page_keys = list(schema_qs.values_list('id', 'title', 'version')[:limit + 1])
+        if len(page_keys) > limit:
+            page_keys = page_keys[:limit]
+            next_cursor = encode_list_cursor(page_keys[-1][1], page_keys[-1][2])
+        schema_qs = schema_qs.filter(id__in=[x[0] for x in page_keys])
+
+    if query['fields']:
+        return iter_schema_fields(schema_qs, query['fields'], query['pretty']), next_cursor
+    return iter_schema_json(schema_qs, query['pretty']), next_cursor
+
+
+def build_schema_list_page(query):
+    """
+    Render one page of the schema list: dict(body, next_cursor)
+    """
+    json_items, next_cursor = get_list_json_items(query)
+    return dict(body=''.join(stream_json_array(json_items, query['pretty'])),\
+                next_cursor=next_cursor)
+
+
+def schema_list_etag(request):
+    return get_schema_list_etag_info(request)[0]
+
+
+def schema_list_last_modified(request):
+    return get_schema_list_etag_info(request)[1]
+
+
+@condition(etag_func=schema_list_etag, last_modified_func=schema_list_last_modified)
+def send_schema_list(request):
+    """
+    Send a JSON array of published schemas (or their metadata columns), or a 304
+    """
+    query = get_list_query(request)
+    if 'error' in query:
+        return HttpResponse(json.dumps(dict(errors=[query['error']])),\
+                        status=400,\
+                        content_type='application/json')
+
+    if not query['limit']:
+        # every schema: streamed as it's read, too big to cache
+        json_items, _ = get_list_json_items(query)
+        return StreamingHttpResponse(stream_json_array(json_items, query['pretty']),\
+                                content_type='application/json')
+
+    page = RESPONSE_CACHE.get_or_build(get_list_key(query), lambda: build_schema_list_page(query))
+    response = HttpResponse(page['body'], content_type='application/json')
+    next_cursor = page['next_cursor']
+    if next_cursor:
+        next_params = request.GET.copy()
+        next_params['cursor'] = next_cursor
+        response['Link'] = '<%s?%s>; rel="next"' % (request.path, next_params.urlencode())
+        response['X-Next-Cursor'] = next_cursor
+
+    return response
+
+
+@require_GET
+def view_schema_list(request):
+    """
+    Send the schema list.  Caches may keep it for a short
+    while (settings.SCHEMA_LIST_MAX_AGE), then revalidate it.
+    """
+    return patch_schema_list_lifetime(send_schema_list(request))
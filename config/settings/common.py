@@ -64,6 +64,12 @@ MIDDLEWARE_CLASSES = (
     'django.middleware.clickjacking.XFrameOptionsMiddleware',
 )
 
+# Middleware of the lightweight schema API application, config/wsgi_api.py
+# (see apps/filemetadata/api_handler.py)
+SCHEMA_API_MIDDLEWARE_CLASSES = (
+    'django.middleware.security.SecurityMiddleware',
+)
+
 # MIGRATIONS CONFIGURATION
 # ------------------------------------------------------------------------------
 MIGRATION_MODULES = {
@@ -248,3 +254,54 @@ ADMIN_URL = r'^admin/'
 
 
 # Your common stuff: Below this line define 3rd party library settings
+
+
+# File metadata validation
+# ------------------------------------------------------------------------------
+# Compiled JSON schema validators kept in each process (see apps/filemetadata/validator_cache.py)
+VALIDATOR_CACHE_MAX_SIZE = env.int('VALIDATOR_CACHE_MAX_SIZE', default=128)
+VALIDATOR_CACHE_TTL = env.int('VALIDATOR_CACHE_TTL', default=3600)  # seconds
+
+# Validation engine: "jsonschema" or "compiled" (see apps/filemetadata/schema_compiler.py)
+VALIDATION_ENGINE = env('VALIDATION_ENGINE', default='jsonschema')
+
+# Reject documents missing required keys or with wrong property types
+# before the full validation (see apps/filemetadata/schema_precheck.py)
+VALIDATION_PRECHECK = env.bool('VALIDATION_PRECHECK', default=True)
+
+# Limits of the "collect every error" mode, e.g. validate/?errors=all
+# (see apps/filemetadata/utils.py find_validation_errors)
+VALIDATION_MAX_ERRORS = env.int('VALIDATION_MAX_ERRORS', default=100)
+VALIDATION_ERROR_TIME_BUDGET = env.float('VALIDATION_ERROR_TIME_BUDGET', default=2.0)  # seconds
+
+# Revalidate a schema's file metadata (in Celery) each time a published schema is saved
+REVALIDATE_ON_SCHEMA_SAVE = env.bool('REVALIDATE_ON_SCHEMA_SAVE', default=True)
+
+# Decode schema/metadata JSON objects as dicts instead of OrderedDicts (lighter).
+# Only keeps key order on Python 3.7+ (see apps/filemetadata/fields.py)
+JSON_FIELD_PLAIN_DICTS = env.bool('JSON_FIELD_PLAIN_DICTS', default=False)
+
+# Published schemas kept in each process (see apps/filemetadata/schema_registry.py).
+# Changes are broadcast through the django_redis cache's Redis, when there is one.
+SCHEMA_REGISTRY_MAX_AGE = env.int('SCHEMA_REGISTRY_MAX_AGE', default=3600)  # seconds
+SCHEMA_REGISTRY_CACHE_ALIAS = 'default'
+
+# Seconds clients/proxies may cache schema responses (see apps/filemetadata/http_caching.py).
+# Published versions are "immutable"; the latest version and the list are revalidated.
+SCHEMA_VERSION_MAX_AGE = env.int('SCHEMA_VERSION_MAX_AGE', default=31536000)
+SCHEMA_LATEST_MAX_AGE = env.int('SCHEMA_LATEST_MAX_AGE', default=60)
+SCHEMA_LIST_MAX_AGE = env.int('SCHEMA_LIST_MAX_AGE', default=60)
+
+# Rendered schema list pages (and unpublished schemas) shared by the workers through
+# this cache until a schema is saved (see apps/filemetadata/response_cache.py)
+SCHEMA_RESPONSE_CACHE_ALIAS = 'default'
+SCHEMA_RESPONSE_CACHE_TTL = env.int('SCHEMA_RESPONSE_CACHE_TTL', default=300)  # seconds
+
+# Default strategy of "manage.py partition_filemetadata", the only way the
+# FileMetadata table is partitioned (PostgreSQL 11+): "installation" or
+# "datafile_hash" (see apps/filemetadata/partitioning.py)
+FILEMETADATA_PARTITION_BY = env('FILEMETADATA_PARTITION_BY', default='installation')
+FILEMETADATA_PARTITION_COUNT = env.int('FILEMETADATA_PARTITION_COUNT', default=16)
+
+# FileMetadata versions stored in full, the others as JSON Patches (see apps/filemetadata/metadata_history.py)
+FILEMETADATA_SNAPSHOT_INTERVAL = env.int('FILEMETADATA_SNAPSHOT_INTERVAL', default=10)
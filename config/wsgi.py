@@ -29,6 +29,11 @@ os.environ.setdefault("DJANGO_SETTINGS_MODULE", "config.settings.production")
 # file. This includes Django's development server, if the WSGI_APPLICATION
 # setting points here.
 application = get_wsgi_application()
+
+# Load the published schemas once per worker
+from apps.filemetadata.schema_registry import warm_schema_registry
+warm_schema_registry()
+
 if os.environ.get('DJANGO_SETTINGS_MODULE') == 'config.settings.production':
     application = Sentry(application)
 # Apply WSGI middleware here.
@@ -0,0 +1,28 @@
+"""
+WSGI config for the schema API of the Metadata Schema Service.
+
+A lightweight application serving only the schema GETs and validation
+(see apps/filemetadata/api_handler.py), without the full site's
+middleware or per-request transactions.  Run it next to config/wsgi.py,
+which keeps serving everything else, e.g. the admin:
+
+    gunicorn config.wsgi_api -b 0.0.0.0:5001
+
+and send /api/metadata/schema* to it (see compose/nginx/nginx.conf).
+"""
+import os
+
+if os.environ.get('DJANGO_SETTINGS_MODULE') == 'config.settings.production':
+    from raven.contrib.django.raven_compat.middleware.wsgi import Sentry
+
+os.environ.setdefault("DJANGO_SETTINGS_MODULE", "config.settings.production")
+
+from apps.filemetadata.api_handler import get_schema_api_application
+application = get_schema_api_application()
+
+# Load the published schemas once per worker
+from apps.filemetadata.schema_registry import warm_schema_registry
+warm_schema_registry()
+
+if os.environ.get('DJANGO_SETTINGS_MODULE') == 'config.settings.production':
+    application = Sentry(application)